@@ -0,0 +1,197 @@
+import asyncio
+import contextvars
+import functools
+import time
+import weakref
+from collections import OrderedDict, deque
+
+from config import tracker_rate, tracker_burst
+from metrics import admission_wait
+
+# Классы запросов в порядке приоритета: ответы на команды пользователя, затем фоновые опросы подписок.
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+CLASSES = (INTERACTIVE, BACKGROUND)
+# Класс запросов текущей задачи. Обработчики команд работают с классом по умолчанию,
+# опросы подписок помечаются декоратором background.
+request_class = contextvars.ContextVar('request_class', default=INTERACTIVE)
+
+
+def background(function):
+    """
+    Декоратор корутины: все запросы к трекеру внутри нее идут с фоновым приоритетом.
+    """
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        token = request_class.set(BACKGROUND)
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            request_class.reset(token)
+    return wrapper
+
+
+class _Queues:
+    """
+    Очереди ожидающих запросов одного event loop: для каждого класса - очереди пользователей в порядке обхода.
+    """
+
+    def __init__(self):
+        self.users = {name: OrderedDict() for name in CLASSES}
+        self.pending = dict.fromkeys(CLASSES, 0)
+        self.dispatcher = None
+        # Ожидающие запросы по задачам, которые их поставили: задача -> (класс, пользователь, запись очереди).
+        self.tasks = {}
+
+    def move(self, task, name: str):
+        """
+        Переносит ожидающий запрос задачи task в очередь класса name того же пользователя.
+        """
+        waiting = self.tasks.get(task)
+        if waiting is None:
+            return
+        current, user, entry = waiting
+        waiters = self.users[current].get(user)
+        if current == name or waiters is None or entry not in waiters:
+            return
+        waiters.remove(entry)
+        if not waiters:
+            del self.users[current][user]
+        self.pending[current] -= 1
+        self.users[name].setdefault(user, deque()).append(entry)
+        self.pending[name] += 1
+        self.tasks[task] = (name, user, entry)
+
+    def pop(self):
+        """
+        Следующий ожидающий запрос: из старшего непустого класса, у пользователя, чья очередь подошла.
+        Пользователь, у которого остались запросы, уходит в конец обхода, поэтому каждый получает
+        одинаковую долю бюджета, сколько бы запросов он ни поставил.
+        """
+        for name in CLASSES:
+            users = self.users[name]
+            while users:
+                user, waiters = next(iter(users.items()))
+                waiter, queued_at = waiters.popleft()
+                self.pending[name] -= 1
+                if waiters:
+                    users.move_to_end(user)
+                else:
+                    del users[user]
+                # Ожидавший запрос мог быть отменен: разрешение ему не нужно.
+                if not waiter.done():
+                    return name, waiter, queued_at
+        return None
+
+
+class AdmissionController:
+    """
+    Допуск запросов к трекеру в пределах общего бюджета: rate запросов в секунду, не больше burst подряд.
+    Пока бюджета хватает и очередь пуста, запрос проходит сразу. Иначе он ждет в очереди: запросы команд
+    пользователя обслуживаются раньше фоновых опросов, а внутри класса пользователи обслуживаются по кругу,
+    по одному запросу за раз, чтобы один пользователь с множеством запросов не занимал весь бюджет.
+    rate 0 отключает ограничение.
+    """
+
+    def __init__(self, rate: float = tracker_rate, burst: float = tracker_burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.admitted = dict.fromkeys(CLASSES, 0)
+        self.queued = dict.fromkeys(CLASSES, 0)
+        # Future ожидающих привязаны к event loop, поэтому очереди у каждого loop свои. Бюджет общий.
+        self._loops = {}
+        # Задачи, запросы которых подняты до старшего класса (см. promote).
+        self._promoted = weakref.WeakKeyDictionary()
+
+    def pending(self, name: str = None) -> int:
+        """
+        Число ожидающих запросов класса name или всех классов.
+        """
+        return sum(queues.pending[name] if name else sum(queues.pending.values())
+                   for queues in self._loops.values())
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _admit(self, name: str, queued_at: float):
+        self.admitted[name] += 1
+        admission_wait.observe_key((name,), time.monotonic() - queued_at)
+
+    def promote(self, task, name: str):
+        """
+        Поднимает запросы задачи task до класса name, если он старше их класса: и уже ожидающий допуска,
+        и следующие. Так команда пользователя, дождавшаяся общего запроса фонового опроса, не ждет в очереди опросов.
+        """
+        if task is None or CLASSES.index(name) >= CLASSES.index(self._promoted.get(task, CLASSES[-1])):
+            return
+        self._promoted[task] = name
+        for queues in self._loops.values():
+            queues.move(task, name)
+
+    def _class(self, task) -> str:
+        name = request_class.get()
+        promoted = self._promoted.get(task) if task is not None else None
+        if promoted is not None and CLASSES.index(promoted) < CLASSES.index(name):
+            return promoted
+        return name
+
+    async def acquire(self, user):
+        """
+        Ждет разрешения на запрос к трекеру. user - ключ пользователя для справедливой очереди,
+        например заголовок авторизации. Класс запроса берется из request_class, если задачу не подняли promote.
+        """
+        task = asyncio.current_task()
+        name = self._class(task)
+        if not self.rate:
+            self.admitted[name] += 1
+            return
+        loop = asyncio.get_running_loop()
+        queues = self._loops.get(loop)
+        self._refill()
+        if queues is None and self.tokens >= 1:
+            self.tokens -= 1
+            self._admit(name, time.monotonic())
+            return
+        if queues is None:
+            queues = self._loops[loop] = _Queues()
+        waiter = loop.create_future()
+        entry = (waiter, time.monotonic())
+        queues.users[name].setdefault(user, deque()).append(entry)
+        queues.pending[name] += 1
+        queues.tasks[task] = (name, user, entry)
+        self.queued[name] += 1
+        if queues.dispatcher is None:
+            queues.dispatcher = asyncio.ensure_future(self._dispatch(loop, queues))
+        try:
+            await waiter
+        finally:
+            queues.tasks.pop(task, None)
+
+    async def _dispatch(self, loop, queues: _Queues):
+        """
+        Раздает разрешения ожидающим запросам этого loop по мере пополнения бюджета.
+        """
+        try:
+            while True:
+                self._refill()
+                if self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    continue
+                turn = queues.pop()
+                if turn is None:
+                    return
+                name, waiter, queued_at = turn
+                self.tokens -= 1
+                self._admit(name, queued_at)
+                waiter.set_result(None)
+        finally:
+            # Очередь опустела или loop останавливается: следующие запросы снова проходят напрямую.
+            del self._loops[loop]
+            for users in queues.users.values():
+                for waiters in users.values():
+                    for waiter, _ in waiters:
+                        waiter.cancel()
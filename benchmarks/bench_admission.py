@@ -0,0 +1,54 @@
+"""
+Допуск запросов к трекеру при исчерпанном бюджете: общая очередь по порядку прихода (delivery.TokenBucket)
+против AdmissionController. Один пользователь ставит пачку фоновых запросов, затем остальные пользователи
+отправляют по одной команде, как /status. Замеряется ожидание команд и время, за которое обслужены все запросы.
+
+Запуск из корня репозитория: python -m benchmarks.bench_admission --rate 200 --flood 400 --users 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from admission import AdmissionController, BACKGROUND, request_class
+from delivery import TokenBucket
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def scenario(acquire, flood: int, users: int):
+    async def poll():
+        request_class.set(BACKGROUND)
+        await acquire('noisy')
+
+    async def command(user):
+        started = time.perf_counter()
+        await acquire(user)
+        return time.perf_counter() - started
+    started = time.perf_counter()
+    polls = [asyncio.ensure_future(poll()) for _ in range(flood)]
+    await asyncio.sleep(0)
+    waits = await asyncio.gather(*(command(user) for user in range(users)))
+    await asyncio.gather(*polls)
+    return waits, time.perf_counter() - started
+
+
+def main(rate: float, flood: int, users: int):
+    bucket = TokenBucket(rate)
+    controller = AdmissionController(rate=rate, burst=1)
+    for name, acquire in (('fifo', lambda user: bucket.acquire()), ('admission', controller.acquire)):
+        waits, total = asyncio.run(scenario(acquire, flood, users))
+        print(f'{name:9} command wait p50={statistics.median(waits) * 1e3:8.1f} ms '
+              f'p99={percentile(waits, 0.99) * 1e3:8.1f} ms | all requests done in {total:.2f} s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=float, default=200)
+    parser.add_argument('--flood', type=int, default=400, help='фоновых запросов шумного пользователя')
+    parser.add_argument('--users', type=int, default=50, help='пользователей с командой')
+    args = parser.parse_args()
+    main(args.rate, args.flood, args.users)
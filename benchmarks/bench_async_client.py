@@ -0,0 +1,65 @@
+"""
+Сравнивает задержку обработчиков при блокирующих и асинхронных запросах к трекеру.
+
+Каждый "пользователь" - корутина, которая как обработчик /status запрашивает свои задачи.
+Заглушка трекера отвечает с фиксированной задержкой.
+
+Запуск из корня репозитория: python -m benchmarks.bench_async_client --users 100 --latency 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import requests
+
+import yandex_api_connector as yac
+from tests.stub_tracker import StubTracker, make_issue
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def blocking_handler(token: str, session: requests.Session):
+    # Так работали обработчики до перехода на асинхронный клиент: запрос блокирует весь loop.
+    headers = {'Authorization': f'OAuth {token}'}
+    session.get(yac.api_url + 'myself', headers=headers)
+    session.get(yac.api_url + 'issues', headers=headers).json()
+
+
+async def async_handler(token: str):
+    await yac.get_issues_async(token)
+
+
+async def measure(users: int, handler) -> list:
+    # Все обновления приходят одновременно, поэтому задержка считается от общего момента старта.
+    started = time.perf_counter()
+
+    async def timed():
+        await handler()
+        return time.perf_counter() - started
+
+    return await asyncio.gather(*(timed() for _ in range(users)))
+
+
+async def main(users: int, latency: float, issues: int):
+    with StubTracker(issues=[make_issue(n) for n in range(issues)], latency=latency) as stub:
+        yac.api_url = stub.url
+        session = requests.Session()
+        for name, handler in (('blocking', lambda: blocking_handler(stub.token, session)),
+                              ('async', lambda: async_handler(stub.token))):
+            latencies = await measure(users, handler)
+            print(f'{name:>8}: users={users} p50={statistics.median(latencies) * 1000:.1f}ms '
+                  f'p99={percentile(latencies, 0.99) * 1000:.1f}ms max={max(latencies) * 1000:.1f}ms')
+        await yac.close_session()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--issues', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.latency, args.issues))
@@ -0,0 +1,60 @@
+"""
+Цикл опроса очереди в командном режиме (все открытые задачи заново) против режима ленты изменений
+(только задачи, измененные с прошлого цикла). За цикл в заглушке трекера меняется changes задач.
+Замеряются запросы к трекеру и время обновления индекса за цикл.
+
+Запуск из корня репозитория: python -m benchmarks.bench_change_feed --issues 20000 --changes 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+import yandex_api_connector as yac
+from admission import AdmissionController
+from change_feed import ChangeFeed
+from circuit_breaker import CircuitBreaker
+from config import tz
+from team_mode import TeamPoller
+from tests.stub_tracker import StubTracker, make_issue
+
+
+async def cycles(tracker, poller, count: int, changes: int, users: int) -> tuple:
+    await poller.refresh()
+    tracker.requests.clear()
+    durations = []
+    for _ in range(count):
+        for issue in random.sample(tracker.issues, changes):
+            login = f'user-{random.randrange(users)}'
+            tracker.touch(issue['key'], assignee={'id': login, 'display': login})
+        started = time.perf_counter()
+        await poller.refresh()
+        durations.append(time.perf_counter() - started)
+    await yac.close_session()
+    return sum(tracker.requests.values()) / count, sum(durations) / count
+
+
+def main(issues: int, users: int, changes: int, count: int):
+    old = (datetime.now(tz) - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S.000+0300')
+    raw = [make_issue(number, assignee={'id': f'user-{number % users}', 'display': 'user'}, updatedAt=old)
+           for number in range(issues)]
+    for name, make_poller in (('team', lambda: TeamPoller(token='service-token', ttl=0)),
+                              ('changelog', lambda: ChangeFeed(token='service-token', ttl=0))):
+        random.seed(0)
+        with StubTracker(issues=[dict(issue) for issue in raw], users={'service-token': 'robot'}) as tracker:
+            yac.api_url = tracker.url
+            yac.breaker = CircuitBreaker()
+            yac.admission = AdmissionController(rate=0)
+            requests, duration = asyncio.run(cycles(tracker, make_poller(), count, changes, users))
+        print(f'{name:9} requests/cycle={requests:6.1f}  refresh={duration * 1e3:9.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--changes', type=int, default=20, help='измененных задач за цикл')
+    parser.add_argument('--cycles', type=int, default=5)
+    args = parser.parse_args()
+    main(args.issues, args.users, args.changes, args.cycles)
@@ -0,0 +1,40 @@
+"""
+Нагрузочный тест очереди доставки на заглушке Bot.
+
+Каждый чат получает пачку задач. Сравнивается число вызовов api Telegram при отправке по одной задаче
+и через DeliveryQueue, а также реальная пропускная способность очереди при лимитах Telegram.
+
+Запуск из корня репозитория: python -m benchmarks.bench_delivery --chats 100 --issues 40
+"""
+import argparse
+import asyncio
+import time
+
+from delivery import DeliveryQueue
+from tests.fake_bot import FakeBot
+
+
+async def main(chats: int, issues: int, latency: float, global_rate: float, chat_rate: float):
+    texts = [f'*Наименование задачи*: задача {n}\n*Дедлайн*: 12:00:00 01.01.2021 (MSK)\n'
+             f'*До сгорания осталось*: 3 ч. 59 мин. 59 сек.' for n in range(issues)]
+    bot = FakeBot(latency=latency)
+    delivery = DeliveryQueue(bot, global_rate=global_rate, chat_rate=chat_rate)
+    started = time.perf_counter()
+    await asyncio.gather(*(delivery.send(chat_id, texts) for chat_id in range(chats)))
+    await delivery.close()
+    elapsed = time.perf_counter() - started
+    print(f'chats={chats} issues/chat={issues} limits={global_rate:g}/s global, {chat_rate:g}/s per chat')
+    print(f'api calls: one per issue={chats * issues} packed={len(bot.sent)}')
+    print(f'elapsed={elapsed:.2f}s messages/s={len(bot.sent) / elapsed:.1f} '
+          f'issues/s={chats * issues / elapsed:.1f} retried={delivery.retried} failed={delivery.failed}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--issues', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--global-rate', type=float, default=30)
+    parser.add_argument('--chat-rate', type=float, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.chats, args.issues, args.latency, args.global_rate, args.chat_rate))
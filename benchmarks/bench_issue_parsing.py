@@ -0,0 +1,76 @@
+"""
+Микробенчмарк разбора задач: прежняя схема (strptime в фильтре и еще раз в get_list_issues,
+astimezone/strftime при форматировании) против однократного разбора в записи Issue.
+
+Запуск из корня репозитория: python -m benchmarks.bench_issue_parsing --issues 10000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import yandex_api_connector as yac
+from config import time_format, tz, comfortable_format, time_remain
+from issues import parse_time
+from tests.stub_tracker import make_issue
+
+
+def legacy(raw_issues: list):
+    # Копия прежнего кода: фильтр по времени, сборка словарей и вычисления из send_issues.
+    period_start = datetime.now(tz) - timedelta(minutes=20)
+    filtered = list(filter(
+        lambda x: (
+            datetime.strptime(x['createdAt'], time_format) >= period_start or
+            datetime.strptime(x['updatedAt'], time_format) >= period_start or
+            datetime.strptime(x['sla'][0]['failAt'], time_format) - timedelta(hours=4) <=
+            datetime.now(tz) <=
+            datetime.strptime(x['sla'][0]['failAt'], time_format) - timedelta(minutes=210)),
+        raw_issues))
+    tasks = [{'issue': issue['summary'],
+              'deadline': datetime.strptime(issue['sla'][0]['failAt'], time_format),
+              'warnAt': datetime.strptime(issue['sla'][0]['warnAt'], time_format)} for issue in filtered]
+    for task in tasks:
+        task['deadline'].astimezone(tz) - timedelta(hours=4) <= datetime.now(tz)
+        datetime.strftime(task['deadline'].astimezone(tz), comfortable_format)
+        time_remain(task['deadline'])
+    return tasks
+
+
+def current(raw_issues: list):
+    tasks = yac.latest_issues(yac.get_list_issues(raw_issues))
+    now = datetime.now(tz)
+    for task in tasks:
+        task.is_hot(now)
+        task.deadline_text
+        time_remain(task.deadline, now)
+    return tasks
+
+
+def measure(func, raw_issues: list, repeat: int) -> float:
+    # Первый прогон соответствует первому опросу, следующие - повторным опросам тех же задач.
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(raw_issues)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(count: int, repeat: int):
+    raw_issues = [make_issue(n, fail_in=timedelta(minutes=n)) for n in range(count)]
+    for issue in raw_issues:
+        issue['sla'] = issue['sla'][:1]
+    assert len(legacy(raw_issues)) == len(current(raw_issues))
+    parse_time.cache_clear()
+    first = measure(current, raw_issues, 1)
+    old = measure(legacy, raw_issues, repeat)
+    new = measure(current, raw_issues, repeat)
+    print(f'issues={count} legacy={old * 1000:.1f}ms issue_record: first poll={first * 1000:.1f}ms '
+          f'repeated polls={new * 1000:.1f}ms speedup={old / first:.1f}x/{old / new:.1f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(args.issues, args.repeat)
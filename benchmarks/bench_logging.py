@@ -0,0 +1,81 @@
+"""
+Стоимость логирования в event loop под нагрузкой 1000 сообщений в секунду.
+
+legacy - прежняя настройка: синхронная запись с сериализацией в JSON, ротация по 50 KB и сжатие zip
+в потоке вызывающего. pipeline - BatchingFileSink из logging_setup. Замеряются время одного вызова logger.info
+и опоздание тикера event loop (насколько дольше положенного спит asyncio.sleep).
+
+Запуск из корня репозитория: python -m benchmarks.bench_logging --rate 1000 --duration 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from loguru import logger
+
+from logging_setup import BatchingFileSink
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def load(rate: int, duration: float) -> tuple:
+    calls, lags = [], []
+    stop = time.perf_counter() + duration
+
+    async def ticker():
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - started - 0.005)
+
+    async def producer():
+        # Пачки по 10 сообщений каждые 10 мс дают rate сообщений в секунду при rate=1000.
+        batch = max(1, rate // 100)
+        number = 0
+        while time.perf_counter() < stop:
+            for _ in range(batch):
+                started = time.perf_counter()
+                logger.info(f"Опрос трекера для чата {number % 1000}: получено задач {number % 50}")
+                calls.append(time.perf_counter() - started)
+                number += 1
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(ticker(), producer())
+    return calls, lags
+
+
+def run(mode: str, rate: int, duration: float):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'logs.json')
+        sink = None
+        if mode == 'legacy':
+            handler = logger.add(path, format='{time} {level} {message}', level='INFO', rotation='50 KB',
+                                 compression='zip', serialize=True)
+        else:
+            sink = BatchingFileSink(path)
+            handler = logger.add(sink.write, level='INFO', format='{message}')
+        calls, lags = asyncio.run(load(rate, duration))
+        logger.remove(handler)
+        if sink is not None:
+            sink.close()
+        files = len(os.listdir(directory))
+    print(f'{mode:8} messages={len(calls)} call p50={statistics.median(calls) * 1e6:.1f}us '
+          f'p99={percentile(calls, 0.99) * 1e6:.1f}us max={max(calls) * 1e3:.2f}ms | '
+          f'loop lag p99={percentile(lags, 0.99) * 1e3:.2f}ms max={max(lags) * 1e3:.2f}ms | files={files}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=5)
+    args = parser.parse_args()
+    # Вывод в консоль измеряется отдельно от файлового лога.
+    logger.remove()
+    for mode in ('legacy', 'pipeline'):
+        run(mode, args.rate, args.duration)
@@ -0,0 +1,84 @@
+"""
+Накладные расходы метрик и трассировки.
+
+Сначала замеряется стоимость самой обвязки (measure + счетчик статусов) в пустом цикле, затем - реальная
+длительность инструментированных вызовов на заглушке трекера. Накладные расходы считаются как доля
+стоимости обвязки от длительности вызова. Для разбора задач дополнительно сравнивается вызов с декоратором
+и без него. latency - задержка ответа заглушки: у настоящего трекера это десятки миллисекунд,
+с --latency 0 получается заведомо худший случай запросов по loopback.
+
+Запуск из корня репозитория: python -m benchmarks.bench_metrics --calls 300 --latency 0.01
+"""
+import argparse
+import asyncio
+import time
+
+import yandex_api_connector as yac
+from issue_cache import IssueCache
+from metrics import measure, tracker_responses
+from token_cache import TokenCache
+from tests.stub_tracker import StubTracker, make_issue
+
+
+def instrumentation_cost(iterations: int = 100000) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with measure('bench'):
+            pass
+        tracker_responses.inc(call='bench', status=200)
+    return (time.perf_counter() - started) / iterations
+
+
+async def timed_calls(calls: int, token: str) -> dict:
+    headers = {'Authorization': f'OAuth {token}'}
+    results = {}
+    started = time.perf_counter()
+    for _ in range(calls):
+        # Без кэша токенов каждый вызов проверяет токен запросом к трекеру.
+        yac.token_cache = TokenCache(ttl=0)
+        await yac.get_headers_async(token)
+    results['get_headers'] = (time.perf_counter() - started) / calls
+    started = time.perf_counter()
+    for _ in range(calls):
+        await yac.load_user_issues(headers, cache=False)
+    results['get_user_issues'] = (time.perf_counter() - started) / calls
+    await yac.close_session()
+    return results
+
+
+def parse_cost(raw: list, calls: int, function) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        function(raw)
+    return (time.perf_counter() - started) / calls
+
+
+def main(calls: int, issues: int, latency: float):
+    raw = [make_issue(number) for number in range(issues)]
+    for issue in raw:
+        issue['sla'] = issue['sla'][:1]
+    cost = instrumentation_cost()
+    print(f'instrumentation cost per call: {cost * 1e6:.2f} us')
+
+    with StubTracker(issues=raw, latency=latency) as tracker:
+        yac.api_url = tracker.url
+        yac.issue_cache = IssueCache(ttl=0)
+        results = asyncio.run(timed_calls(calls, tracker.token))
+    instrumented = yac.get_list_issues.__wrapped__
+    # Прогрев кэша разбора времени, чтобы оба варианта были в равных условиях.
+    instrumented.__wrapped__(raw)
+    results['get_list_issues'] = parse_cost(raw, calls, instrumented)
+    bare = parse_cost(raw, calls, instrumented.__wrapped__)
+    for call, duration in results.items():
+        print(f'{call:16} {duration * 1000:8.3f} ms/call  overhead={cost / duration * 100:.3f}%')
+    print(f'get_list_issues with/without decorator: {results["get_list_issues"] * 1000:.3f} / '
+          f'{bare * 1000:.3f} ms ({(results["get_list_issues"] / bare - 1) * 100:+.2f}%)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=300)
+    parser.add_argument('--issues', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.01)
+    args = parser.parse_args()
+    main(args.calls, args.issues, args.latency)
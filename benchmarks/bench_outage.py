@@ -0,0 +1,93 @@
+"""
+Нагрузка на трекер и задержка /status во время сбоя.
+
+Подписчики опрашиваются планировщиком, заглушка трекера сначала работает, затем отвечает 503 с задержкой
+latency. Параллельно раз в 100 мс выполняется запрос как в /status. Режим off - предохранитель, который
+никогда не размыкается, и опросы без паузы после ошибок; on - настройки по умолчанию из config.
+Считаются запросы к трекеру за время сбоя и задержка /status.
+
+Запуск из корня репозитория: python -m benchmarks.bench_outage --users 200 --duration 6
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import yandex_api_connector as yac
+from admission import AdmissionController
+from circuit_breaker import CircuitBreaker
+from issue_cache import IssueCache
+from scheduler import SubscriptionScheduler
+from token_cache import TokenCache
+from tests.stub_tracker import StubTracker, make_issue
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def poll(subscription):
+    pages = await yac.get_issue_pages_async(subscription.token)
+    if pages is None:
+        return yac.tracker_backoff() or 0.0
+    async for _ in pages:
+        pass
+    return yac.tracker_backoff()
+
+
+async def status_latency(token: str, stop: float) -> list:
+    latencies = []
+    while time.perf_counter() < stop:
+        started = time.perf_counter()
+        pages = await yac.get_issue_pages_async(token)
+        if pages is not None:
+            async for _ in pages:
+                pass
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.1)
+    return latencies
+
+
+async def scenario(tracker: StubTracker, users: int, duration: float, interval: float, latency: float,
+                   backoff: bool):
+    scheduler = SubscriptionScheduler(poll, interval=interval, workers=50,
+                                      max_backoff=30 if backoff else interval)
+    for chat_id in range(users):
+        scheduler.subscribe(chat_id, tracker.token)
+    await scheduler.start()
+    # Первый период трекер работает, и кэш заполняется.
+    await asyncio.sleep(interval)
+    # Деградировавший трекер отвечает медленно и с ошибкой.
+    tracker.error = 503
+    tracker.latency = latency
+    tracker.requests.clear()
+    latencies = await status_latency(tracker.token, time.perf_counter() + duration)
+    requests = sum(tracker.requests.values())
+    await scheduler.stop()
+    await yac.close_session()
+    return requests, latencies
+
+
+def run(mode: str, users: int, duration: float, interval: float, latency: float):
+    with StubTracker(issues=[make_issue(number) for number in range(20)]) as tracker:
+        yac.api_url = tracker.url
+        yac.token_cache = TokenCache()
+        yac.issue_cache = IssueCache(ttl=interval / 2)
+        yac.breaker = CircuitBreaker() if mode == 'on' else CircuitBreaker(min_calls=10 ** 9)
+        # Сравнивается только предохранитель: бюджет запросов не ограничен.
+        yac.admission = AdmissionController(rate=0)
+        requests, latencies = asyncio.run(scenario(tracker, users, duration, interval, latency, mode == 'on'))
+    print(f'{mode:4} tracker requests during outage={requests:6} ({requests / duration:8.1f}/s) | '
+          f'/status p50={statistics.median(latencies) * 1e3:7.2f}ms p99={percentile(latencies, 0.99) * 1e3:7.2f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=6)
+    parser.add_argument('--interval', type=float, default=1)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+    for mode in ('off', 'on'):
+        run(mode, args.users, args.duration, args.interval, args.latency)
@@ -0,0 +1,68 @@
+"""
+Форматирование задач для отправки: прежний issue_text (emojize и вложенные md.text на каждую задачу)
+против IssueRenderer. Для рендерера замеряются первый проход (кэш пуст) и повторный (как в следующем
+опросе или /status, когда задачи не изменились и пересчитывается только оставшееся время).
+
+Запуск из корня репозитория: python -m benchmarks.bench_rendering --issues 100000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import aiogram.utils.markdown as md
+from aiogram.utils.emoji import emojize
+
+from config import time_remain, tz
+from rendering import IssueRenderer
+from tests.stub_tracker import parsed_issue
+
+
+def legacy_text(task, now) -> str:
+    # Копия прежнего issue_text.
+    if task.is_hot(now):
+        return md.text(
+            md.text(f'{emojize(":red_exclamation_mark:" * 3)}'
+                    f'Эта задача в огне!'
+                    f'{emojize(":red_exclamation_mark:" * 3)}'),
+            md.text(f'*Наименование задачи*: {task.summary}'),
+            md.text(f'{emojize(":fire:" * 3)}'
+                    f'*Дедлайн*: '
+                    f'{task.deadline_text}'),
+            md.text(f'*До сгорания осталось*: {time_remain(task.deadline, now)}'),
+            sep='\n',
+        )
+    return md.text(
+        md.text(f'*Наименование задачи*: {task.summary}'),
+        md.text(f'*Дедлайн*: {task.deadline_text}'),
+        md.text(f'*До сгорания осталось*: {time_remain(task.deadline, now)}'),
+        sep='\n',
+    )
+
+
+def measure(function, tasks: list) -> float:
+    now = datetime.now(tz)
+    started = time.perf_counter()
+    for task in tasks:
+        function(task, now)
+    return time.perf_counter() - started
+
+
+def main(issues: int):
+    # Каждая пятая задача горящая.
+    tasks = [parsed_issue(number, fail_in=timedelta(hours=2 if number % 5 == 0 else 10)) for number in range(issues)]
+    renderer = IssueRenderer(max_entries=issues)
+    results = {
+        'legacy': measure(legacy_text, tasks),
+        'renderer cold': measure(renderer.render, tasks),
+        'renderer warm': measure(renderer.render, tasks),
+    }
+    for name, duration in results.items():
+        print(f'{name:14} {duration:7.3f} s  {duration / issues * 1e6:6.2f} us/issue  '
+              f'x{results["legacy"] / duration:.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--issues', type=int, default=100000)
+    args = parser.parse_args()
+    main(args.issues)
@@ -0,0 +1,98 @@
+"""
+Время запуска бота: импорт telegram_bot_logic и путь от импорта до готового диспетчера
+(Bot, хранилище диалогов, обработчики). Каждый замер - в отдельном процессе с холодными модулями.
+Отдельно проверяется, что общие модули (коннектор трекера) импортируются без aiogram.
+
+Результаты сравниваются с базовым уровнем baseline.json["startup"]: медианы могут вырасти
+не больше чем на tolerance. При регрессии бенчмарк завершается с кодом 1.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_startup --runs 10
+    python -m benchmarks.bench_startup --update-baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def child() -> dict:
+    """
+    Один замер запуска. Выполняется в отдельном процессе.
+    """
+    os.environ.setdefault('TELEGRAM_TOKEN', '123456:' + 'A' * 35)
+    started = time.perf_counter()
+    import yandex_api_connector  # noqa: F401
+    connector = time.perf_counter()
+    connector_aiogram = 'aiogram' in sys.modules
+    import telegram_bot_logic as bot
+    imported = time.perf_counter()
+    from dataclasses import replace
+    from config import settings
+    bot.create_app(replace(settings, fsm_storage='memory')).dp
+    ready = time.perf_counter()
+    return {'connector_ms': round((connector - started) * 1000, 3),
+            'import_ms': round((imported - started) * 1000, 3),
+            'ready_ms': round((ready - started) * 1000, 3),
+            'connector_aiogram': connector_aiogram}
+
+
+def run(runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_startup', '--child'],
+                                check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+    results = {metric: round(statistics.median(sample[metric] for sample in samples), 3)
+               for metric in ('connector_ms', 'import_ms', 'ready_ms')}
+    results['connector_aiogram'] = any(sample['connector_aiogram'] for sample in samples)
+    return results
+
+
+def main(runs: int, baseline_path: str, update: bool, tolerance: float) -> int:
+    results = run(runs)
+    print(f'connector={results["connector_ms"]:8.1f} ms  import={results["import_ms"]:8.1f} ms  '
+          f'ready={results["ready_ms"]:8.1f} ms  aiogram in connector: {results["connector_aiogram"]}')
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+    if update:
+        baseline['startup'] = results
+        with open(baseline_path, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f'Базовый уровень сохранен в {baseline_path}')
+        return 0
+    base = baseline.get('startup')
+    if base is None:
+        print('Базовый уровень не найден, сравнение пропущено')
+        return 0
+    found = []
+    for metric in ('connector_ms', 'import_ms', 'ready_ms'):
+        # Запас 5 мс - на шум запуска интерпретатора.
+        if results[metric] > base[metric] * (1 + tolerance) + 5:
+            found.append(f'startup {metric} {results[metric]} > {base[metric]}')
+    if results['connector_aiogram'] and not base['connector_aiogram']:
+        found.append('startup: коннектор трекера снова импортирует aiogram')
+    for line in found:
+        print(f'РЕГРЕССИЯ: {line}')
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10, help='число запусков, сравниваются медианы')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='допустимый рост времени, доля')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(child()))
+        sys.exit(0)
+    sys.exit(main(args.runs, args.baseline, args.update_baseline, args.tolerance))
@@ -0,0 +1,92 @@
+"""
+Сравнение режимов long polling и webhook на локальной заглушке Bot API.
+
+В обоих режимах бот отвечает эхом на каждое сообщение. Задержка - время от появления обновления
+(постановки в очередь getUpdates или отправки на webhook) до получения заглушкой ответа бота.
+
+Запуск из корня репозитория: python -m benchmarks.bench_webhook --updates 2000 --handler-latency 0.05
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from tests.fake_telegram import FakeTelegram, make_update, post_updates
+from webhook import make_app
+
+
+TOKEN = '123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+def make_dispatcher(fake: FakeTelegram, handler_latency: float) -> Dispatcher:
+    dp = Dispatcher(Bot(TOKEN, server=TelegramAPIServer.from_base(fake.url)), storage=MemoryStorage())
+
+    @dp.message_handler()
+    async def echo(message: types.Message):
+        # Имитация обращения к трекеру внутри обработчика.
+        await asyncio.sleep(handler_latency)
+        await message.answer(message.text)
+    return dp
+
+
+async def wait_sent(fake: FakeTelegram, count: int):
+    while len(fake.sent) < count:
+        await asyncio.sleep(0.005)
+
+
+async def run_polling(fake: FakeTelegram, dp: Dispatcher, updates: list) -> dict:
+    Bot.set_current(dp.bot)
+    polling = asyncio.ensure_future(dp.start_polling(timeout=1, relax=0))
+    started = {}
+    for update in updates:
+        started[update['message']['text']] = time.monotonic()
+        fake.push(update)
+    await wait_sent(fake, len(updates))
+    dp.stop_polling()
+    await asyncio.gather(polling, return_exceptions=True)
+    return started
+
+
+async def run_webhook(fake: FakeTelegram, dp: Dispatcher, updates: list, concurrency: int) -> dict:
+    server = TestServer(make_app(dp, url=None, concurrency=concurrency))
+    await server.start_server()
+    started = {update['message']['text']: time.monotonic() for update in updates}
+    async with ClientSession() as session:
+        await post_updates(session, str(server.make_url('/webhook')), updates, concurrency=concurrency)
+        await wait_sent(fake, len(updates))
+    await server.close()
+    return started
+
+
+async def main(mode: str, count: int, handler_latency: float, concurrency: int):
+    updates = [make_update(n, n % 500 + 1, f'msg {n}') for n in range(1, count + 1)]
+    async with FakeTelegram() as fake:
+        dp = make_dispatcher(fake, handler_latency)
+        begin = time.monotonic()
+        if mode == 'polling':
+            started = await run_polling(fake, dp, updates)
+        else:
+            started = await run_webhook(fake, dp, updates, concurrency)
+        elapsed = time.monotonic() - begin
+        latencies = sorted(sent_at - started[text] for _, text, sent_at in fake.sent)
+        await dp.bot.session.close()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f'{mode:8} updates={count} elapsed={elapsed:.2f}s updates/s={count / elapsed:.0f} '
+          f'p50={statistics.median(latencies) * 1000:.0f}ms p99={p99 * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=['polling', 'webhook', 'both'], default='both')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--handler-latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+    for mode in (['polling', 'webhook'] if args.mode == 'both' else [args.mode]):
+        asyncio.run(main(mode, args.updates, args.handler_latency, args.concurrency))
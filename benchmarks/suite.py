@@ -0,0 +1,241 @@
+"""
+Нагрузочный набор на заглушке трекера и заглушке Bot, без обращения к сети.
+
+Для каждого числа пользователей в отдельном процессе (чтобы RSS и кэши не смешивались) прогоняются сценарии:
+get_issues - все пользователи одновременно запрашивают задачи с холодными кэшами, как /status;
+get_latest_issues - следующий цикл после истечения кэша, задачи перепроверяются условными запросами;
+send_issues - форматирование и отправка задач каждому пользователю через очередь доставки;
+subscription_cycle - один полный цикл планировщика подписок с poll_subscription бота.
+Для сценария считаются задержка одного вызова (p50/p99) и число запросов к трекеру за цикл,
+для процесса - пиковый RSS.
+
+Каждый размер прогоняется repeat раз, и сравниваются медианы прогонов. Регрессией считается рост p50
+больше чем на tolerance и еще floor миллисекунд сверху (короткие сценарии шумят на миллисекунды),
+рост памяти больше чем на rss_tolerance и любой рост числа запросов за цикл. p99 одного прогона слишком
+шумный для проверки и только печатается. При регрессии набор завершается с кодом 1.
+
+Запуск из корня репозитория:
+    python -m benchmarks.suite --users 1,100,10000
+    python -m benchmarks.suite --update-baseline    # сохранить текущие результаты как базовые
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+ISSUES_PER_USER = 5
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def summary(latencies: list, requests: int) -> dict:
+    return {'p50_ms': round(statistics.median(latencies) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'requests': requests}
+
+
+async def timed_calls(calls) -> list:
+    """
+    Выполняет корутины одновременно и возвращает длительность каждой.
+    """
+    async def timed(coro):
+        started = time.perf_counter()
+        await coro
+        return time.perf_counter() - started
+    return await asyncio.gather(*(timed(coro) for coro in calls))
+
+
+async def scenarios(bot, tracker, tokens: list) -> dict:
+    import yandex_api_connector as yac
+    from delivery import DeliveryQueue
+    from issue_cache import IssueCache
+    from scheduler import SubscriptionScheduler
+    from tests.fake_bot import FakeBot
+
+    results = {}
+    chats = range(len(tokens))
+
+    def requests() -> int:
+        return sum(tracker.requests.values())
+
+    before = requests()
+    issues = {}
+
+    async def get_issues(chat_id, token):
+        issues[chat_id] = await yac.get_issues_async(token)
+    latencies = await timed_calls(get_issues(chat_id, token) for chat_id, token in zip(chats, tokens))
+    results['get_issues'] = summary(latencies, requests() - before)
+
+    # Кэш задач истек: следующий цикл перепроверяет записи условными запросами.
+    yac.issue_cache = IssueCache(ttl=0)
+    await timed_calls(yac.get_issues_async(token) for token in tokens)
+    before = requests()
+    latencies = await timed_calls(yac.get_latest_issues_async(token) for token in tokens)
+    results['get_latest_issues'] = summary(latencies, requests() - before)
+
+    # Лимиты Telegram не нужны: замеряется работа бота, а не ожидание в очереди.
+    bot.app.delivery = DeliveryQueue(FakeBot(), global_rate=1e9, chat_rate=1e9)
+    latencies = await timed_calls(bot.send_issues(chat_id, issues[chat_id]) for chat_id in chats)
+    await bot.app.delivery.close()
+    results['send_issues'] = summary(latencies, 0)
+
+    bot.app.delivery = DeliveryQueue(FakeBot(), global_rate=1e9, chat_rate=1e9)
+    durations = []
+    done = asyncio.Event()
+
+    async def poll(subscription):
+        started = time.perf_counter()
+        try:
+            return await bot.poll_subscription(subscription)
+        finally:
+            durations.append(time.perf_counter() - started)
+            # Каждая подписка опрашивается один раз за цикл.
+            scheduler.unsubscribe(subscription.chat_id)
+            if not len(scheduler):
+                done.set()
+    scheduler = SubscriptionScheduler(poll, interval=3600)
+    for chat_id, token in zip(chats, tokens):
+        scheduler.subscribe(chat_id, token, delay=random.uniform(0, 1))
+    before = requests()
+    await scheduler.start()
+    await done.wait()
+    await scheduler.stop()
+    await bot.app.delivery.close()
+    results['subscription_cycle'] = summary(durations, requests() - before)
+    await yac.close_session()
+    return results
+
+
+def child(users: int) -> dict:
+    """
+    Прогон сценариев для одного числа пользователей. Выполняется в отдельном процессе.
+    """
+    os.environ.setdefault('TELEGRAM_TOKEN', '123456:' + 'A' * 35)
+    os.environ['FSM_STORAGE'] = 'memory'
+    # Импорт модуля бота не настраивает лог и не создает Bot: сценарии собирают только нужные компоненты.
+    import telegram_bot_logic as bot
+    import yandex_api_connector as yac
+    from admission import AdmissionController
+    from circuit_breaker import CircuitBreaker
+    from issue_cache import IssueCache
+    from token_cache import TokenCache
+    from tests.stub_tracker import StubTracker, make_issue
+
+    random.seed(0)
+    tokens = [f'token-{user}' for user in range(users)]
+    raw = [make_issue(user * ISSUES_PER_USER + number, assignee={'id': f'user-{user}'})
+           for user in range(users) for number in range(ISSUES_PER_USER)]
+    with StubTracker(issues=raw, users={token: f'user-{user}' for user, token in enumerate(tokens)}) as tracker:
+        yac.api_url = tracker.url
+        yac.token_cache = TokenCache()
+        yac.issue_cache = IssueCache()
+        yac.breaker = CircuitBreaker()
+        # Бюджет запросов не ограничен: замеряется работа бота, а не ожидание допуска.
+        yac.admission = AdmissionController(rate=0)
+        # Компоненты бота создаются при первом обращении; это стоимость запуска, а не сценариев.
+        bot.app.renderer, bot.app.ledger
+        results = asyncio.run(scenarios(bot, tracker, tokens))
+    results['rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return results
+
+
+def run(users: int) -> dict:
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.suite', '--child', str(users)],
+                            check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def repeated(users: int, repeat: int) -> dict:
+    """
+    Медианы repeat прогонов в отдельных процессах. Число запросов берется наибольшее: оно не должно шуметь.
+    """
+    runs = [run(users) for _ in range(repeat)]
+    results = {'rss_mb': statistics.median(current['rss_mb'] for current in runs)}
+    for scenario in runs[0]:
+        if scenario == 'rss_mb':
+            continue
+        results[scenario] = {metric: round(statistics.median(current[scenario][metric] for current in runs), 3)
+                             for metric in ('p50_ms', 'p99_ms')}
+        results[scenario]['requests'] = max(current[scenario]['requests'] for current in runs)
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float, rss_tolerance: float, floor: float) -> list:
+    """
+    Список регрессий относительно базового уровня. Время сравнивается по p50 с запасом floor мс на шум таймеров.
+    """
+    found = []
+    for users, current in results.items():
+        base = baseline.get(users)
+        if base is None:
+            continue
+        for scenario, values in current.items():
+            if scenario == 'rss_mb':
+                if values > base['rss_mb'] * (1 + rss_tolerance):
+                    found.append(f'{users} users: rss {values} MB > {base["rss_mb"]} MB')
+                continue
+            if values['p50_ms'] > base[scenario]['p50_ms'] * (1 + tolerance) + floor:
+                found.append(f'{users} users: {scenario} p50_ms {values["p50_ms"]} > {base[scenario]["p50_ms"]}')
+            if values['requests'] > base[scenario]['requests']:
+                found.append(f'{users} users: {scenario} requests {values["requests"]} > '
+                             f'{base[scenario]["requests"]}')
+    return found
+
+
+def main(sizes: list, baseline_path: str, update: bool, tolerance: float, rss_tolerance: float, floor: float,
+         repeat: int) -> int:
+    results = {}
+    for users in sizes:
+        started = time.perf_counter()
+        results[str(users)] = current = repeated(users, repeat)
+        print(f'users={users} rss={current["rss_mb"]} MB ({time.perf_counter() - started:.1f} s)')
+        for scenario, values in current.items():
+            if scenario != 'rss_mb':
+                print(f'  {scenario:20} p50={values["p50_ms"]:9.3f} ms  p99={values["p99_ms"]:9.3f} ms  '
+                      f'requests/cycle={values["requests"]}')
+    if update:
+        baseline = {}
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as file:
+                baseline = json.load(file)
+        baseline.update(results)
+        with open(baseline_path, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f'Базовый уровень сохранен в {baseline_path}')
+        return 0
+    if not os.path.exists(baseline_path):
+        print('Базовый уровень не найден, сравнение пропущено')
+        return 0
+    with open(baseline_path) as file:
+        found = regressions(results, json.load(file), tolerance, rss_tolerance, floor)
+    for line in found:
+        print(f'РЕГРЕССИЯ: {line}')
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', default='1,100,10000', help='числа пользователей через запятую')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='допустимый рост p50, доля')
+    parser.add_argument('--floor', type=float, default=5.0, help='допустимый рост p50 сверх доли, мс')
+    parser.add_argument('--repeat', type=int, default=3, help='прогонов каждого размера, сравниваются медианы')
+    parser.add_argument('--rss-tolerance', type=float, default=0.25, help='допустимый рост памяти, доля')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        print(json.dumps(child(args.child)))
+        sys.exit(0)
+    sys.exit(main([int(users) for users in args.users.split(',')], args.baseline, args.update_baseline,
+                  args.tolerance, args.rss_tolerance, args.floor, args.repeat))
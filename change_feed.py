@@ -0,0 +1,117 @@
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from loguru import logger
+
+from config import YANDEX_TOKEN, poll_interval, changelog_resync, tz
+from issues import parse_time
+from query_builder import IssueFilter, compile_filter, default_filter
+from team_mode import TeamPoller
+from yandex_api_connector import build_changes_filter, get_headers_async, get_list_issues, iter_issue_entries
+
+
+class ChangeFeed(TeamPoller):
+    """
+    Режим ленты изменений. Как и в командном режиме, задачи очередей запрашиваются сервисным токеном
+    и раздаются подписчикам по исполнителю, но весь список открытых задач запрашивается только при первом
+    обновлении и раз в resync секунд. В остальных обновлениях для каждой очереди запрашиваются задачи,
+    измененные после ее курсора, и по ним правятся записи затронутых исполнителей в индексе.
+    Обновление без изменений стоит одного запроса с пустым ответом на очередь.
+    """
+
+    def __init__(self, token: str = YANDEX_TOKEN, issue_filter: IssueFilter = default_filter,
+                 ttl: float = poll_interval, resync: float = changelog_resync):
+        super().__init__(token, compile_filter(issue_filter, mine=False), ttl)
+        self.issue_filter = issue_filter
+        self.resync = resync
+        # Время изменения последней полученной задачи по очередям. Запрос изменений включает и сам курсор,
+        # поэтому задачи, измененные в ту же секунду, не теряются, а повторно полученные ничего не меняют.
+        self.cursors = {}
+        self.loaded_at = None
+        self.changes = 0
+        # Исполнитель каждой задачи индекса и задачи каждого исполнителя по ключу.
+        self._owners = {}
+        self._by_login = defaultdict(dict)
+
+    async def refresh(self) -> bool:
+        """
+        Применяет изменения задач с прошлого обновления или, если пора, заново загружает все открытые задачи.
+        Возвращает False при ошибке, тогда курсоры не сдвигаются и изменения будут запрошены повторно.
+        """
+        headers = await get_headers_async(self.token)
+        if headers is None:
+            logger.warning("Сервисный токен трекера невалиден. Режим ленты изменений не может получить задачи")
+            return False
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.resync:
+            loaded = await self._load(headers)
+        else:
+            loaded = await self._pull(headers)
+        if loaded:
+            self.fetched_at = time.monotonic()
+            self.refreshes += 1
+        return loaded
+
+    async def _load(self, headers: dict) -> bool:
+        # Курсоры ставятся на начало загрузки: изменения, сделанные во время нее, придут в следующем обновлении.
+        started = datetime.now(tz)
+        previous = self._owners, self._by_login
+        self._owners, self._by_login = {}, defaultdict(dict)
+        async for entry in iter_issue_entries(headers, self.query):
+            if entry is None:
+                self._owners, self._by_login = previous
+                return False
+            for raw in entry.issues:
+                self._apply(raw)
+        self._index = {login: list(issues.values()) for login, issues in self._by_login.items()}
+        self.cursors = dict.fromkeys(self.issue_filter.queues, started)
+        self.loaded_at = time.monotonic()
+        return True
+
+    async def _pull(self, headers: dict) -> bool:
+        affected = set()
+        try:
+            for queue, cursor in self.cursors.items():
+                latest = cursor
+                async for entry in iter_issue_entries(headers, build_changes_filter(queue, cursor)):
+                    if entry is None:
+                        return False
+                    for raw in entry.issues:
+                        self.changes += 1
+                        affected.update(self._apply(raw))
+                        if raw.get('updatedAt'):
+                            latest = max(latest, parse_time(raw['updatedAt']))
+                self.cursors[queue] = latest
+            return True
+        finally:
+            # Уже полученные изменения применяются, даже если следующая страница не пришла.
+            for login in affected:
+                issues = self._by_login.get(login)
+                if issues:
+                    self._index[login] = list(issues.values())
+                else:
+                    self._index.pop(login, None)
+                    self._by_login.pop(login, None)
+
+    def _apply(self, raw: dict) -> set:
+        """
+        Применяет к индексу измененную задачу. Задача, которая больше не проходит фильтр (закрыта,
+        снят исполнитель, сменился приоритет), убирается у прежнего исполнителя, переназначенная
+        переходит к новому. Возвращает логины исполнителей, чьи задачи изменились.
+        """
+        key = raw.get('key')
+        login = (raw.get('assignee') or {}).get('id')
+        issue = None
+        if login and self.issue_filter.matches(raw):
+            parsed = get_list_issues([raw])
+            issue = parsed[0] if parsed else None
+        affected = set()
+        owner = self._owners.pop(key, None)
+        if owner is not None:
+            self._by_login[owner].pop(key, None)
+            affected.add(owner)
+        if issue is not None:
+            self._owners[key] = login
+            self._by_login[login][key] = issue
+            affected.add(login)
+        return affected
@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from collections import deque
+
+from config import (breaker_window, breaker_min_calls, breaker_failure_ratio, breaker_cooldown,
+                    breaker_max_cooldown)
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для запросов к трекеру.
+    closed - запросы идут как обычно, результаты за последние window секунд копятся в скользящем окне.
+    Если в окне не меньше min_calls запросов и доля ошибок не меньше failure_ratio, предохранитель размыкается.
+    open - запросы не отправляются cooldown секунд (или сколько попросил трекер в Retry-After).
+    half_open - пропускается один пробный запрос: успех замыкает предохранитель, ошибка снова размыкает его
+    с удвоенной паузой, но не дольше max_cooldown.
+    """
+
+    def __init__(self, window: float = breaker_window, min_calls: int = breaker_min_calls,
+                 failure_ratio: float = breaker_failure_ratio, cooldown: float = breaker_cooldown,
+                 max_cooldown: float = breaker_max_cooldown):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.opened = 0
+        self.rejected = 0
+        self._state = CLOSED
+        self._calls = deque()
+        self._failures = 0
+        self._open_until = 0.0
+        self._current_cooldown = cooldown
+        self._probe = False
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() >= self._open_until:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Можно ли сейчас отправить запрос. В полуоткрытом состоянии разрешает только один пробный запрос.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == OPEN and now >= self._open_until:
+                self._state = HALF_OPEN
+                self._probe = False
+            # Если проба так и не ответила (например, запрос отменили), через паузу разрешаем следующую.
+            if self._state == HALF_OPEN and (not self._probe or now - self._probe_at > self._current_cooldown):
+                self._probe = True
+                self._probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self) -> float:
+        """
+        Через сколько секунд предохранитель пропустит следующий запрос. 0, если пропускает сейчас.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return 0.0
+            return max(0.0, self._open_until - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                self._state = CLOSED
+                self._current_cooldown = self.cooldown
+                self._calls.clear()
+                self._failures = 0
+            self._record(False)
+
+    def record_failure(self, retry_after: float = None):
+        """
+        Учитывает ошибку. retry_after - пауза, которую попросил трекер: предохранитель размыкается
+        как минимум на это время.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                # Неудачная проба: снова размыкаемся с удвоенной паузой.
+                self._current_cooldown = min(self._current_cooldown * 2, self.max_cooldown)
+                self._open(retry_after)
+                return
+            if self._state == OPEN:
+                # Ответ на запрос, отправленный до размыкания, паузу не продлевает.
+                return
+            self._record(True)
+            calls = len(self._calls)
+            if retry_after or (calls >= self.min_calls and self._failures / calls >= self.failure_ratio):
+                self._open(retry_after)
+
+    def _record(self, failed: bool):
+        now = time.monotonic()
+        self._calls.append((now, failed))
+        self._failures += failed
+        while self._calls and self._calls[0][0] < now - self.window:
+            _, old_failed = self._calls.popleft()
+            self._failures -= old_failed
+
+    def _open(self, retry_after: float = None):
+        # Разброс паузы, чтобы пробы разных процессов не приходили одновременно.
+        pause = self._current_cooldown * random.uniform(0.8, 1.2)
+        self._open_until = time.monotonic() + max(pause, retry_after or 0)
+        self._state = OPEN
+        self._probe = False
+        self.opened += 1
+
+
+def parse_retry_after(value: str):
+    """
+    Значение заголовка Retry-After в секундах или None. Дата вместо числа секунд не поддерживается.
+    """
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
@@ -1,40 +1,187 @@
 import datetime
 import os
+from dataclasses import dataclass
+from typing import Optional
+
 import pytz
 
 
-# Токен приложения трекера.
+# Токен приложения трекера. В командном режиме опроса используется как сервисный токен.
 YANDEX_TOKEN = os.getenv('YANDEX_TOKEN')
 
 # Адрес апи трекера
 api_url = 'https://st-api.yandex-team.ru/v2/'
 
-# Фильтр возвращает задачи юзера в конкретной очереди, которые открыты.
-# PCR в первой строке - это код очереди, в которой будут искаться задачи
-issue_filter = ('issues?filter=queue:PCR&'
+# Сколько задач запрашивать у трекера за одну страницу.
+issues_per_page = int(os.getenv('TRACKER_PER_PAGE', 50))
+
+# Настройки HTTP-клиента трекера: размер пула keep-alive соединений и таймаут одного запроса в секундах.
+http_pool_size = int(os.getenv('TRACKER_POOL_SIZE', 20))
+http_timeout = float(os.getenv('TRACKER_TIMEOUT', 10))
+
+# Очереди и статусы задач по умолчанию, через запятую. Пользователь может задать свой фильтр командой /filter
+# (query_builder.py), эти значения используются, пока он этого не сделал.
+default_queues = tuple(os.getenv('TRACKER_QUEUES', 'PCR').split(','))
+default_statuses = tuple(os.getenv('TRACKER_STATUSES', 'open').split(','))
+
+# Фильтр возвращает задачи юзера в очередях по умолчанию, которые открыты.
+issue_filter = (f'issues?filter=queue:{",".join(default_queues)}&'
                 'filter=assignee:me()&'
-                'filter=status:open&')
+                f'filter=status:{",".join(default_statuses)}&')
 
-# Задаем таймзону и время, чтобы отфильтровать новые задачи за последние 20 минут.
+# Тот же фильтр на языке запросов трекера. Используется в инкрементальном режиме опроса,
+# где к нему добавляется условие по времени последнего обновления задачи.
+issue_query = f'Queue: {", ".join(default_queues)} Assignee: me() Status: {", ".join(default_statuses)}'
+
+# Открытые задачи всей очереди. Запрашиваются сервисным токеном YANDEX_TOKEN в командном режиме.
+team_filter = (f'issues?filter=queue:{",".join(default_queues)}&'
+               f'filter=status:{",".join(default_statuses)}&')
+
+# Режим опроса по подписке: full - каждый раз запрашиваются все открытые задачи и фильтруются на стороне бота,
+# incremental - запрашиваются только задачи, обновленные после последней доставленной,
+# team - задачи всей очереди запрашиваются раз в период сервисным токеном и раздаются подписчикам по исполнителю,
+# changelog - как team, но после первой загрузки запрашиваются только задачи очередей, измененные с прошлого опроса
+# (change_feed.py). Раз в changelog_resync секунд все открытые задачи загружаются заново.
+sync_mode = os.getenv('SYNC_MODE', 'full')
+changelog_resync = float(os.getenv('CHANGELOG_RESYNC', 24 * 60 * 60))
+
+# Задаем таймзону. Время, от которого отбираются новые задачи за последние 20 минут (twenty_min_past),
+# считается при каждом обращении к нему, а не один раз при импорте: см. __getattr__ в конце модуля.
 tz = pytz.timezone("Europe/Moscow")
-twenty_min_past = datetime.datetime.now(tz) - datetime.timedelta(minutes=20)
+
+# Задача считается горящей за hot_before до дедлайна. В функциях выборки последних задач напоминание о ней
+# приходит, пока до дедлайна остается от hot_before до hot_before - hot_window.
+hot_before = datetime.timedelta(hours=4)
+hot_window = datetime.timedelta(minutes=30)
+
+# Пороги напоминаний о дедлайне по умолчанию: за сколько до failAt приходит напоминание.
+# Пользователь может задать свои командой /alerts.
+alert_thresholds = (hot_before, datetime.timedelta(0))
+# Самый дальний порог, который можно задать командой /alerts.
+alert_max_threshold = datetime.timedelta(days=30)
+
+# В инкрементальном режиме опрос возвращает только обновленные открытые задачи: закрытые, переназначенные
+# и задачи с остановленным SLA в выдачу не попадают. Поэтому раз в alerts_resync секунд таймеры напоминаний
+# подписчика сверяются с полным списком его задач.
+alerts_resync = float(os.getenv('ALERTS_RESYNC', 60 * 60))
+
+# Сколько напоминаний отправляется одновременно. Отправка ждет лимитов Telegram чата, поэтому напоминания
+# отправляются параллельно, чтобы медленный чат не задерживал напоминания остальным.
+alert_senders = int(os.getenv('ALERT_SENDERS', 100))
 
 # Фиксируем формат времени.
 time_format = "%Y-%m-%dT%H:%M:%S.%f%z"
 comfortable_format = "%H:%M:%S %d.%m.%Y (%Z)"
 
+# Сколько секунд токен считается проверенным после успешного запроса к myself и сколько токенов хранится в кэше.
+token_cache_ttl = int(os.getenv('TOKEN_CACHE_TTL', 600))
+token_cache_size = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+# Сколько секунд список задач пользователя отдается из кэша без запроса к трекеру
+# и сколько байт ответов трекера может храниться в кэше.
+issue_cache_ttl = int(os.getenv('ISSUE_CACHE_TTL', 30))
+issue_cache_max_bytes = int(os.getenv('ISSUE_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+
+# Период опроса трекера по подписке в секундах, разброс времени опроса (доля периода)
+# и число одновременных опросов.
+poll_interval = int(os.getenv('POLL_INTERVAL', 1200))
+poll_jitter = float(os.getenv('POLL_JITTER', 0.1))
+poll_workers = int(os.getenv('POLL_WORKERS', 10))
+
+# Ограничения Telegram на отправку: сообщений в секунду всего и в один чат, максимальная длина сообщения
+# и число повторов после ответа RetryAfter.
+telegram_global_rate = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+telegram_chat_rate = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+telegram_message_limit = 4096
+delivery_retries = int(os.getenv('DELIVERY_RETRIES', 3))
+
+# Файл базы SQLite для состояний диалогов (токены и подписки переживают перезапуск бота).
+# Значение memory оставляет хранение только в памяти. Изменения пишутся в базу раз в fsm_flush_interval секунд.
+fsm_storage = os.getenv('FSM_STORAGE', 'fsm.sqlite3')
+fsm_flush_interval = float(os.getenv('FSM_FLUSH_INTERVAL', 1))
+
+# Сколько задач на пользователя помнит журнал доставки (ledger.py).
+ledger_max_issues = int(os.getenv('LEDGER_MAX_ISSUES', 1000))
+# Сколько отформатированных текстов задач хранит кэш рендеринга (rendering.py).
+render_cache_size = int(os.getenv('RENDER_CACHE_SIZE', 100000))
+# Сколько задач на странице /status и для скольких чатов хранятся снимки задач для листания (paging.py).
+status_page_size = int(os.getenv('STATUS_PAGE_SIZE', 5))
+status_snapshots = int(os.getenv('STATUS_SNAPSHOTS', 10000))
+# Для скольких фильтров /filter хранятся собранные строки запросов (query_builder.py).
+filter_cache_size = int(os.getenv('FILTER_CACHE_SIZE', 1024))
+
 # Токен телеграмм бота.
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 
+# Число рабочих процессов, между которыми распределяются подписчики (sharding.py). 0 - все в одном процессе.
+# ring_replicas - число точек каждого процесса на кольце консистентного хеширования.
+shard_workers = int(os.getenv('SHARD_WORKERS', 0))
+ring_replicas = int(os.getenv('RING_REPLICAS', 100))
+
+# Порт локального http-сервера с метриками в формате Prometheus (/metrics) и трассами (/traces). 0 - сервер выключен.
+# Рабочие процессы шардов слушают следующие порты по порядку. trace_buffer_size - сколько последних
+# интервалов трассировки хранится в памяти.
+metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+metrics_port = int(os.getenv('METRICS_PORT', 0))
+trace_buffer_size = int(os.getenv('TRACE_BUFFER_SIZE', 1000))
+
+# Файловый лог (logging_setup.py): строки JSON пишутся пачками раз в log_flush_interval секунд
+# или по log_batch_size записей. Файл ротируется по размеру или раз в сутки, старые файлы сжимаются gzip,
+# хранится log_retention последних.
+log_file = os.getenv('LOG_FILE', 'logs.json')
+log_level = os.getenv('LOG_LEVEL', 'INFO')
+log_rotation_bytes = int(os.getenv('LOG_ROTATION_BYTES', 10 * 1024 * 1024))
+log_rotation_interval = float(os.getenv('LOG_ROTATION_INTERVAL', 24 * 60 * 60))
+log_retention = int(os.getenv('LOG_RETENTION', 10))
+log_flush_interval = float(os.getenv('LOG_FLUSH_INTERVAL', 1))
+log_batch_size = int(os.getenv('LOG_BATCH_SIZE', 1000))
+
+# Предохранитель запросов к трекеру (circuit_breaker.py): размыкается, если за breaker_window секунд
+# было не меньше breaker_min_calls запросов и доля ошибок не меньше breaker_failure_ratio. Пока он разомкнут,
+# вместо запросов отдаются последние закэшированные задачи. Пауза до пробного запроса удваивается
+# после каждой неудачной пробы, но не превышает breaker_max_cooldown.
+breaker_window = float(os.getenv('BREAKER_WINDOW', 60))
+breaker_min_calls = int(os.getenv('BREAKER_MIN_CALLS', 5))
+breaker_failure_ratio = float(os.getenv('BREAKER_FAILURE_RATIO', 0.5))
+breaker_cooldown = float(os.getenv('BREAKER_COOLDOWN', 30))
+breaker_max_cooldown = float(os.getenv('BREAKER_MAX_COOLDOWN', 600))
+# Максимальная пауза между опросами подписки, пока трекер отвечает ошибками.
+poll_max_backoff = float(os.getenv('POLL_MAX_BACKOFF', 4 * 60 * 60))
+# Бюджет запросов к трекеру (admission.py): запросов в секунду на весь бот и сколько можно отправить подряд.
+# 0 снимает ограничение.
+tracker_rate = float(os.getenv('TRACKER_RATE', 20))
+tracker_burst = float(os.getenv('TRACKER_BURST', 20))
 
-def time_remain(fail_data: datetime.datetime):
+# Способ получения обновлений от Telegram: polling (long polling) или webhook.
+# keep_pending_updates - обрабатывать ли обновления, накопившиеся, пока бот был выключен.
+bot_mode = os.getenv('BOT_MODE', 'polling')
+keep_pending_updates = os.getenv('KEEP_PENDING_UPDATES', '0').lower() in ('1', 'true', 'yes')
+
+# Настройки webhook. webhook_url - публичный https-адрес, на который Telegram шлет обновления
+# (обычно адрес прокси, который терминирует TLS и проксирует на webapp_host:webapp_port).
+# Если прокси нет, можно указать самоподписанный сертификат и ключ: тогда TLS терминирует сам бот.
+webhook_url = os.getenv('WEBHOOK_URL')
+webhook_path = os.getenv('WEBHOOK_PATH', '/webhook')
+webapp_host = os.getenv('WEBAPP_HOST', '127.0.0.1')
+webapp_port = int(os.getenv('WEBAPP_PORT', 8080))
+webhook_ssl_cert = os.getenv('WEBHOOK_SSL_CERT')
+webhook_ssl_key = os.getenv('WEBHOOK_SSL_KEY')
+# Сколько обновлений обрабатывается одновременно и сколько секунд при остановке ждать незавершенные обработчики.
+webhook_concurrency = int(os.getenv('WEBHOOK_CONCURRENCY', 100))
+webhook_drain_timeout = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 30))
+
+
+def time_remain(fail_data: datetime.datetime, now: datetime.datetime = None):
     """
     Получает поле date-time парсит его и возвращает в удобном для чтения формате.
+    now - текущее время, если вызывающий уже получил его для нескольких задач.
     """
-    if fail_data.astimezone(tz) <= datetime.datetime.now(tz):
+    if now is None:
+        now = datetime.datetime.now(tz)
+    if fail_data <= now:
         formated_time = "Все сгорело в синем пламени"
         return formated_time
-    time = fail_data.astimezone(tz) - datetime.datetime.now(tz)
+    time = fail_data - now
     mm, ss = divmod(time.seconds, 60)
     hh, mm = divmod(mm, 60)
     if hh > 0:
@@ -46,3 +193,45 @@ def time_remain(fail_data: datetime.datetime):
     else:
         formated_time = "Все сгорело в синем пламени"
     return formated_time
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Настройки, по которым собирается приложение бота (telegram_bot_logic.create_app). Значения по умолчанию -
+    прочитанные один раз из окружения переменные этого модуля. Для тестов и бенчмарков отдельные значения
+    можно заменить через dataclasses.replace, не трогая окружение.
+    """
+    telegram_token: Optional[str] = TELEGRAM_TOKEN
+    bot_mode: str = bot_mode
+    keep_pending_updates: bool = keep_pending_updates
+    fsm_storage: str = fsm_storage
+    sync_mode: str = sync_mode
+    shard_workers: int = shard_workers
+    metrics_port: int = metrics_port
+    telegram_global_rate: float = telegram_global_rate
+    tracker_rate: float = tracker_rate
+    log_file: str = log_file
+    log_level: str = log_level
+    webhook_url: Optional[str] = webhook_url
+    webhook_path: str = webhook_path
+    webapp_host: str = webapp_host
+    webapp_port: int = webapp_port
+    webhook_ssl_cert: Optional[str] = webhook_ssl_cert
+    webhook_ssl_key: Optional[str] = webhook_ssl_key
+    webhook_concurrency: int = webhook_concurrency
+    webhook_drain_timeout: float = webhook_drain_timeout
+
+    @property
+    def twenty_min_past(self) -> datetime.datetime:
+        return datetime.datetime.now(tz) - datetime.timedelta(minutes=20)
+
+
+settings = Settings()
+
+
+def __getattr__(name: str):
+    # Вычисляемые значения модуля считаются в момент обращения.
+    if name == 'twenty_min_past':
+        return settings.twenty_min_past
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from config import tz, alert_max_threshold, alert_senders, alert_thresholds
+from issues import Issue
+from ledger import issue_key
+
+
+class DeadlineEngine:
+    """
+    Напоминания о дедлайнах по таймерам. Для каждой задачи подписчика в кучу кладутся моменты срабатывания:
+    warnAt из SLA и failAt минус каждый из порогов пользователя. Напоминание приходит ровно в этот момент,
+    независимо от того, как часто опрашивается трекер.
+    callback - корутина (chat_id, issue, threshold), threshold равен None для напоминания по warnAt.
+    Колбэки выполняются отдельными задачами, не больше senders одновременно: отправка в один чат ждет
+    его лимита Telegram и не должна задерживать напоминания остальным.
+    """
+
+    def __init__(self, callback, thresholds: tuple = alert_thresholds, senders: int = alert_senders):
+        self.callback = callback
+        self.thresholds = tuple(thresholds)
+        self.senders = senders
+        self.fired = 0
+        self._heap = []
+        self._counter = itertools.count()
+        # chat_id -> {ключ задачи: (версия, задача, число таймеров в куче)}. Таймеры устаревшей версии пропускаются.
+        self._issues = {}
+        # Сколько таймеров в куче относятся к устаревшим версиям задач.
+        self._stale = 0
+        self._user_thresholds = {}
+        self._wakeup = None
+        self._task = None
+        self._slots = None
+        # Отправляемые сейчас напоминания, чтобы stop() мог их отменить.
+        self._sending = set()
+
+    def __len__(self):
+        return sum(len(issues) for issues in self._issues.values())
+
+    def __contains__(self, chat_id: int):
+        return chat_id in self._issues
+
+    def thresholds_for(self, chat_id: int) -> tuple:
+        return self._user_thresholds.get(chat_id, self.thresholds)
+
+    def set_thresholds(self, chat_id: int, thresholds: list):
+        """
+        Задает пороги пользователя и пересчитывает таймеры всех его задач.
+        """
+        self._user_thresholds[chat_id] = tuple(sorted(set(thresholds), reverse=True))
+        for _, issue, _ in list(self._issues.get(chat_id, {}).values()):
+            self._schedule(chat_id, issue)
+        self._compact()
+
+    def update(self, chat_id: int, issues: list):
+        """
+        Добавляет задачи или обновляет их таймеры. Таймеры пересоздаются только для задач,
+        у которых изменились сроки SLA.
+        """
+        known_issues = self._issues.get(chat_id, {})
+        for issue in issues:
+            known = known_issues.get(issue_key(issue))
+            if known is None or known[1].deadline != issue.deadline or known[1].warn_at != issue.warn_at:
+                self._schedule(chat_id, issue)
+            else:
+                # Сроки прежние, но название могло поменяться: сохраняем свежую версию задачи.
+                known_issues[issue_key(issue)] = (known[0], issue, known[2])
+        self._compact()
+
+    def retain(self, chat_id: int, keys: set):
+        """
+        Удаляет таймеры задач пользователя, которых нет среди keys (задачи закрыты или переназначены).
+        """
+        known_issues = self._issues.get(chat_id, {})
+        for key in [key for key in known_issues if key not in keys]:
+            self._stale += known_issues.pop(key)[2]
+        if not known_issues:
+            self._issues.pop(chat_id, None)
+        self._compact()
+
+    def remove(self, chat_id: int):
+        """
+        Удаляет все таймеры пользователя, например после /cancel.
+        """
+        for _, _, timers in self._issues.pop(chat_id, {}).values():
+            self._stale += timers
+        self._user_thresholds.pop(chat_id, None)
+        self._compact()
+
+    def _schedule(self, chat_id: int, issue: Issue):
+        version = next(self._counter)
+        key = issue_key(issue)
+        known_issues = self._issues.setdefault(chat_id, {})
+        known = known_issues.get(key)
+        if known is not None:
+            self._stale += known[2]
+        now = datetime.now(tz)
+        moments = [(issue.warn_at, None)] if issue.warn_at < issue.deadline else []
+        moments += [(issue.deadline - threshold, threshold) for threshold in self.thresholds_for(chat_id)]
+        timers = 0
+        for fire_at, threshold in moments:
+            if fire_at > now:
+                heapq.heappush(self._heap, (fire_at, version, chat_id, key, threshold))
+                timers += 1
+        known_issues[key] = (version, issue, timers)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _current(self, version: int, chat_id: int, key: str):
+        """
+        Запись задачи, если таймер относится к ее текущей версии, иначе None.
+        """
+        known = self._issues.get(chat_id, {}).get(key)
+        return known if known is not None and known[0] == version else None
+
+    def _compact(self):
+        # Перестраиваем кучу, когда устаревших таймеров в ней становится больше половины.
+        # Счетчик нужен, чтобы не просматривать кучу на каждом опросе.
+        if self._stale <= len(self._heap) // 2:
+            return
+        self._heap = [timer for timer in self._heap if self._current(timer[1], timer[2], timer[3]) is not None]
+        heapq.heapify(self._heap)
+        self._stale = 0
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.senders)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        tasks = list(self._sending)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._sending.clear()
+
+    async def _run(self):
+        while True:
+            now = datetime.now(tz)
+            while self._heap and self._heap[0][0] <= now:
+                _, version, chat_id, key, threshold = heapq.heappop(self._heap)
+                known = self._current(version, chat_id, key)
+                if known is None:
+                    self._stale = max(0, self._stale - 1)
+                    continue
+                self._issues[chat_id][key] = (version, known[1], known[2] - 1)
+                self.fired += 1
+                task = asyncio.ensure_future(self._send(chat_id, known[1], threshold))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+            timeout = (self._heap[0][0] - datetime.now(tz)).total_seconds() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, chat_id: int, issue: Issue, threshold):
+        async with self._slots:
+            try:
+                await self.callback(chat_id, issue, threshold)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Не удалось отправить напоминание о дедлайне в чат {chat_id}")
+
+
+def parse_threshold(value: str) -> timedelta:
+    """
+    Разбирает порог напоминания вида 4h, 30m или число минут. Выбрасывает ValueError на неверный формат
+    и на порог меньше нуля или больше alert_max_threshold.
+    """
+    value = value.strip().lower()
+    unit = 'minutes'
+    if value.endswith('h'):
+        value, unit = value[:-1], 'hours'
+    elif value.endswith('m'):
+        value = value[:-1]
+    try:
+        threshold = timedelta(**{unit: float(value)})
+    except OverflowError:
+        raise ValueError(f"Слишком большой порог: {value}")
+    if not timedelta(0) <= threshold <= alert_max_threshold:
+        raise ValueError(f"Порог должен быть от 0 до {alert_max_threshold}")
+    return threshold
@@ -0,0 +1,163 @@
+import asyncio
+import time
+
+from aiogram.types import ParseMode
+from aiogram.utils.exceptions import RetryAfter
+from loguru import logger
+
+from config import telegram_global_rate, telegram_chat_rate, telegram_message_limit, delivery_retries
+from metrics import flood_waits, flood_wait_seconds
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate разрешений в секунду, не больше capacity подряд.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def pack_messages(texts: list, limit: int = telegram_message_limit, sep: str = '\n\n') -> list:
+    """
+    Склеивает тексты в как можно меньшее число сообщений длиной не больше limit.
+    Текст длиннее limit режется на части.
+    """
+    messages = []
+    current = ''
+    for text in texts:
+        while len(text) > limit:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(text[:limit])
+            text = text[limit:]
+        if not current:
+            current = text
+        elif len(current) + len(sep) + len(text) <= limit:
+            current += sep + text
+        else:
+            messages.append(current)
+            current = text
+    if current:
+        messages.append(current)
+    return messages
+
+
+class DeliveryQueue:
+    """
+    Очередь исходящих сообщений Telegram. Склеивает задачи в сообщения до 4096 символов,
+    соблюдает общий лимит и лимит на чат, повторяет отправку после RetryAfter и сохраняет
+    порядок сообщений внутри чата: у каждого чата своя очередь и свой воркер.
+    """
+
+    def __init__(self, bot, global_rate: float = telegram_global_rate, chat_rate: float = telegram_chat_rate,
+                 limit: int = telegram_message_limit, retries: int = delivery_retries, idle_timeout: float = 60):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.limit = limit
+        self.retries = retries
+        self.idle_timeout = idle_timeout
+        self.global_bucket = TokenBucket(global_rate)
+        self._chats = {}
+        # Счетчики для оценки пропускной способности.
+        self.texts = 0
+        self.messages = 0
+        self.retried = 0
+        self.failed = 0
+
+    def stats(self) -> dict:
+        return {'texts': self.texts, 'messages': self.messages, 'retried': self.retried, 'failed': self.failed,
+                'chats': len(self._chats), 'queued': sum(queue.qsize() for queue, _ in self._chats.values())}
+
+    async def send(self, chat_id: int, texts: list, parse_mode: str = ParseMode.MARKDOWN, reply_markup=None):
+        """
+        Ставит тексты в очередь чата и ждет, пока все они будут отправлены.
+        reply_markup - клавиатура, она прикрепляется к последнему сообщению.
+        Ошибка отправки пробрасывается вызывающему.
+        """
+        texts = [text for text in texts if text]
+        if not texts:
+            return
+        self.texts += len(texts)
+        loop = asyncio.get_event_loop()
+        futures = []
+        queue = self._chat_queue(chat_id)
+        messages = pack_messages(texts, self.limit)
+        for number, text in enumerate(messages, 1):
+            future = loop.create_future()
+            queue.put_nowait((text, parse_mode, reply_markup if number == len(messages) else None, future))
+            futures.append(future)
+        await asyncio.gather(*futures)
+
+    def _chat_queue(self, chat_id: int) -> asyncio.Queue:
+        if chat_id not in self._chats:
+            queue = asyncio.Queue()
+            self._chats[chat_id] = (queue, asyncio.ensure_future(self._chat_worker(chat_id, queue)))
+        return self._chats[chat_id][0]
+
+    async def _chat_worker(self, chat_id: int, queue: asyncio.Queue):
+        bucket = TokenBucket(self.chat_rate)
+        try:
+            while True:
+                try:
+                    text, parse_mode, reply_markup, future = await asyncio.wait_for(queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    # Чат давно ничего не получал: освобождаем воркер.
+                    if queue.empty():
+                        return
+                    continue
+                try:
+                    await self._deliver(chat_id, text, parse_mode, reply_markup, bucket)
+                except Exception as ex:
+                    self.failed += 1
+                    if not future.done():
+                        future.set_exception(ex)
+                else:
+                    self.messages += 1
+                    if not future.done():
+                        future.set_result(None)
+                finally:
+                    queue.task_done()
+        finally:
+            self._chats.pop(chat_id, None)
+
+    async def _deliver(self, chat_id: int, text: str, parse_mode: str, reply_markup, bucket: TokenBucket):
+        for attempt in range(self.retries + 1):
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await self.bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+            except RetryAfter as ex:
+                flood_waits.inc()
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                flood_wait_seconds.inc(ex.timeout)
+                logger.warning(f"Telegram просит подождать {ex.timeout} сек. перед отправкой в чат {chat_id}")
+                await asyncio.sleep(ex.timeout)
+
+    async def close(self):
+        """
+        Дожидается отправки всех сообщений в очереди и останавливает воркеры.
+        """
+        chats = list(self._chats.values())
+        for queue, _ in chats:
+            await queue.join()
+        for _, worker in chats:
+            worker.cancel()
+        await asyncio.gather(*(worker for _, worker in chats), return_exceptions=True)
+        self._chats.clear()
@@ -0,0 +1,135 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from config import issue_cache_ttl, issue_cache_max_bytes
+
+
+class CacheEntry:
+    """
+    Закэшированный ответ трекера со списком задач.
+    issues - задачи после фильтрации SLA.
+    parsed - результат get_list_issues, считается один раз при первом обращении.
+    etag, last_modified - валидаторы для условного запроса.
+    size - размер тела ответа в байтах, по нему считается занимаемая кэшем память.
+    total_pages - число страниц в выдаче по заголовку X-Total-Pages, если трекер его прислал.
+    stale - запись отдана без перепроверки, потому что трекер недоступен.
+    """
+    __slots__ = ('issues', 'parsed', 'etag', 'last_modified', 'size', 'total_pages', 'fresh_until', 'stale')
+
+    def __init__(self, issues: list, etag: str = None, last_modified: str = None, size: int = 0,
+                 total_pages: int = None):
+        self.issues = issues
+        self.parsed = None
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+        self.total_pages = total_pages
+        self.fresh_until = 0.0
+        self.stale = False
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.fresh_until
+
+    def conditional_headers(self) -> dict:
+        """
+        Заголовки для условного запроса: если задачи не изменились, трекер ответит 304 без тела.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class IssueCache:
+    """
+    Общий для /status и опросов по подписке кэш задач пользователей. Записи живут ttl секунд,
+    после чего перепроверяются условным запросом. Суммарный размер ограничен max_bytes, при переполнении
+    вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, ttl: float = issue_cache_ttl, max_bytes: int = issue_cache_max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(authorization: str, url: str) -> bytes:
+        """
+        Ключ записи. Заголовок авторизации хэшируется, чтобы токен не хранился в открытом виде.
+        """
+        return hashlib.sha256(f'{authorization}\n{url}'.encode('utf-8', 'surrogatepass')).digest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: bytes):
+        """
+        Возвращает запись или None. Свежая запись считается попаданием, устаревшую нужно перепроверить.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.is_fresh():
+                self.hits += 1
+                self.bytes_saved += entry.size
+            return entry
+
+    def store(self, key: bytes, entry: CacheEntry):
+        entry.fresh_until = time.monotonic() + self.ttl
+        entry.stale = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old.size
+            # Ответ больше всего кэша не храним.
+            if entry.size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.total_bytes += entry.size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted.size
+                self.evictions += 1
+
+    def revalidated(self, entry: CacheEntry):
+        """
+        Трекер ответил 304: продлеваем запись, тело ответа не скачивалось и не разбиралось.
+        """
+        entry.fresh_until = time.monotonic() + self.ttl
+        entry.stale = False
+        with self._lock:
+            self.revalidations += 1
+            self.bytes_saved += entry.size
+
+    def discard(self, key: bytes):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry.size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.revalidations + self.misses
+        return {
+            'size': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'revalidations': self.revalidations,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes_saved': self.bytes_saved,
+            'hit_ratio': (self.hits + self.revalidations) / lookups if lookups else 0.0,
+        }
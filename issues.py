@@ -0,0 +1,80 @@
+import re
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from config import tz, comfortable_format, hot_before, hot_window, time_format
+
+# Формат времени трекера (config.time_format), разобранный заранее скомпилированным выражением:
+# datetime.strptime на каждый вызов заметно медленнее.
+_TIME_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?([+-])(\d\d):?(\d\d)$')
+# Объекты часовых поясов по смещению, чтобы не создавать их для каждой задачи.
+_offsets = {}
+
+
+# Одни и те же задачи приходят в каждом опросе, поэтому их метки времени повторяются из цикла в цикл.
+@lru_cache(maxsize=65536)
+def parse_time(value: str) -> datetime:
+    """
+    Разбирает время из ответа трекера. Для строк нестандартного вида использует strptime с config.time_format.
+    Выбрасывает ValueError на невалидное значение.
+    """
+    match = _TIME_RE.match(value)
+    if match is None:
+        return datetime.strptime(value, time_format)
+    year, month, day, hour, minute, second, fraction, sign, off_hours, off_minutes = match.groups()
+    offset_key = sign + off_hours + off_minutes
+    offset = _offsets.get(offset_key)
+    if offset is None:
+        delta = timedelta(hours=int(off_hours), minutes=int(off_minutes))
+        offset = _offsets[offset_key] = timezone(-delta if sign == '-' else delta)
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), microsecond, offset)
+
+
+class Issue(NamedTuple):
+    """
+    Задача трекера, разобранная один раз. Все даты приведены к таймзоне бота.
+    hot_at - момент, с которого задача считается горящей.
+    deadline_text - дедлайн, отформатированный для сообщения.
+    """
+    key: Optional[str]
+    summary: str
+    status: Optional[str]
+    deadline: datetime
+    warn_at: datetime
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    hot_at: datetime
+    deadline_text: str
+
+    def is_hot(self, now: datetime) -> bool:
+        return self.hot_at <= now
+
+    def in_hot_window(self, now: datetime) -> bool:
+        """
+        Попадает ли now в окно напоминания о горящей задаче.
+        """
+        return self.hot_at <= now <= self.hot_at + hot_window
+
+
+def make_issue(issue: dict) -> Issue:
+    """
+    Создает Issue из задачи в формате ответа трекера с уже отфильтрованным полем sla.
+    Выбрасывает KeyError/IndexError на отсутствующие поля и ValueError на невалидное время.
+    """
+    sla = issue['sla'][0]
+    deadline = parse_time(sla['failAt']).astimezone(tz)
+    created_at = issue.get('createdAt')
+    updated_at = issue.get('updatedAt')
+    return Issue(
+        key=issue.get('key'),
+        summary=issue['summary'],
+        status=(issue.get('status') or {}).get('key'),
+        deadline=deadline,
+        warn_at=parse_time(sla['warnAt']).astimezone(tz),
+        created_at=parse_time(created_at) if created_at else None,
+        updated_at=parse_time(updated_at) if updated_at else None,
+        hot_at=deadline - hot_before,
+        deadline_text=deadline.strftime(comfortable_format),
+    )
@@ -0,0 +1,67 @@
+import hashlib
+from collections import OrderedDict
+
+from config import ledger_max_issues
+from issues import Issue
+
+
+def issue_digest(issue: Issue) -> bytes:
+    """
+    Отпечаток значимых для пользователя полей задачи: название, статус и дедлайн SLA.
+    О приближении дедлайна напоминает DeadlineEngine, поэтому время в отпечаток не входит.
+    """
+    content = f'{issue.summary}\x00{issue.status}\x00{issue.deadline.isoformat()}'
+    return hashlib.blake2b(content.encode(), digest_size=8).digest()
+
+
+def issue_key(issue: Issue) -> str:
+    return issue.key or issue.summary
+
+
+class DeliveryLedger:
+    """
+    Журнал доставки: для каждого пользователя хранит отпечатки последних отправленных ему версий задач.
+    Опрос сравнивает полученные задачи с журналом и отправляет только изменившиеся.
+    На пользователя хранится не больше max_issues задач, давно не встречавшиеся вытесняются.
+    """
+
+    def __init__(self, max_issues: int = ledger_max_issues):
+        self.max_issues = max_issues
+        self._users = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    def diff(self, user: int, issues: list) -> list:
+        """
+        Возвращает задачи, которые пользователь еще не получал в текущем виде.
+        """
+        entries = self._users.get(user)
+        if not entries:
+            return list(issues)
+        return [issue for issue in issues if entries.get(issue_key(issue)) != issue_digest(issue)]
+
+    def commit(self, user: int, issues: list):
+        """
+        Запоминает задачи как доставленные. Вызывается после успешной отправки.
+        """
+        entries = self._users.setdefault(user, OrderedDict())
+        for issue in issues:
+            key = issue_key(issue)
+            entries[key] = issue_digest(issue)
+            entries.move_to_end(key)
+        while len(entries) > self.max_issues:
+            entries.popitem(last=False)
+
+    def forget(self, user: int):
+        self._users.pop(user, None)
+
+    def dump(self, user: int) -> dict:
+        """
+        Журнал пользователя в виде, пригодном для сохранения в состоянии диалога.
+        """
+        return {key: digest.hex() for key, digest in self._users.get(user, {}).items()}
+
+    def load(self, user: int, data: dict):
+        if data:
+            self._users[user] = OrderedDict((key, bytes.fromhex(digest)) for key, digest in data.items())
@@ -0,0 +1,190 @@
+import atexit
+import gzip
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from loguru import logger
+
+from config import (log_file, log_level, log_rotation_bytes, log_rotation_interval, log_retention,
+                    log_flush_interval, log_batch_size)
+
+
+class BatchingFileSink:
+    """
+    Приемник loguru для структурированных логов. Поток, который пишет в лог, только кладет запись в очередь.
+    Фоновый поток раз в flush_interval секунд или при накоплении batch_size записей сериализует пачку
+    в строки JSON и пишет ее в файл одним вызовом.
+    Файл ротируется по размеру и по времени, хранится не больше retention старых файлов,
+    сжатие старого файла выполняется в отдельном потоке и не задерживает запись.
+    """
+
+    def __init__(self, path: str, rotation_bytes: int = log_rotation_bytes,
+                 rotation_interval: float = log_rotation_interval, retention: int = log_retention,
+                 compression: bool = True, flush_interval: float = log_flush_interval,
+                 batch_size: int = log_batch_size):
+        self.path = path
+        self.rotation_bytes = rotation_bytes
+        self.rotation_interval = rotation_interval
+        self.retention = retention
+        self.compression = compression
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self.batches = 0
+        # Пачки, которые фоновый поток не смог записать: их записи потеряны.
+        self.failed_batches = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._compressors = []
+        self._file = None
+        self._opened_at = None
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, message):
+        """
+        Вызывается loguru в потоке, который пишет в лог. Только ставит запись в очередь.
+        """
+        self._queue.append((message.record, str(message)))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Синхронно записывает все, что накопилось в очереди.
+        """
+        self._write_batch()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for thread in self._compressors:
+            thread.join()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self._write_batch()
+            except Exception as ex:
+                self.failed_batches += 1
+                # Логировать здесь нельзя: запись вернулась бы в эту же очередь.
+                print(f"Не удалось записать логи: {ex!r}", file=sys.stderr)
+        self._write_batch()
+
+    def _write_batch(self):
+        with self._lock:
+            self._write_lines()
+
+    def _write_lines(self):
+        lines = []
+        while self._queue:
+            record, text = self._queue.popleft()
+            lines.append(json.dumps({
+                'time': record['time'].isoformat(),
+                'level': record['level'].name,
+                'name': record['name'],
+                'function': record['function'],
+                'line': record['line'],
+                'message': text.rstrip('\n'),
+                'extra': record['extra'],
+                'process': record['process'].id,
+            }, ensure_ascii=False, default=str))
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode()
+        if self._file is not None and self._should_rotate(len(data)):
+            self._rotate()
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+            self._opened_at = time.time()
+        self._file.write(data)
+        self._file.flush()
+        self.written += len(lines)
+        self.batches += 1
+
+    def _should_rotate(self, incoming: int) -> bool:
+        return (self._file.tell() + incoming > self.rotation_bytes or
+                time.time() - self._opened_at >= self.rotation_interval)
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        root, ext = os.path.splitext(self.path)
+        # Метка с микросекундами уникальна и сортируется по времени - на этом держится retention.
+        rotated = f'{root}.{datetime.now():%Y-%m-%d_%H-%M-%S_%f}{ext}'
+        os.replace(self.path, rotated)
+        if self.compression:
+            thread = threading.Thread(target=self._compress, args=(rotated,), name='log-compressor', daemon=True)
+            thread.start()
+            self._compressors = [item for item in self._compressors if item.is_alive()] + [thread]
+        else:
+            self._apply_retention()
+
+    def _compress(self, path: str):
+        with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(path)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        root, ext = os.path.splitext(self.path)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(root) + '.'
+        old = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                     if name.startswith(prefix) and name != os.path.basename(self.path)
+                     and (name.endswith(ext) or name.endswith(ext + '.gz')))
+        for path in old[:-self.retention] if self.retention else old:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+_sink = None
+_handler_id = None
+
+
+def setup_logging(path: str = log_file, level: str = log_level) -> BatchingFileSink:
+    """
+    Подключает файловый лог. Повторные вызовы ничего не делают, поэтому модули могут вызывать ее
+    независимо друг от друга. Рабочие процессы шардов пишут каждый в свой файл.
+    """
+    global _sink, _handler_id
+    if _sink is not None:
+        return _sink
+    if multiprocessing.parent_process() is not None:
+        root, ext = os.path.splitext(path)
+        path = f'{root}-{multiprocessing.current_process().name}{ext}'
+    _sink = BatchingFileSink(path)
+    _handler_id = logger.add(_sink.write, level=level, format='{message}')
+    atexit.register(shutdown_logging)
+    return _sink
+
+
+def shutdown_logging():
+    """
+    Отключает файловый лог, дописав очередь.
+    """
+    global _sink, _handler_id
+    if _sink is None:
+        return
+    logger.remove(_handler_id)
+    _sink.close()
+    _sink = _handler_id = None
@@ -0,0 +1,346 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import itertools
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiohttp import web
+from loguru import logger
+
+from config import metrics_host, metrics_port, trace_buffer_size
+
+
+default_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Metric:
+    """
+    Базовая метрика с метками. Значения хранятся по кортежу значений меток в порядке labels.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple([str(labels.get(label, '')) for label in self.labels])
+
+    def _format(self, key: tuple, extra: tuple = ()) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{label}="{value}"' for label, value in pairs) + '}'
+
+    def samples(self):
+        """
+        Строки значений в формате Prometheus без заголовков.
+        """
+        for key, value in sorted(self._values.items()):
+            yield f'{self.name}{self._format(key)} {value}'
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Вместо set можно задать функцию, которая вызывается при каждом чтении метрик
+    и возвращает словарь {кортеж значений меток: значение}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._functions = []
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self._functions.append(function)
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        for function in self._functions:
+            values = function()
+            if key in values:
+                return values[key]
+        return self._values.get(key, 0)
+
+    def samples(self):
+        values = dict(self._values)
+        for function in self._functions:
+            values.update(function())
+        for key, value in sorted(values.items()):
+            yield f'{self.name}{self._format(key)} {value}'
+
+
+class Histogram(Metric):
+    """
+    Распределение значений по корзинам. Для каждого набора меток хранятся счетчики корзин, сумма и число значений.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = default_buckets):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        self.observe_key(self._key(labels), value)
+
+    def observe_key(self, key: tuple, value: float):
+        """
+        observe для уже собранного кортежа значений меток, без разбора именованных аргументов.
+        """
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                yield f'{self.name}_bucket{self._format(key, (("le", le),))} {cumulative}'
+            yield f'{self.name}_sum{self._format(key)} {total}'
+            yield f'{self.name}_count{self._format(key)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = default_buckets):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = Registry()
+
+# Метрики бота.
+call_latency = registry.histogram('bot_call_duration_seconds',
+                                  'Длительность обращений к трекеру, разбора задач и отправки', ('call',))
+tracker_responses = registry.counter('tracker_responses_total', 'Ответы трекера по кодам статуса', ('call', 'status'))
+coalesced_calls = registry.counter('tracker_coalesced_total',
+                                   'Обращения к трекеру, дождавшиеся уже выполняющегося такого же запроса', ('call',))
+admission_wait = registry.histogram('tracker_admission_wait_seconds',
+                                    'Ожидание допуска запроса к трекеру в пределах бюджета', ('class',))
+handler_latency = registry.histogram('bot_handler_duration_seconds', 'Длительность обработчиков Telegram',
+                                     ('handler',))
+poll_lag = registry.histogram('poll_lag_seconds', 'Опоздание опроса подписки относительно запланированного времени')
+queue_depth = registry.gauge('queue_depth', 'Длина внутренних очередей', ('queue',))
+flood_waits = registry.counter('telegram_flood_waits_total', 'Ответы RetryAfter от Telegram')
+flood_wait_seconds = registry.counter('telegram_flood_wait_seconds_total', 'Суммарное ожидание по RetryAfter')
+
+
+class Span:
+    """
+    Интервал трассировки. Вложенные интервалы наследуют trace_id родителя из contextvars,
+    поэтому обращения к трекеру и отправки попадают в трассу обработчика или опроса, который их вызвал.
+    """
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'duration', 'attrs')
+
+    def __init__(self, name: str, trace_id: int, span_id: int, parent_id: int, attrs: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration = None
+        self.attrs = attrs
+
+    def as_dict(self) -> dict:
+        return {'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id,
+                'start': self.start, 'duration': self.duration, 'attrs': self.attrs}
+
+
+current_span = contextvars.ContextVar('current_span', default=None)
+# Последние завершенные интервалы, отдаются на /traces.
+finished_spans = deque(maxlen=trace_buffer_size)
+_span_ids = itertools.count(1)
+
+
+def start_span(name: str, **attrs) -> tuple:
+    """
+    Открывает интервал и делает его текущим. Возвращает (span, token) для finish_span.
+    """
+    parent = current_span.get()
+    span_id = next(_span_ids)
+    span = Span(name, parent.trace_id if parent else span_id, span_id, parent.span_id if parent else None, attrs)
+    return span, current_span.set(span)
+
+
+def finish_span(span: Span, token, started: float):
+    span.duration = time.perf_counter() - started
+    current_span.reset(token)
+    finished_spans.append(span)
+
+
+class SpanContext:
+    """
+    Контекстный менеджер интервала. Если задана гистограмма, длительность пишется в нее с меткой call.
+    Сделан классом, а не генератором: он стоит на каждом обращении к трекеру.
+    """
+    __slots__ = ('name', 'attrs', 'histogram', 'span', 'token', 'started')
+
+    def __init__(self, name: str, attrs: dict, histogram: Histogram = None):
+        self.name = name
+        self.attrs = attrs
+        self.histogram = histogram
+
+    def __enter__(self) -> Span:
+        self.started = time.perf_counter()
+        self.span, self.token = start_span(self.name, **self.attrs)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is not None:
+            self.span.attrs['error'] = exc_type.__name__
+        finish_span(self.span, self.token, self.started)
+        if self.histogram is not None:
+            self.histogram.observe_key((self.name,), self.span.duration)
+        return False
+
+
+def span(name: str, **attrs) -> SpanContext:
+    return SpanContext(name, attrs)
+
+
+def measure(call: str, **attrs) -> SpanContext:
+    """
+    Интервал трассировки, длительность которого пишется в call_latency с меткой call.
+    Стоит порядка пары микросекунд - на фоне сетевого запроса к трекеру это доли процента.
+    """
+    return SpanContext(call, attrs, call_latency)
+
+
+def timed(call: str):
+    """
+    Декоратор: оборачивает функцию в measure(call). Подходит и для обычных функций, и для корутин.
+    """
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with measure(call):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with measure(call):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _handler_metrics_middleware() -> type:
+    # aiogram импортируется только ботом: коннектору трекера, рабочим инструментам и тестам метрики нужны без него.
+    from aiogram.dispatcher.handler import current_handler
+    from aiogram.dispatcher.middlewares import BaseMiddleware
+
+    class HandlerMetricsMiddleware(BaseMiddleware):
+        """
+        Замеряет длительность обработчиков сообщений и открывает для каждого из них трассу.
+        """
+
+        async def on_process_message(self, message, data: dict):
+            handler = current_handler.get()
+            data['_metrics'] = (getattr(handler, '__name__', 'unknown'), time.perf_counter(),
+                                *start_span('handler', handler=getattr(handler, '__name__', 'unknown'),
+                                            chat=message.chat.id))
+
+        async def on_post_process_message(self, message, results, data: dict):
+            if '_metrics' in data:
+                name, started, current, token = data.pop('_metrics')
+                finish_span(current, token, started)
+                handler_latency.observe(current.duration, handler=name)
+    return HandlerMetricsMiddleware
+
+
+def __getattr__(name: str):
+    # Класс middleware создается при первом обращении к нему.
+    if name == 'HandlerMetricsMiddleware':
+        globals()[name] = _handler_metrics_middleware()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def traces_handler(request: web.Request) -> web.Response:
+    """
+    Последние интервалы трассировки. Параметр trace оставляет только интервалы одной трассы.
+    """
+    spans = list(finished_spans)
+    if 'trace' in request.query:
+        spans = [item for item in spans if str(item.trace_id) == request.query['trace']]
+    return web.json_response([item.as_dict() for item in spans])
+
+
+async def start_server(host: str = metrics_host, port: int = metrics_port) -> web.AppRunner:
+    """
+    Поднимает локальный http-сервер с /metrics в формате Prometheus и /traces.
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    app.router.add_get('/traces', traces_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from datetime import datetime
+from itertools import count
+from operator import attrgetter
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.callback_data import CallbackData
+
+from config import status_page_size, status_snapshots
+
+# Данные кнопок листания /status: номер снимка, страница и признак "только горящие".
+status_page = CallbackData('status', 'snapshot', 'page', 'hot')
+
+
+class StatusSnapshot:
+    """
+    Задачи пользователя на момент запроса /status, отсортированные по дедлайну (failAt из SLA).
+    Горящие задачи отбираются один раз при создании, поэтому листание не сортирует и не фильтрует заново.
+    """
+    __slots__ = ('id', 'issues', 'hot')
+
+    def __init__(self, snapshot_id: int, issues: list, now: datetime):
+        self.id = snapshot_id
+        self.issues = tuple(sorted(issues, key=attrgetter('deadline')))
+        self.hot = tuple(issue for issue in self.issues if issue.is_hot(now))
+
+    def select(self, hot_only: bool) -> tuple:
+        return self.hot if hot_only else self.issues
+
+
+class StatusPages:
+    """
+    Снимки /status по чатам. Новый /status заменяет снимок чата, кнопки старых сообщений после этого
+    не работают. Хранится не больше max_snapshots чатов, давно не листавшие вытесняются.
+    """
+
+    def __init__(self, page_size: int = status_page_size, max_snapshots: int = status_snapshots):
+        self.page_size = page_size
+        self.max_snapshots = max_snapshots
+        self._snapshots = OrderedDict()
+        self._ids = count(1)
+        from aiogram.utils.emoji import emojize
+        self._previous = emojize(':left_arrow:')
+        self._next = emojize(':right_arrow:')
+        self._hot = emojize(':fire:') + ' Только горящие'
+        self._all = 'Все задачи'
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def take(self, chat_id: int, issues: list, now: datetime) -> StatusSnapshot:
+        """
+        Сохраняет снимок задач чата и возвращает его.
+        """
+        snapshot = self._snapshots[chat_id] = StatusSnapshot(next(self._ids), issues, now)
+        self._snapshots.move_to_end(chat_id)
+        if len(self._snapshots) > self.max_snapshots:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def get(self, chat_id: int, snapshot_id: int):
+        """
+        Снимок чата с номером snapshot_id или None, если он заменен новым или вытеснен.
+        """
+        snapshot = self._snapshots.get(chat_id)
+        if snapshot is None or snapshot.id != snapshot_id:
+            return None
+        self._snapshots.move_to_end(chat_id)
+        return snapshot
+
+    def forget(self, chat_id: int):
+        self._snapshots.pop(chat_id, None)
+
+    def page(self, snapshot: StatusSnapshot, number: int, hot_only: bool = False):
+        """
+        Задачи страницы number. Возвращает (задачи, номер страницы, число страниц).
+        Номер за пределами списка приводится к первой или последней странице.
+        """
+        issues = snapshot.select(hot_only)
+        pages = max(1, -(-len(issues) // self.page_size))
+        number = min(max(number, 0), pages - 1)
+        start = number * self.page_size
+        return issues[start:start + self.page_size], number, pages
+
+    def keyboard(self, snapshot: StatusSnapshot, number: int, pages: int, hot_only: bool = False):
+        """
+        Кнопки листания страницы. Возвращает None, если листать нечего.
+        """
+        buttons = []
+        if number > 0:
+            buttons.append(InlineKeyboardButton(self._previous, callback_data=status_page.new(
+                snapshot=snapshot.id, page=number - 1, hot=int(hot_only))))
+        if number < pages - 1:
+            buttons.append(InlineKeyboardButton(self._next, callback_data=status_page.new(
+                snapshot=snapshot.id, page=number + 1, hot=int(hot_only))))
+        # Переключатель нужен, только если горящие задачи есть, но горят не все.
+        if hot_only or 0 < len(snapshot.hot) < len(snapshot.issues):
+            buttons.append(InlineKeyboardButton(self._all if hot_only else self._hot, callback_data=status_page.new(
+                snapshot=snapshot.id, page=0, hot=int(not hot_only))))
+        return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
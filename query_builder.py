@@ -0,0 +1,134 @@
+import shlex
+import weakref
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from urllib.parse import quote
+
+from config import default_queues, default_statuses, filter_cache_size
+
+
+@dataclass(frozen=True)
+class IssueFilter:
+    """
+    Фильтр задач подписки: очереди, статусы, приоритеты и компоненты. Пустой кортеж - без ограничения по полю.
+    Создается через make_filter, которая приводит значения к единому виду: одинаковые по смыслу фильтры
+    разных пользователей становятся одним объектом и дают одну и ту же строку запроса.
+    """
+    queues: tuple = default_queues
+    statuses: tuple = default_statuses
+    priorities: tuple = ()
+    components: tuple = ()
+
+    def as_dict(self) -> dict:
+        """
+        Фильтр в виде, пригодном для сохранения в состоянии диалога.
+        """
+        return {field.name: list(getattr(self, field.name)) for field in fields(self)}
+
+    def describe(self) -> str:
+        names = {'queues': 'очереди', 'statuses': 'статусы', 'priorities': 'приоритеты', 'components': 'компоненты'}
+        return ', '.join(f'{names[name]}: {" ".join(values)}' for name, values in self.as_dict().items() if values)
+
+    def matches(self, issue: dict) -> bool:
+        """
+        Проходит ли задача в формате ответа трекера через фильтр. Так же, как трекер, но на стороне бота:
+        для изменений, полученных запросом без условий на статус, приоритет и компоненты.
+        """
+        if issue.get('key', '').split('-')[0] not in self.queues:
+            return False
+        if self.statuses and (issue.get('status') or {}).get('key') not in self.statuses:
+            return False
+        if self.priorities and (issue.get('priority') or {}).get('key') not in self.priorities:
+            return False
+        if self.components:
+            names = {component.get('display') for component in issue.get('components') or ()}
+            return not names.isdisjoint(self.components)
+        return True
+
+
+# Названия параметров команды /filter и поля фильтра, которые они задают.
+ARGUMENTS = {'queue': 'queues', 'status': 'statuses', 'priority': 'priorities', 'component': 'components'}
+# Нормализованные фильтры: одинаковые фильтры разных пользователей - один объект.
+# Фильтр, которым больше никто не пользуется, удаляется отсюда сам.
+_filters = weakref.WeakValueDictionary()
+
+
+def _normalize(name: str, values) -> tuple:
+    values = {value.strip() for value in values if value and value.strip()}
+    # Ключи очередей в трекере пишутся заглавными буквами, ключи приоритетов - строчными.
+    # Ключи статусов бывают составными (inProgress), их регистр не меняется.
+    if name == 'queues':
+        values = {value.upper() for value in values}
+    elif name == 'priorities':
+        values = {value.lower() for value in values}
+    return tuple(sorted(values))
+
+
+def make_filter(**values) -> IssueFilter:
+    """
+    Возвращает нормализованный фильтр: значения без повторов и отсортированы, регистр приведен к принятому
+    в трекере. Не заданные поля берутся по умолчанию. Выбрасывает ValueError, если не указано ни одной очереди.
+    """
+    issue_filter = IssueFilter(**{field.name: _normalize(field.name, values.get(field.name, field.default))
+                                  for field in fields(IssueFilter)})
+    if not issue_filter.queues:
+        raise ValueError("Нужна хотя бы одна очередь")
+    # Ключ - значения полей, а не сам фильтр: иначе словарь держал бы его и после последнего пользователя.
+    key = tuple(getattr(issue_filter, field.name) for field in fields(IssueFilter))
+    return _filters.setdefault(key, issue_filter)
+
+
+def filter_from_data(data) -> IssueFilter:
+    """
+    Фильтр из состояния диалога. Без сохраненного фильтра возвращает фильтр по умолчанию.
+    """
+    return make_filter(**data) if data else default_filter
+
+
+def parse_filter(text: str) -> IssueFilter:
+    """
+    Разбирает аргументы команды /filter, например "queue=PCR,OPS status=open,inProgress priority=critical".
+    Значения с пробелами берутся в кавычки: component="Мобильное приложение".
+    Выбрасывает ValueError на неизвестный параметр или неверную запись.
+    """
+    values = {}
+    for argument in shlex.split(text):
+        name, separator, value = argument.partition('=')
+        if not separator or name.lower() not in ARGUMENTS:
+            raise ValueError(f"Неизвестный параметр фильтра: {argument}")
+        values.setdefault(ARGUMENTS[name.lower()], []).extend(value.split(','))
+    return make_filter(**values)
+
+
+def _condition(field: str, values: tuple) -> str:
+    return f'filter={field}:{",".join(quote(value, safe="") for value in values)}&' if values else ''
+
+
+@lru_cache(maxsize=filter_cache_size)
+def compile_filter(issue_filter: IssueFilter, mine: bool = True) -> str:
+    """
+    Строка запроса задач к api трекера с параметрами filter. Кэшируется для filter_cache_size последних фильтров.
+    mine - только задачи владельца токена (assignee:me()). Без него запрашиваются задачи всей очереди.
+    """
+    return ('issues?' + _condition('queue', issue_filter.queues) + ('filter=assignee:me()&' if mine else '') +
+            _condition('status', issue_filter.statuses) + _condition('priority', issue_filter.priorities) +
+            _condition('components', issue_filter.components))
+
+
+def _query_condition(field: str, values: tuple) -> str:
+    # Значения с пробелами и спецсимволами берутся в кавычки.
+    return f' {field}: ' + ', '.join(value if value.isalnum() else f'"{value}"' for value in values) if values else ''
+
+
+@lru_cache(maxsize=filter_cache_size)
+def compile_query(issue_filter: IssueFilter) -> str:
+    """
+    Тот же фильтр на языке запросов трекера, для инкрементального опроса. Кэшируется так же, как compile_filter.
+    """
+    return (_query_condition('Queue', issue_filter.queues).lstrip() + ' Assignee: me()' +
+            _query_condition('Status', issue_filter.statuses) +
+            _query_condition('Priority', issue_filter.priorities) +
+            _query_condition('Components', issue_filter.components))
+
+
+default_filter = make_filter()
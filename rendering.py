@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from datetime import datetime
+
+from config import time_remain, render_cache_size
+from issues import Issue
+from ledger import issue_key
+
+
+class IssueRenderer:
+    """
+    Форматирование задач для сообщений Telegram. Шаблоны собираются и эмодзи разрешаются один раз при создании.
+    Неизменная часть текста задачи кэшируется по ключу задачи вместе с версией, из которой она собрана:
+    полями отпечатка из ledger.issue_digest (название, статус, дедлайн) и признаком горящей задачи.
+    Поля сравниваются напрямую, без подсчета хэша. При каждой отправке заново считается только
+    оставшееся до дедлайна время. В кэше хранится не больше max_entries задач, давно не использованные вытесняются.
+    """
+
+    def __init__(self, max_entries: int = render_cache_size):
+        # Таблицы эмодзи загружаются только вместе с первым рендерером.
+        from aiogram.utils.emoji import emojize
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        alarm = emojize(':red_exclamation_mark:' * 3)
+        fire = emojize(':fire:' * 3)
+        remain = '*До сгорания осталось*: '
+        self._normal = ('*Наименование задачи*: {summary}\n'
+                        '*Дедлайн*: {deadline}\n' + remain).format
+        self._hot = (alarm + 'Эта задача в огне!' + alarm + '\n'
+                     '*Наименование задачи*: {summary}\n' +
+                     fire + '*Дедлайн*: {deadline}\n' + remain).format
+        self.status_header = 'Ваши текущие задачи:'
+        self._hot_header = emojize(':fire:') + ' Горящие задачи:'
+        self._alarm_clock = emojize(':alarm_clock:')
+        self._deadline_passed = emojize(':fire:') + ' Дедлайн задачи наступил'
+
+    def __len__(self):
+        return len(self._cache)
+
+    def render(self, issue: Issue, now: datetime) -> str:
+        """
+        Текст задачи на момент now.
+        """
+        key = issue_key(issue)
+        version = (issue.summary, issue.status, issue.deadline, issue.is_hot(now))
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            static = cached[1]
+        else:
+            self.misses += 1
+            template = self._hot if version[3] else self._normal
+            static = template(summary=issue.summary, deadline=issue.deadline_text)
+            self._cache[key] = (version, static)
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return static + time_remain(issue.deadline, now)
+
+    def page_header(self, number: int, pages: int, hot_only: bool = False) -> str:
+        """
+        Заголовок страницы /status. number считается с нуля.
+        """
+        header = self._hot_header if hot_only else self.status_header
+        return header if pages == 1 else f'{header[:-1]} (страница {number + 1} из {pages}):'
+
+    def alert_header(self, threshold) -> str:
+        """
+        Заголовок напоминания о дедлайне. threshold - сработавший порог, None для warnAt из SLA.
+        """
+        if threshold is None:
+            return f'{self._alarm_clock} Подходит срок SLA по задаче'
+        if threshold:
+            return f'{self._alarm_clock} До дедлайна задачи осталось {threshold}'
+        return self._deadline_passed
@@ -0,0 +1,199 @@
+import asyncio
+import heapq
+import itertools
+import random
+from datetime import datetime
+
+from loguru import logger
+
+from config import poll_interval, poll_jitter, poll_workers, poll_max_backoff
+from metrics import poll_lag
+
+
+class Subscription:
+    """
+    Подписка одного чата на обновления.
+    chat_id - чат, в который отправляются обновления.
+    token - токен трекера пользователя, чтобы не перечитывать его из FSM на каждом опросе.
+    due - время следующего опроса по часам event loop.
+    watermark - время последнего обновления уже доставленных задач (для инкрементального опроса).
+    user_id - пользователь, которому принадлежит состояние диалога. По умолчанию совпадает с чатом.
+    login - логин пользователя в трекере (нужен в командном режиме опроса).
+    failures - число неудачных опросов подряд, от него зависит пауза до следующего опроса.
+    issue_filter - фильтр задач подписки (query_builder.IssueFilter), None - фильтр по умолчанию.
+    retained_at - когда таймеры напоминаний последний раз сверялись с полным списком задач (time.monotonic).
+    """
+    __slots__ = ('chat_id', 'token', 'due', 'watermark', 'user_id', 'login', 'active', 'failures', 'issue_filter',
+                 'in_heap', 'retained_at')
+
+    def __init__(self, chat_id: int, token: str, due: float, watermark: datetime = None, user_id: int = None,
+                 login: str = None, issue_filter=None):
+        self.chat_id = chat_id
+        self.token = token
+        self.due = due
+        self.watermark = watermark
+        self.user_id = chat_id if user_id is None else user_id
+        self.login = login
+        self.active = True
+        self.failures = 0
+        self.issue_filter = issue_filter
+        self.retained_at = None
+        # Лежит ли подписка в куче: во время опроса ее там нет.
+        self.in_heap = False
+
+
+class SubscriptionScheduler:
+    """
+    Единый планировщик подписок. Хранит все подписки в куче по времени следующего опроса
+    и выполняет опросы ограниченным пулом воркеров.
+    job - корутина, принимающая Subscription и выполняющая один опрос. Возвращает None, если опрос удался,
+    иначе - сколько секунд трекер просил подождать (0, если не просил). После неудачного опроса пауза
+    удваивается, но не превышает max_backoff.
+    """
+
+    def __init__(self, job, interval: float = poll_interval, workers: int = poll_workers,
+                 jitter: float = poll_jitter, max_backoff: float = poll_max_backoff):
+        self.job = job
+        self.interval = interval
+        self.workers = workers
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self._heap = []
+        self._subscriptions = {}
+        self._counter = itertools.count()
+        # Число отмененных записей, которые еще лежат в куче.
+        self._removed = 0
+        self._queue = None
+        self._wakeup = None
+        self._tasks = []
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    @property
+    def pending(self) -> int:
+        """
+        Число подписок, время опроса которых наступило, но свободного воркера для них пока нет.
+        """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def __contains__(self, chat_id: int):
+        return chat_id in self._subscriptions
+
+    def get(self, chat_id: int):
+        return self._subscriptions.get(chat_id)
+
+    def _now(self) -> float:
+        return asyncio.get_event_loop().time()
+
+    def _push(self, subscription: Subscription):
+        heapq.heappush(self._heap, (subscription.due, next(self._counter), subscription))
+        subscription.in_heap = True
+        # Будим диспетчер, если новая подписка должна сработать раньше текущей вершины кучи.
+        if self._wakeup is not None and self._heap[0][2] is subscription:
+            self._wakeup.set()
+
+    def subscribe(self, chat_id: int, token: str, delay: float = None, watermark: datetime = None,
+                  user_id: int = None, login: str = None, issue_filter=None) -> Subscription:
+        """
+        Добавляет или заменяет подписку чата. Без явной задержки первый опрос случайно разносится по периоду,
+        чтобы одновременные подписки не опрашивали трекер в один момент.
+        """
+        self.unsubscribe(chat_id)
+        if delay is None:
+            delay = random.uniform(0, self.interval)
+        subscription = Subscription(chat_id, token, self._now() + delay, watermark, user_id, login, issue_filter)
+        self._subscriptions[chat_id] = subscription
+        self._push(subscription)
+        return subscription
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        """
+        Удаляет подписку чата. Запись в куче помечается неактивной и пропускается при извлечении.
+        """
+        subscription = self._subscriptions.pop(chat_id, None)
+        if subscription is None:
+            return False
+        subscription.active = False
+        # Подписка, которая сейчас опрашивается, в куче не лежит и при перестройке не учитывается.
+        if not subscription.in_heap:
+            return True
+        self._removed += 1
+        # Перестраиваем кучу, когда отмененных записей в ней становится больше половины.
+        if self._removed > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[2].active]
+            heapq.heapify(self._heap)
+            self._removed = 0
+        return True
+
+    def _next_due(self, subscription: Subscription) -> float:
+        due = subscription.due + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(due, self._now())
+
+    def _backoff_due(self, subscription: Subscription, retry_after: float) -> float:
+        """
+        Время следующего опроса после неудачи: экспоненциальная пауза со случайным разбросом,
+        но не раньше, чем просил трекер, и не раньше обычного расписания.
+        """
+        backoff = min(self.interval * 2 ** (subscription.failures - 1), self.max_backoff)
+        spread = random.uniform(1 - self.jitter, 1 + self.jitter)
+        # Ожидание по Retry-After тоже разносим, чтобы подписки не вернулись к трекеру одновременно.
+        delay = max(backoff * spread, retry_after * random.uniform(1, 1 + self.jitter))
+        return max(self._now() + delay, self._next_due(subscription))
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._dispatch())]
+        self._tasks += [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Планировщик запущен, подписок: {len(self)}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Планировщик остановлен")
+
+    async def _dispatch(self):
+        """
+        Извлекает из кучи подписки, время которых наступило, и передает их воркерам.
+        """
+        while True:
+            now = self._now()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, subscription = heapq.heappop(self._heap)
+                subscription.in_heap = False
+                if subscription.active:
+                    self._queue.put_nowait(subscription)
+                else:
+                    self._removed -= 1
+            timeout = self._heap[0][0] - now if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            subscription = await self._queue.get()
+            poll_lag.observe(max(0.0, self._now() - subscription.due))
+            try:
+                retry_after = await self.job(subscription)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Ошибка при опросе трекера для чата {subscription.chat_id}")
+                retry_after = 0.0
+            finally:
+                self._queue.task_done()
+            # Подписку могли отменить, пока шел опрос.
+            if subscription.active:
+                if retry_after is None:
+                    subscription.failures = 0
+                    subscription.due = self._next_due(subscription)
+                else:
+                    subscription.failures += 1
+                    subscription.due = self._backoff_due(subscription, retry_after)
+                self._push(subscription)
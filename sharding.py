@@ -0,0 +1,247 @@
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import threading
+
+from loguru import logger
+
+from config import shard_workers, ring_replicas
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Консистентное хеширование: каждый узел занимает replicas точек на кольце, ключ принадлежит
+    ближайшему по часовой стрелке узлу. При добавлении или удалении узла переезжают только ключи,
+    попавшие на его точки, - в среднем доля 1/N.
+    """
+
+    def __init__(self, nodes=(), replicas: int = ring_replicas):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> set:
+        return set(self._owners.values())
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+                self._owners[point] = node
+
+    def remove(self, node):
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                del self._points[bisect.bisect_left(self._points, point)]
+
+    def node_for(self, key):
+        if not self._points:
+            raise LookupError("На кольце нет ни одного узла")
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class ShardChannel:
+    """
+    Канал рабочего процесса к основному: команды приходят из commands(), отчеты уходят через report().
+    """
+
+    def __init__(self, index: int, workers: int, conn):
+        self.index = index
+        self.workers = workers
+        self._conn = conn
+
+    async def commands(self):
+        """
+        Асинхронный итератор команд (command, chat_id, payload). Завершается по команде stop.
+        Команда workers сообщает новое число рабочих процессов: оно сразу записывается в workers.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                message = await loop.run_in_executor(None, self._conn.recv)
+            except EOFError:
+                return
+            if message[0] == 'stop':
+                return
+            if message[0] == 'workers':
+                self.workers = message[2]
+            yield message
+
+    def report(self, message):
+        self._conn.send(message)
+
+
+def _run_worker(serve, index: int, workers: int, conn, args: tuple):
+    asyncio.run(serve(ShardChannel(index, workers, conn), *args))
+
+
+class ShardRouter:
+    """
+    Распределяет подписки по рабочим процессам. Основной процесс принимает обновления Telegram и отправляет
+    команды subscribe/update/unsubscribe процессу, которому чат принадлежит по консистентному хешу chat_id.
+    serve - корутина уровня модуля, выполняемая в рабочем процессе: serve(channel: ShardChannel, *args).
+    on_report - функция основного процесса, получающая (chat_id, user_id, data) от рабочих процессов.
+    args - дополнительные аргументы serve, например настройки приложения. Передаются через pickle.
+    Роутер помнит данные подписок, поэтому при изменении числа процессов переезжающие подписки
+    переносятся вместе с журналом доставки и отметкой времени, а неожиданно завершившийся процесс
+    перезапускается и заново получает все свои подписки.
+    """
+
+    def __init__(self, serve, workers: int = shard_workers, on_report=None, args: tuple = ()):
+        self.serve = serve
+        self.workers = workers
+        self.on_report = on_report
+        self.args = tuple(args)
+        self.ring = HashRing()
+        self.moved = 0
+        self.restarts = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = {}
+        self._subscriptions = {}
+        self._loop = None
+        self._scaling = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    async def start(self):
+        self._loop = asyncio.get_event_loop()
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(f"Запущено рабочих процессов: {self.workers}")
+
+    async def stop(self):
+        for index in list(self._processes):
+            await self._stop_worker(index)
+
+    def subscribe(self, chat_id: int, user_id: int, data: dict, delay: float = None):
+        self._subscriptions[chat_id] = (user_id, dict(data))
+        self._send(chat_id, ('subscribe', chat_id, (user_id, data, delay)))
+
+    def update(self, chat_id: int, data: dict):
+        if chat_id in self._subscriptions:
+            self._subscriptions[chat_id][1].update(data)
+            self._send(chat_id, ('update', chat_id, data))
+
+    def unsubscribe(self, chat_id: int):
+        if self._subscriptions.pop(chat_id, None) is not None:
+            self._send(chat_id, ('unsubscribe', chat_id, None))
+
+    async def scale(self, delta: int) -> int:
+        """
+        Добавляет delta рабочих процессов или, если delta меньше нуля, останавливает, оставляя хотя бы один.
+        Одновременные вызовы выполняются по очереди. Возвращает новое число процессов.
+        """
+        async with self._scaling:
+            workers = max(1, self.workers + delta)
+            if workers != self.workers:
+                await self.resize(workers)
+            return workers
+
+    async def resize(self, workers: int):
+        """
+        Меняет число рабочих процессов. Переезжают только подписки, сменившие владельца на кольце.
+        В боте вызывается через scale по сигналам SIGUSR1 и SIGUSR2 основному процессу.
+        """
+        owners = {chat_id: self.ring.node_for(chat_id) for chat_id in self._subscriptions}
+        previous, self.workers = self.workers, workers
+        for index in range(previous, workers):
+            self._spawn(index)
+        for index in range(workers, previous):
+            self.ring.remove(index)
+        for chat_id, owner in owners.items():
+            new_owner = self.ring.node_for(chat_id)
+            if new_owner == owner:
+                continue
+            self.moved += 1
+            if owner < workers:
+                self._send_to(owner, ('unsubscribe', chat_id, None))
+            user_id, data = self._subscriptions[chat_id]
+            self._send_to(new_owner, ('subscribe', chat_id, (user_id, data, None)))
+        for index in [index for index in self._processes if index >= workers]:
+            await self._stop_worker(index)
+        # Оставшиеся процессы пересчитывают свою долю общих лимитов Telegram и трекера.
+        for index in range(min(previous, workers)):
+            self._send_to(index, ('workers', None, workers))
+
+    def _send(self, chat_id: int, message):
+        self._send_to(self.ring.node_for(chat_id), message)
+
+    def _send_to(self, index: int, message):
+        try:
+            self._processes[index][1].send(message)
+        except (BrokenPipeError, OSError):
+            # Процесс завершился и будет перезапущен: подписки он получит заново из self._subscriptions.
+            logger.warning(f"Рабочий процесс {index} недоступен: подписки он получит заново после перезапуска")
+
+    def _spawn(self, index: int):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_run_worker,
+                                        args=(self.serve, index, self.workers, child_conn, self.args),
+                                        name=f'shard-{index}', daemon=True)
+        process.start()
+        child_conn.close()
+        # Отчеты читаются в отдельном потоке: основной процесс не блокируется, даже если рабочий много пишет.
+        reader = threading.Thread(target=self._read_reports, args=(index, process, conn), name=f'shard-{index}-reports',
+                                  daemon=True)
+        reader.start()
+        self._processes[index] = (process, conn, reader)
+        self.ring.add(index)
+
+    def _read_reports(self, index: int, process, conn):
+        while True:
+            try:
+                chat_id, user_id, data = conn.recv()
+            except (EOFError, OSError):
+                # Канал закрылся: процесс остановлен роутером или упал.
+                if not self._loop.is_closed():
+                    self._loop.call_soon_threadsafe(self._on_exit, index, process)
+                return
+            self._loop.call_soon_threadsafe(self._on_report, chat_id, user_id, data)
+
+    def _on_exit(self, index: int, process):
+        entry = self._processes.get(index)
+        # Остановленный роутером процесс из self._processes уже убран.
+        if entry is None or entry[0] is not process:
+            return
+        asyncio.ensure_future(self._restart(index, entry))
+
+    async def _restart(self, index: int, entry):
+        process, conn, _ = entry
+        await self._loop.run_in_executor(None, process.join)
+        conn.close()
+        if self._processes.get(index) is not entry:
+            return
+        self.restarts += 1
+        logger.error(f"Рабочий процесс {index} неожиданно завершился с кодом {process.exitcode}, перезапускаем")
+        self._spawn(index)
+        for chat_id, (user_id, data) in self._subscriptions.items():
+            if self.ring.node_for(chat_id) == index:
+                self._send_to(index, ('subscribe', chat_id, (user_id, data, None)))
+
+    def _on_report(self, chat_id: int, user_id: int, data: dict):
+        if chat_id in self._subscriptions:
+            self._subscriptions[chat_id][1].update(data)
+        if self.on_report is not None:
+            self.on_report(chat_id, user_id, data)
+
+    async def _stop_worker(self, index: int):
+        process, conn, reader = self._processes.pop(index)
+        self.ring.remove(index)
+        conn.send(('stop', None, None))
+        # Процесс завершает опросы и закрывает свои соединения, после чего закрывает канал - читатель отчетов выходит.
+        await self._loop.run_in_executor(None, process.join)
+        await self._loop.run_in_executor(None, reader.join)
+        conn.close()
@@ -0,0 +1,54 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых запросов. Пока запрос с ключом выполняется, остальные вызовы
+    с тем же ключом не запускают свой, а ждут результат первого.
+    Запрос выполняется в отдельной задаче: отмена одного из ожидающих не отменяет его для остальных.
+    Задача отменяется, только когда ее результат больше никто не ждет.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, factory, on_join=None):
+        """
+        Возвращает результат корутины factory() для ключа key. Ключ None отключает объединение.
+        on_join - функция, которая вызывается, если этот вызов дождется уже выполняющегося запроса.
+        Она получает задачу этого запроса.
+        """
+        if key is None:
+            return await factory()
+        # Задачи привязаны к event loop, поэтому одинаковые запросы из разных loop не объединяются.
+        key = (asyncio.get_running_loop(), key)
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = self._flights[key] = [asyncio.ensure_future(factory()), 0]
+            flight[0].add_done_callback(lambda _: self._land(key, flight))
+        else:
+            self.shared += 1
+            if on_join is not None:
+                on_join(flight[0])
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and flight[1] == 1:
+                # Последний ожидающий ушел: новые вызовы должны запустить запрос заново, а не ждать отмененный.
+                self._land(key, flight)
+                task.cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -0,0 +1,163 @@
+import asyncio
+import copy
+import json
+import sqlite3
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.dispatcher.storage import BaseStorage
+from loguru import logger
+
+from config import fsm_flush_interval
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний диалогов в SQLite (режим WAL), переживающее перезапуск бота.
+    Записи читаются из базы лениво, при первом обращении к чату. Изменения копятся в памяти
+    и пишутся в базу одной транзакцией раз в flush_interval секунд и при закрытии хранилища.
+    Все обращения к базе выполняются в отдельном потоке, чтобы не блокировать event loop.
+    """
+
+    def __init__(self, path: str, flush_interval: float = fsm_flush_interval):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-storage')
+        self._conn = None
+        self._records = {}
+        self._dirty = set()
+        self._flush_handle = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS fsm ('
+                               'chat TEXT, user TEXT, state TEXT, data TEXT, bucket TEXT, '
+                               'PRIMARY KEY (chat, user))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS fsm_state ON fsm (state)')
+            self._conn.commit()
+        return self._conn
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def _select(self, key: tuple) -> dict:
+        row = self._connect().execute('SELECT state, data, bucket FROM fsm WHERE chat = ? AND user = ?',
+                                      key).fetchone()
+        if row is None:
+            return {'state': None, 'data': {}, 'bucket': {}}
+        return {'state': row[0], 'data': json.loads(row[1]), 'bucket': json.loads(row[2])}
+
+    def _write(self, rows: list):
+        conn = self._connect()
+        with conn:
+            for chat, user, record in rows:
+                # Пустые записи удаляем, чтобы завершенные диалоги не копились в базе.
+                if record['state'] is None and not record['data'] and not record['bucket']:
+                    conn.execute('DELETE FROM fsm WHERE chat = ? AND user = ?', (chat, user))
+                else:
+                    conn.execute('INSERT OR REPLACE INTO fsm (chat, user, state, data, bucket) '
+                                 'VALUES (?, ?, ?, ?, ?)',
+                                 (chat, user, record['state'], json.dumps(record['data']),
+                                  json.dumps(record['bucket'])))
+
+    async def _record(self, chat, user) -> dict:
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        record = self._records.get(key)
+        if record is None:
+            record = await self._run(self._select, key)
+            # Пока шло чтение, запись могла появиться из другого обработчика.
+            record = self._records.setdefault(key, record)
+        return record
+
+    def _changed(self, chat, user):
+        self._dirty.add(tuple(map(str, self.check_address(chat=chat, user=user))))
+        if self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        """
+        Записывает накопленные изменения в базу одной транзакцией.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        rows = [(chat, user, copy.deepcopy(self._records[chat, user])) for chat, user in self._dirty]
+        self._dirty.clear()
+        try:
+            await self._run(self._write, rows)
+        except sqlite3.Error:
+            logger.exception("Не удалось сохранить состояния диалогов")
+            self._dirty.update((chat, user) for chat, user, _ in rows)
+
+    async def close(self):
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+
+    async def wait_closed(self):
+        self._executor.shutdown(wait=True)
+
+    async def states(self, state: str) -> list:
+        """
+        Возвращает [(chat, user, data)] всех диалогов в состоянии state прямо из базы,
+        без загрузки остальных записей. Используется для восстановления подписок после перезапуска.
+        """
+        await self.flush()
+
+        def select():
+            rows = self._connect().execute('SELECT chat, user, data FROM fsm WHERE state = ?', (state,)).fetchall()
+            return [(chat, user, json.loads(data)) for chat, user, data in rows]
+        return await self._run(select)
+
+    async def get_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        return (await self._record(chat, user))['state'] or default
+
+    async def get_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        return copy.deepcopy((await self._record(chat, user))['data'] or default or {})
+
+    async def set_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        (await self._record(chat, user))['state'] = state
+        self._changed(chat, user)
+
+    async def set_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        (await self._record(chat, user))['data'] = copy.deepcopy(data or {})
+        self._changed(chat, user)
+
+    async def update_data(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None, data: typing.Dict = None, **kwargs):
+        (await self._record(chat, user))['data'].update(copy.deepcopy(data or {}), **kwargs)
+        self._changed(chat, user)
+
+    async def reset_state(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None, with_data: typing.Optional[bool] = True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None, default: typing.Optional[dict] = None) -> typing.Dict:
+        return copy.deepcopy((await self._record(chat, user))['bucket'] or default or {})
+
+    async def set_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None, bucket: typing.Dict = None):
+        (await self._record(chat, user))['bucket'] = copy.deepcopy(bucket or {})
+        self._changed(chat, user)
+
+    async def update_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None, bucket: typing.Dict = None, **kwargs):
+        (await self._record(chat, user))['bucket'].update(copy.deepcopy(bucket or {}), **kwargs)
+        self._changed(chat, user)
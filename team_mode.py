@@ -0,0 +1,81 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from loguru import logger
+
+from config import YANDEX_TOKEN, team_filter, poll_interval
+from yandex_api_connector import get_headers_async, get_list_issues, iter_issue_entries
+
+
+class TeamPoller:
+    """
+    Командный режим опроса. Открытые задачи очереди запрашиваются сервисным токеном не чаще раза в ttl секунд
+    и раскладываются в индекс по исполнителю. Подписчики получают свои задачи из индекса,
+    поэтому число запросов к трекеру за период не зависит от числа пользователей.
+    """
+
+    def __init__(self, token: str = YANDEX_TOKEN, query: str = team_filter, ttl: float = poll_interval):
+        self.token = token
+        self.query = query
+        self.ttl = ttl
+        self.fetched_at = None
+        self.refreshes = 0
+        self._index = {}
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self.fetched_at is not None and time.monotonic() - self.fetched_at < self.ttl
+
+    async def refresh(self) -> bool:
+        """
+        Перезапрашивает задачи очереди и перестраивает индекс. Возвращает False при ошибке,
+        тогда остается прежний индекс.
+        """
+        headers = await get_headers_async(self.token)
+        if headers is None:
+            logger.warning("Сервисный токен трекера невалиден. Командный режим не может получить задачи")
+            return False
+        index = defaultdict(list)
+        async for entry in iter_issue_entries(headers, self.query):
+            if entry is None:
+                return False
+            by_assignee = defaultdict(list)
+            for issue in entry.issues:
+                assignee = issue.get('assignee')
+                if assignee:
+                    by_assignee[assignee['id']].append(issue)
+            for login, issues in by_assignee.items():
+                index[login].extend(get_list_issues(issues))
+        self._index = dict(index)
+        self.fetched_at = time.monotonic()
+        self.refreshes += 1
+        return True
+
+    async def issues_for(self, login: str):
+        """
+        Возвращает задачи исполнителя login из индекса, при необходимости обновив его.
+        Одновременные обращения ждут одного обновления. None, если задачи очереди еще ни разу не получены.
+        """
+        async with self._lock:
+            if not self._is_fresh():
+                await self.refresh()
+        if self.fetched_at is None:
+            return None
+        return self._index.get(login, [])
+
+    async def updates_for(self, login: str, since: datetime = None):
+        """
+        Возвращает задачи исполнителя, обновленные позже since, и новую отметку времени последнего обновления.
+        """
+        issues = await self.issues_for(login)
+        if issues is None:
+            return None
+        updated = []
+        watermark = since
+        for issue in issues:
+            if issue.updated_at is not None and (since is None or issue.updated_at > since):
+                updated.append(issue)
+                watermark = issue.updated_at if watermark is None else max(watermark, issue.updated_at)
+        return updated, watermark
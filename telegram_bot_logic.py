@@ -1,48 +1,38 @@
 import asyncio
+import signal
+import time
+from collections import Counter
 from datetime import datetime, timedelta
+from functools import cached_property
 from loguru import logger
 
-import aiogram.utils.markdown as md
-from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import Text
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram import exceptions as aioex
 from aiogram.types import ParseMode
-from aiogram.utils import executor
-from aiogram.utils.emoji import emojize
 
 
-from config import TELEGRAM_TOKEN, twenty_min_past, comfortable_format, time_remain, tz
-from yandex_api_connector import get_issues, get_latest_issues
-
-
-logger.add('logs.json', format='{time} {level} {message}',
-           level='INFO', rotation='50 KB', compression='zip', serialize=True)
-
-if TELEGRAM_TOKEN is not None:
-    try:
-        bot = Bot(token=TELEGRAM_TOKEN)
-        logger.info("Бот создан")
-    except aioex.ValidationError:
-        logger.exception("Использован невалидный токен/Такой токен не был зарегистрирован")
-        exit()
-    except Exception as ex:
-        logger.exception("Ошибка при создании бота")
-        logger.exception(str(ex))
-        exit()
-    # Создаем хранилище данных для бота.
-    storage = MemoryStorage()
-    try:
-        dp = Dispatcher(bot, storage=storage)
-        logger.info("Создан диспетчер")
-    except Exception as ex:
-        logger.exception("Ошибка при создании диспетчера")
-        logger.exception(str(ex))
-elif TELEGRAM_TOKEN is None:
-    logger.warning("Был передан токен с значанием None. Возможно, Неверно передана переменная окружения")
-    exit()
+from admission import BACKGROUND, INTERACTIVE, background
+from change_feed import ChangeFeed
+from config import Settings, alert_max_threshold, alerts_resync, settings, tz
+from deadlines import DeadlineEngine, parse_threshold
+from delivery import DeliveryQueue
+from issues import Issue
+from ledger import DeliveryLedger, issue_key
+from logging_setup import setup_logging
+from metrics import HandlerMetricsMiddleware, queue_depth, start_server, timed
+from paging import StatusPages, StatusSnapshot, status_page
+from query_builder import IssueFilter, compile_filter, default_filter, filter_from_data, parse_filter
+from rendering import IssueRenderer
+from scheduler import SubscriptionScheduler, Subscription
+from sharding import ShardRouter, ShardChannel
+from storage import SQLiteStorage
+from team_mode import TeamPoller
+from webhook import run_webhook
+from yandex_api_connector import (get_issue_pages_async, get_updated_issues_async, get_login_async, close_session,
+                                  tracker_backoff, admission as tracker_admission)
 
 
 # Класс в котором будем сохранять данные по email и ответам пользователя.
@@ -56,7 +46,6 @@ class Form(StatesGroup):
     yes_or_not = State()
 
 
-@dp.message_handler(commands='start')
 async def cmd_start(message: types.Message, state: FSMContext):
     """
     Точка входа в диалог с ботом.
@@ -74,7 +63,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
         "пользователя и отправить мне сгенерированный там токен: "
         "https://oauth.yandex-team.ru/authorize?response_type=token&client_id=5f671d781aca402ab7460fde4050267b"
                         )
-    await bot.send_message(message.chat.id,
+    await app.bot.send_message(message.chat.id,
                            "Эта ссылка отправит тебя на страницу аутентификации Яндекса. Токен будет храниться внутри "
                            "этог диалога. Если ты захочешь его удалить введи команду /cancel. Она отчистит токен и " 
                            "завершит диалог со мной.",
@@ -82,8 +71,6 @@ async def cmd_start(message: types.Message, state: FSMContext):
                            )
 
 
-@dp.message_handler(state='*', commands='cancel')
-@dp.message_handler(Text(equals='cancel', ignore_case=True), state='*')
 async def cancel_handler(message: types.Message, state: FSMContext):
     """
     Обработчик команды "/cancel". Удаляет все данные по state.
@@ -93,15 +80,14 @@ async def cancel_handler(message: types.Message, state: FSMContext):
         return
 
     logger.info('Canceling state %r', current_state)
+    # Снимаем подписку на обновления, если она была.
+    unsubscribe_chat(message.chat.id)
+    app.status_pages.forget(message.chat.id)
     await state.finish()
-    # Задаем доп. значения для ответа. Необходимо для двойной проверки цикла на выход из него.
-    async with state.proxy() as data:
-        data['answer'] = None
     markup = types.ReplyKeyboardRemove()
     await message.reply("Алоха!(что означает 'привет' и 'пока' на гавайском)", reply_markup=markup)
 
 
-@dp.message_handler(state='*', commands='status')
 async def get_all_tasks(message: types.Message, state: FSMContext):
     """
    Обработчик команды "/status". возвращает все задачи, которые есть у юзера на данный момент.
@@ -113,29 +99,79 @@ async def get_all_tasks(message: types.Message, state: FSMContext):
         return
     # получаем из state email.
     async with state.proxy() as data:
-        tasks = get_issues(data['token'])
-        # Отлавливаем вариант, когда email передан неверно.
-        if tasks is None:
-            await bot.send_message(
-                message.chat.id, "Введен некорректный email/такого юзера не существует. Повторите попытку")
+        token = data['token']
+        issue_filter = filter_from_data(data.get('filter'))
+    pages = await get_issue_pages_async(token, issue_filter=issue_filter)
+    backoff = tracker_backoff()
+    # Отлавливаем вариант, когда email передан неверно.
+    if pages is None:
+        if backoff is not None:
+            await app.bot.send_message(message.chat.id, f"Трекер сейчас недоступен. Повторите попытку "
+                                                    f"через {max(1, round(backoff / 60))} мин.")
             return
-        elif len(tasks) == 0:
-            await bot.send_message(
-                message.chat.id, "У вас пока нет открытых задач")
-        elif len(tasks) > 0:
-            await bot.send_message(
-                message.chat.id,
-                md.text(
-                    md.text("Ваши текущие задачи:"),
-                    sep='\n'
-                ),
-                parse_mode=ParseMode.MARKDOWN
-            )
-            # Возвращаем сообщение с таксками.
-            await send_issues(message, tasks)
+        await app.bot.send_message(
+            message.chat.id, "Введен некорректный email/такого юзера не существует. Повторите попытку")
+        return
+    # Возвращаем сообщение с таксками.
+    await send_status(message.chat.id, pages)
+    if backoff is not None:
+        # Предупреждение идет через ту же очередь чата, чтобы прийти после списка задач.
+        await app.delivery.send(message.chat.id, ["Трекер сейчас недоступен, задачи показаны по последним данным "
+                                                  "и могли устареть"], parse_mode=None)
+
+
+async def set_alerts(message: types.Message, state: FSMContext):
+    """
+    Обработчик команды "/alerts". Задает, за сколько до дедлайна присылать напоминания, например "/alerts 4h 1h 0".
+    Без аргументов показывает текущие пороги.
+    """
+    if await state.get_state() is None:
+        await message.reply("token не был указан. Воспользуйся командой /start и после указания token повтори попытку.")
+        return
+    args = message.get_args().split()
+    if not args:
+        current = ', '.join(str(threshold) for threshold in app.alerts.thresholds_for(message.chat.id))
+        await message.reply(f"Напоминания приходят за {current} до дедлайна. Изменить: /alerts 4h 30m 0")
+        return
+    try:
+        thresholds = [parse_threshold(arg) for arg in args]
+    except ValueError:
+        await message.reply(f"Не понял пороги: они задаются от 0 до {alert_max_threshold.days} дней. "
+                            f"Пример: /alerts 4h 30m 0")
+        return
+    async with state.proxy() as data:
+        data['alerts'] = [threshold.total_seconds() for threshold in thresholds]
+    update_subscription(message.chat.id, {'alerts': data['alerts']})
+    await message.reply("Пороги напоминаний сохранены")
+
+
+async def set_filter(message: types.Message, state: FSMContext):
+    """
+    Обработчик команды "/filter". Задает очереди, статусы, приоритеты и компоненты задач,
+    например "/filter queue=PCR,OPS status=open,inProgress priority=critical component=Backend".
+    "/filter reset" возвращает фильтр по умолчанию, без аргументов показывает текущий фильтр.
+    """
+    if await state.get_state() is None:
+        await message.reply("token не был указан. Воспользуйся командой /start и после указания token повтори попытку.")
+        return
+    args = message.get_args().strip()
+    if not args:
+        async with state.proxy() as data:
+            current = filter_from_data(data.get('filter'))
+        await message.reply(f"Текущий фильтр: {current.describe()}. "
+                            f"Изменить: /filter queue=PCR,OPS status=open priority=critical component=Backend")
+        return
+    try:
+        issue_filter = default_filter if args.lower() == 'reset' else parse_filter(args)
+    except ValueError as ex:
+        await message.reply(f"Не понял фильтр: {ex}. Пример: /filter queue=PCR,OPS status=open")
+        return
+    async with state.proxy() as data:
+        data['filter'] = issue_filter.as_dict()
+    update_subscription(message.chat.id, {'filter': data['filter']})
+    await message.reply(f"Фильтр сохранен: {issue_filter.describe()}")
 
 
-@dp.message_handler(state=Form.token)
 async def process_email(message: types.Message, state: FSMContext):
     """
     Функция обрабатывает полученный email и возвращает список всех задач, после чего предлагает перейти к циклу.
@@ -144,38 +180,25 @@ async def process_email(message: types.Message, state: FSMContext):
         # Записываем в state значение email по ключу.
         data['token'] = message.text
         # получаем задачи
-        tasks = get_issues(data['token'])
+        pages = await get_issue_pages_async(data['token'], issue_filter=filter_from_data(data.get('filter')))
         # Проверяем валидность переданного email.
-        if tasks is None:
-            await bot.send_message(
+        if pages is None:
+            await app.bot.send_message(
                 message.chat.id, "Введен некорректный token. Повторите попытку")
             return
-        elif len(tasks) == 0:
-            await bot.send_message(
-                message.chat.id, "У вас пока нет открытых задач")
-        elif len(tasks) > 0:
-            await bot.send_message(
-                message.chat.id,
-                md.text(
-                    md.text("Ваши текущие задачи:"),
-                    sep='\n'
-                ),
-                parse_mode=ParseMode.MARKDOWN
-            )
-            # Возвращаем сообщение с таксками.
-            await send_issues(message, tasks)
+        # Возвращаем сообщение с таксками.
+        await send_status(message.chat.id, pages)
 
         # Создаем клавиатуру.
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, selective=True)
         markup.add("да", "нет")
         # Переходим к следующему стейту. Теперь все сообщения будут обрабатываться следующей функцией.
         await Form.next()
-        await bot.send_message(message.chat.id,
+        await app.bot.send_message(message.chat.id,
                                "Хотите подписаться на обновления вашего трекера задач?",
                                reply_markup=markup)
 
 
-@dp.message_handler(lambda message: message.text.lower() not in ['да', 'нет'], state=Form.yes_or_not)
 async def process_confirm_invalid(message: types.Message):
     """
     Отрабатывем ситуацию, когда пользователь ответил не то, что нужно.
@@ -183,7 +206,6 @@ async def process_confirm_invalid(message: types.Message):
     return await message.reply('Не верный выбор. Воспользуйся клавиатурой. Для тебя же старались')
 
 
-@dp.message_handler(state=Form.yes_or_not)
 async def loop_request(message: types.Message, state: FSMContext):
     """
     Отрабатываем небольшое ветвление, если пользоватлеь хочет, или не хочет получать обновления.
@@ -191,88 +213,642 @@ async def loop_request(message: types.Message, state: FSMContext):
     if message.text.lower() == "нет":
         markup = types.ReplyKeyboardRemove()
 
-        await bot.send_message(
+        await app.bot.send_message(
             message.chat.id,
             "Ну, на нет и суда нет. Зачем это все было тогда?",
             reply_markup=markup
         )
         await state.finish()
     else:
+        # Все текущие задачи пользователь уже получил, поэтому обновления отсчитываются от текущего момента.
+        watermark = datetime.now(tz)
         async with state.proxy() as data:
             # Записываем ответ пользователя в соответствующий state.
             data['answer'] = message.text
+            data['watermark'] = watermark.isoformat()
+            data['ledger'] = app.ledger.dump(message.chat.id)
+            # В командном режиме и режиме ленты изменений задачи раздаются по логину исполнителя.
+            if app.settings.sync_mode in ('team', 'changelog'):
+                data['login'] = await get_login_async(data['token'])
+            subscription = data.as_dict()
         # Удаляем клавиатуру.
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, selective=True)
         markup.add('/status', '/cancel')
-        await bot.send_message(
+        await app.bot.send_message(
                 message.chat.id,
                 "С этого момента, каждые 20 минут, ты будешь получать обновления, если таковые будут",
                 reply_markup=markup
             )
-        # Проверяем, что стейты по-прежнему не пусты и переходим к циклу обновления.
-        current_state = await state.get_state()
-        while current_state is not None:
-            # Каждый раз в начале цикла проверяем.
-            current_state = await state.get_state()
-
-            async with state.proxy() as data:
-                # В случае, если пользователь вышел из цикла ключ answer возврощает None(см. def cancel_handler).
-                if data['answer'] is None:
-                    break
-                # Получаем список задач
-                tasks = get_latest_issues(data['token'])
-                # Проверяем, что список не пустой, тогда высылаем таски.
-                if len(tasks) == 0:
-                    pass
-                elif len(tasks) > 0:
-                    await send_issues(message, tasks)
-
-                # Получаем задачи.
-            await asyncio.sleep(1200)
-        # Подчищаем стейты, если пользователь вышел из цикла.
-        await state.finish()
+        # Передаем подписку планировщику. Отменяется она командой /cancel.
+        # Первый опрос сразу: он ставит таймеры напоминаний, а уже отправленные задачи отсеет журнал доставки.
+        subscribe_chat(message.chat.id, message.from_user.id, subscription, delay=0)
 
 
-async def send_issues(message: types.Message, tasks: list):
+def start_subscription(chat_id: int, user_id: int, data: dict, delay: float = None):
     """
-    Функция принимает объект message, из которого получает id чата, и токен, который достается из базы диалога.
-    Функция запрашивает список новых задач и отправляет их пользователю.
+    Ставит подписку в планировщик этого процесса вместе с журналом доставки и порогами напоминаний.
+    data - данные диалога пользователя.
     """
-    # Парсим каждую задачу в списке
-    for task in tasks:
-        if task['deadline'].astimezone(tz) - timedelta(hours=4) <= datetime.now(tz):
-            await bot.send_message(
-                message.chat.id,
-                md.text(
-                    md.text(f'{emojize(":red_exclamation_mark:" * 3)}'
-                            f'Эта задача в огне!'
-                            f'{emojize(":red_exclamation_mark:" * 3)}'),
-                    md.text(f'*Наименование задачи*: {task["issue"]}'),
-                    md.text(f'{emojize(":fire:" * 3)}'
-                            f'*Дедлайн*: '
-                            f'{datetime.strftime(task["deadline"].astimezone(tz), comfortable_format)}'),
-                    md.text(f'*До сгорания осталось*: {time_remain(task["deadline"])}'),
-                    sep='\n',
-                ),
-                parse_mode=ParseMode.MARKDOWN,
-            )
+    watermark = datetime.fromisoformat(data['watermark']) if data.get('watermark') else None
+    previous = app.scheduler.get(chat_id)
+    if previous is not None:
+        release_team(previous.issue_filter)
+    subscription = app.scheduler.subscribe(chat_id, data['token'], delay=delay, watermark=watermark,
+                                           user_id=user_id, login=data.get('login'),
+                                           issue_filter=filter_from_data(data.get('filter')))
+    hold_team(subscription.issue_filter)
+    app.ledger.load(chat_id, data.get('ledger'))
+    apply_subscription_update(chat_id, data)
+
+
+def apply_subscription_update(chat_id: int, data: dict):
+    subscription = app.scheduler.get(chat_id)
+    if subscription is not None and 'filter' in data:
+        issue_filter = filter_from_data(data['filter'])
+        if issue_filter is not subscription.issue_filter:
+            # Задачи новых очередей могли обновиться раньше отметки: следующий опрос запросит все открытые,
+            # а уже доставленные отсеет журнал доставки.
+            release_team(subscription.issue_filter)
+            hold_team(issue_filter)
+            subscription.issue_filter = issue_filter
+            subscription.watermark = None
+    if data.get('alerts'):
+        app.alerts.set_thresholds(chat_id, [timedelta(seconds=seconds) for seconds in data['alerts']])
+
+
+def stop_subscription(chat_id: int):
+    subscription = app.scheduler.get(chat_id)
+    if subscription is not None:
+        release_team(subscription.issue_filter)
+    app.scheduler.unsubscribe(chat_id)
+    app.ledger.forget(chat_id)
+    app.alerts.remove(chat_id)
+
+
+def subscribe_chat(chat_id: int, user_id: int, data: dict, delay: float = None):
+    """
+    Оформляет подписку в этом процессе или, если включено шардирование, в рабочем процессе, которому принадлежит чат.
+    """
+    if app.shards is None:
+        start_subscription(chat_id, user_id, data, delay)
+    else:
+        app.shards.subscribe(chat_id, user_id, data, delay)
+
+
+def update_subscription(chat_id: int, data: dict):
+    apply_subscription_update(chat_id, data)
+    if app.shards is not None:
+        app.shards.update(chat_id, data)
+
+
+def unsubscribe_chat(chat_id: int):
+    stop_subscription(chat_id)
+    if app.shards is not None:
+        app.shards.unsubscribe(chat_id)
+
+
+@timed('poll')
+@background
+async def poll_subscription(subscription: Subscription):
+    """
+    Один опрос трекера по подписке. Вызывается планировщиком. Возвращает None, если трекер ответил,
+    иначе - сколько секунд подождать до следующего обращения к нему.
+    """
+    watermark = None
+    if app.settings.sync_mode == 'full':
+        pages = await get_issue_pages_async(subscription.token, issue_filter=subscription.issue_filter)
+        if pages is None:
+            return tracker_backoff() or 0.0
+        # Сравниваем с журналом доставки постранично, не собирая весь список задач в памяти.
+        changed = 0
+        keys = set()
+        async for tasks in pages:
+            # Пока шел запрос, пользователь мог отписаться: его таймеры и журнал уже удалены.
+            if not subscription.active:
+                return None
+            app.alerts.update(subscription.chat_id, tasks)
+            keys.update(issue_key(task) for task in tasks)
+            changed += await send_changes(subscription, tasks)
+        # Закрытые и переназначенные задачи больше не напоминают о себе.
+        retain_alerts(subscription, keys)
+    else:
+        if app.settings.sync_mode in ('team', 'changelog'):
+            # Логин мог не определиться при подписке (трекер был недоступен) или подписка оформлена в режиме full.
+            if subscription.login is None and not await resolve_login(subscription):
+                return tracker_backoff() or 0.0
+            result = await team_for(subscription.issue_filter).updates_for(subscription.login, subscription.watermark)
         else:
-            await bot.send_message(
-                message.chat.id,
-                md.text(
-                    md.text(f'*Наименование задачи*: {task["issue"]}'),
-                    md.text(f'*Дедлайн*: {datetime.strftime(task["deadline"].astimezone(tz), comfortable_format)}'),
-                    md.text(f'*До сгорания осталось*: {time_remain(task["deadline"])}'),
-                    sep='\n',
-                ),
-                parse_mode=ParseMode.MARKDOWN,
-            )
+            result = await get_updated_issues_async(subscription.token, subscription.watermark,
+                                                    subscription.issue_filter)
+        if not subscription.active:
+            return None
+        if result is None:
+            return tracker_backoff() or 0.0
+        complete = subscription.watermark is None
+        tasks, watermark = result
+        if app.settings.sync_mode in ('team', 'changelog'):
+            # Снимок очереди уже в памяти: таймеры сверяются с полным списком задач исполнителя.
+            snapshot = await team_for(subscription.issue_filter).issues_for(subscription.login) or []
+            if not subscription.active:
+                return None
+            app.alerts.update(subscription.chat_id, snapshot)
+            app.alerts.retain(subscription.chat_id, {issue_key(task) for task in snapshot})
+        else:
+            app.alerts.update(subscription.chat_id, tasks)
+            if complete:
+                # Без отметки опрос вернул все открытые задачи: сверять с ними можно сразу.
+                retain_alerts(subscription, {issue_key(task) for task in tasks})
+            else:
+                await resync_alerts(subscription)
+        changed = await send_changes(subscription, tasks)
+        # Сдвигаем отметку только после доставки, чтобы при ошибке отправки задачи пришли в следующий раз.
+        subscription.watermark = watermark
+    # Сохраняем журнал и отметку в состоянии диалога, чтобы после перезапуска не присылать задачи повторно.
+    if subscription.active and (changed or watermark is not None):
+        data = {'ledger': app.ledger.dump(subscription.chat_id)}
+        if watermark is not None:
+            data['watermark'] = watermark.isoformat()
+        await store_subscription(subscription, data)
+    # Задачи могли прийти из кэша: тогда следующий опрос откладывается, как после ошибки.
+    return tracker_backoff()
 
 
-if __name__ == '__main__':
+async def store_subscription(subscription: Subscription, data: dict):
+    """
+    Сохраняет данные подписки в состоянии диалога.
+    """
+    if app.shard_channel is not None:
+        # Хранилищем владеет основной процесс: рабочий отправляет ему изменения.
+        app.shard_channel.report((subscription.chat_id, subscription.user_id, data))
+    else:
+        await app.storage.update_data(chat=subscription.chat_id, user=subscription.user_id, data=data)
+
+
+async def resolve_login(subscription: Subscription) -> bool:
+    """
+    Узнает логин пользователя в трекере для командного режима и режима ленты изменений и сохраняет его
+    в состоянии диалога. Возвращает False, если трекер не ответил или токен невалиден.
+    """
+    login = await get_login_async(subscription.token)
+    if login is None:
+        logger.warning(f"Не удалось узнать логин пользователя чата {subscription.chat_id} в трекере. "
+                       f"Задачи будут запрошены после паузы")
+        return False
+    subscription.login = login
+    if subscription.active:
+        await store_subscription(subscription, {'login': login})
+    return True
+
+
+def retain_alerts(subscription: Subscription, keys: set):
+    # Пока трекер недоступен, задачи приходят из кэша и могут быть неполными: таймеры не сокращаем.
+    if subscription.active and tracker_backoff() is None:
+        app.alerts.retain(subscription.chat_id, keys)
+        subscription.retained_at = time.monotonic()
+
+
+async def resync_alerts(subscription: Subscription):
+    """
+    Инкрементальный режим: раз в alerts_resync секунд сверяет таймеры напоминаний с полным списком задач.
+    Закрытые задачи и задачи с остановленным SLA в обновления не попадают, и без сверки напоминания
+    о них продолжали бы приходить. Первая сверка - при первом опросе подписки: обновления отсчитываются
+    от отметки, и без нее таймеры для уже существующих задач не были бы поставлены.
+    """
+    if subscription.retained_at is not None and time.monotonic() - subscription.retained_at < alerts_resync:
+        return
+    pages = await get_issue_pages_async(subscription.token, issue_filter=subscription.issue_filter)
+    if pages is None:
+        return
+    keys = set()
+    async for tasks in pages:
+        if not subscription.active:
+            return
+        app.alerts.update(subscription.chat_id, tasks)
+        keys.update(issue_key(task) for task in tasks)
+    retain_alerts(subscription, keys)
+
+
+async def send_changes(subscription: Subscription, tasks: list) -> int:
+    """
+    Отправляет подписчику только задачи, изменившиеся с последней доставки. Возвращает их число.
+    Отмененной подписке ничего не отправляется.
+    """
+    if not subscription.active:
+        return 0
+    changed = app.ledger.diff(subscription.chat_id, tasks)
+    if changed:
+        await send_issues(subscription.chat_id, changed, subscription=subscription)
+    return len(changed)
+
+
+async def send_alert(chat_id: int, task: Issue, threshold):
+    """
+    Напоминание о приближающемся дедлайне. Вызывается движком таймеров в момент срабатывания.
+    """
+    header = app.renderer.alert_header(threshold)
+    await app.delivery.send(chat_id, [header, issue_text(task, datetime.now(tz))], parse_mode=ParseMode.MARKDOWN)
+
+
+def team_for(issue_filter: IssueFilter) -> TeamPoller:
+    """
+    Опрос командного режима или ленты изменений для фильтра. Подписчики с одинаковым фильтром делят
+    одни запросы задач очереди. Опрос фильтра, которым больше не пользуется ни одна подписка, удаляет release_team.
+    """
+    issue_filter = issue_filter or default_filter
+    poller = app.teams.get(issue_filter)
+    if poller is None:
+        if app.settings.sync_mode == 'changelog':
+            poller = ChangeFeed(issue_filter=issue_filter)
+        else:
+            poller = TeamPoller(query=compile_filter(issue_filter, mine=False))
+        app.teams[issue_filter] = poller
+    return poller
+
+
+def hold_team(issue_filter: IssueFilter):
+    """
+    Отмечает, что подписка этого процесса пользуется фильтром.
+    """
+    app.team_users[issue_filter or default_filter] += 1
+
+
+def release_team(issue_filter: IssueFilter):
+    """
+    Снимает отметку hold_team. Когда фильтром больше никто не пользуется, его опрос вместе с индексом
+    задач очереди удаляется: число опросов трекера за период растет с числом используемых фильтров,
+    а не со всеми фильтрами, когда-либо заданными через /filter.
+    """
+    issue_filter = issue_filter or default_filter
+    app.team_users[issue_filter] -= 1
+    if app.team_users[issue_filter] <= 0:
+        del app.team_users[issue_filter]
+        app.teams.pop(issue_filter, None)
+
+
+async def send_status(chat_id: int, pages):
+    """
+    Показывает задачи пользователя одним сообщением с первой страницей и кнопками листания.
+    Страницы трекера собираются в снимок, отсортированный по дедлайну: листание идет по нему,
+    без новых запросов к трекеру. Весь снимок отмечается в журнале доставки как показанный.
+    Сообщение уходит через очередь доставки: с лимитами Telegram и после уже поставленных в очередь чата.
+    """
+    tasks = []
+    async for page in pages:
+        tasks.extend(page)
+    if not tasks:
+        await app.delivery.send(chat_id, ["У вас пока нет открытых задач"], parse_mode=None)
+        return
+    now = datetime.now(tz)
+    snapshot = app.status_pages.take(chat_id, tasks, now)
+    app.ledger.commit(chat_id, tasks)
+    text, markup = status_page_text(snapshot, 0, False, now)
+    await app.delivery.send(chat_id, [text], parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+
+
+def status_page_text(snapshot: StatusSnapshot, number: int, hot_only: bool, now: datetime):
+    """
+    Текст и кнопки страницы снимка. Форматируются только задачи этой страницы.
+    """
+    tasks, number, pages = app.status_pages.page(snapshot, number, hot_only)
+    texts = [app.renderer.page_header(number, pages, hot_only)] + [issue_text(task, now) for task in tasks]
+    return '\n\n'.join(texts), app.status_pages.keyboard(snapshot, number, pages, hot_only)
+
+
+async def turn_status_page(query: types.CallbackQuery, callback_data: dict):
+    """
+    Обработчик кнопок листания /status: перерисовывает то же сообщение нужной страницей снимка.
+    """
+    chat_id = query.message.chat.id
+    snapshot = app.status_pages.get(chat_id, int(callback_data['snapshot']))
+    if snapshot is None:
+        await query.answer("Список задач устарел, запросите /status")
+        return
+    text, markup = status_page_text(snapshot, int(callback_data['page']), callback_data['hot'] == '1',
+                                    datetime.now(tz))
+    await query.answer()
+    try:
+        await query.message.edit_text(text, parse_mode=ParseMode.MARKDOWN, reply_markup=markup)
+    except aioex.MessageNotModified:
+        # Повторное нажатие той же кнопки: страница уже показана.
+        pass
+
+
+def issue_text(task: Issue, now: datetime) -> str:
+    """
+    Форматирует одну задачу для отправки в Telegram.
+    """
+    return app.renderer.render(task, now)
+
+
+@timed('send_issues')
+async def send_issues(chat_id: int, tasks: list, header: str = None, subscription: Subscription = None):
+    """
+    Функция принимает id чата и список задач и отправляет их пользователю.
+    Задачи склеиваются в сообщения и уходят через очередь доставки с учетом лимитов Telegram.
+    subscription - подписка, по которой отправляются задачи: если ее отменили во время отправки,
+    журнал доставки отписавшегося чата не восстанавливается.
+    """
+    if not tasks:
+        return
+    now = datetime.now(tz)
+    texts = [issue_text(task, now) for task in tasks]
+    if header is not None:
+        texts.insert(0, header)
+    await app.delivery.send(chat_id, texts, parse_mode=ParseMode.MARKDOWN)
+    if subscription is None or subscription.active:
+        app.ledger.commit(chat_id, tasks)
+
+
+async def resume_subscriptions(dispatcher: Dispatcher):
+    """
+    Восстанавливает подписки из хранилища после перезапуска. Трекер при этом не опрашивается:
+    первые опросы планировщик случайно распределяет по периоду.
+    """
+    if not isinstance(dispatcher.storage, SQLiteStorage):
+        return
+    for chat, user, data in await dispatcher.storage.states(Form.yes_or_not.state):
+        if not data.get('answer') or not data.get('token'):
+            continue
+        subscribe_chat(int(chat), int(user), data)
+    logger.info(f"Восстановлено подписок: {len(app.shards if app.shards is not None else app.scheduler)}")
+
+
+def store_shard_report(chat_id: int, user_id: int, data: dict):
+    """
+    Сохраняет в хранилище журнал и отметку, присланные рабочим процессом.
+    """
+    task = asyncio.ensure_future(app.storage.update_data(chat=chat_id, user=user_id, data=data))
+    app.shard_reports.add(task)
+    task.add_done_callback(app.shard_reports.discard)
+
+
+def share_limits(workers: int):
+    """
+    Доля рабочего процесса в общих лимитах при workers рабочих процессах.
+    """
+    # Общий лимит Telegram делится между процессами.
+    app.delivery.global_bucket.rate = app.settings.telegram_global_rate / workers
+    # Бюджет запросов к трекеру тоже делится: на рабочие процессы и основной, отвечающий на команды.
+    tracker_admission.rate = app.settings.tracker_rate / (workers + 1)
+
+
+async def serve_shard(channel: ShardChannel, settings: Settings = settings):
+    """
+    Рабочий процесс шарда: опрашивает трекер по своим подписчикам и сам отправляет им сообщения.
+    Команды подписки приходят от основного процесса, settings - настройки, с которыми он запущен.
+    """
+    # Рабочий процесс запускается с импортом модуля, поэтому лог и приложение собираются здесь.
+    create_app(settings)
+    setup_logging(app.settings.log_file, app.settings.log_level)
+    app.shard_channel = channel
+    app.export_queue_depth()
+    share_limits(channel.workers)
+    # Метрики у каждого процесса свои: рабочие слушают порты после порта основного.
+    metrics_port = app.settings.metrics_port
+    app.metrics_server = await start_server(port=metrics_port + 1 + channel.index) if metrics_port else None
+    await app.alerts.start()
+    await app.scheduler.start()
+    try:
+        async for command, chat_id, payload in channel.commands():
+            if command == 'subscribe':
+                start_subscription(chat_id, *payload)
+            elif command == 'update':
+                apply_subscription_update(chat_id, payload)
+            elif command == 'unsubscribe':
+                stop_subscription(chat_id)
+            elif command == 'workers':
+                share_limits(payload)
+    finally:
+        await app.scheduler.stop()
+        await app.alerts.stop()
+        await app.delivery.close()
+        await close_session()
+        await app.bot.session.close()
+        if app.metrics_server is not None:
+            await app.metrics_server.cleanup()
+
+
+def scale_shards(delta: int):
+    """
+    Обработчик сигналов SIGUSR1 и SIGUSR2: добавляет или останавливает рабочий процесс.
+    Переезжают только подписки, сменившие владельца на кольце.
+    """
+    async def scale():
+        try:
+            workers = await app.shards.scale(delta)
+        except Exception:
+            logger.exception("Не удалось изменить число рабочих процессов")
+            return
+        # Доля основного процесса в бюджете запросов к трекеру пересчитывается так же, как при запуске.
+        tracker_admission.rate = app.settings.tracker_rate / (workers + 1)
+        logger.info(f"Рабочих процессов: {workers}, всего переехало подписок: {app.shards.moved}")
+    asyncio.ensure_future(scale())
+
+
+async def on_startup(dispatcher: Dispatcher):
+    """
+    Запускает рабочие процессы, если включено шардирование, восстанавливает подписки из хранилища
+    и запускает планировщик, таймеры напоминаний и сервер метрик.
+    """
+    app.export_queue_depth()
+    if app.settings.metrics_port:
+        app.metrics_server = await start_server(port=app.settings.metrics_port)
+    # Бюджет запросов к трекеру делится между основным процессом и рабочими, если они есть.
+    tracker_admission.rate = app.settings.tracker_rate / (app.settings.shard_workers + 1)
+    if app.shards is not None:
+        await app.shards.start()
+        # Число рабочих процессов меняется без перезапуска: SIGUSR1 добавляет процесс, SIGUSR2 останавливает один.
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGUSR1, scale_shards, 1)
+        loop.add_signal_handler(signal.SIGUSR2, scale_shards, -1)
+    await resume_subscriptions(dispatcher)
+    await app.alerts.start()
+    await app.scheduler.start()
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """
+    Останавливает рабочие процессы, планировщик и таймеры, дожидается отправки очереди сообщений
+    и закрывает общую HTTP-сессию трекера.
+    """
+    if app.shards is not None:
+        loop = asyncio.get_event_loop()
+        loop.remove_signal_handler(signal.SIGUSR1)
+        loop.remove_signal_handler(signal.SIGUSR2)
+        await app.shards.stop()
+        await asyncio.gather(*app.shard_reports)
+    await app.scheduler.stop()
+    await app.alerts.stop()
+    await app.delivery.close()
+    await close_session()
+    if app.metrics_server is not None:
+        await app.metrics_server.cleanup()
+
+
+def register_handlers(dp: Dispatcher):
+    """
+    Регистрирует обработчики команд, диалога и кнопок листания в диспетчере.
+    """
+    dp.register_message_handler(cmd_start, commands='start')
+    dp.register_message_handler(cancel_handler, Text(equals='cancel', ignore_case=True), state='*')
+    dp.register_message_handler(cancel_handler, state='*', commands='cancel')
+    dp.register_message_handler(get_all_tasks, state='*', commands='status')
+    dp.register_message_handler(set_alerts, state='*', commands='alerts')
+    dp.register_message_handler(set_filter, state='*', commands='filter')
+    dp.register_message_handler(process_email, state=Form.token)
+    dp.register_message_handler(process_confirm_invalid,
+                                lambda message: message.text.lower() not in ['да', 'нет'], state=Form.yes_or_not)
+    dp.register_message_handler(loop_request, state=Form.yes_or_not)
+    dp.register_callback_query_handler(turn_status_page, status_page.filter(), state='*')
+
+
+class Application:
+    """
+    Компоненты бота: Bot, диспетчер, хранилище диалогов, планировщик подписок, очередь доставки и остальные.
+    Каждый компонент создается при первом обращении к нему, поэтому импорт модуля ничего не запускает,
+    а рабочий процесс шарда, тесты и бенчмарки собирают только то, чем пользуются.
+    """
+
+    def __init__(self, settings: Settings = settings):
+        self.settings = settings
+        # Командный режим и лента изменений: задачи очередей запрашиваются один раз за период
+        # для всех подписчиков с одним фильтром. team_users - число подписок на каждый фильтр.
+        self.teams = {}
+        self.team_users = Counter()
+        # В рабочем процессе шарда - канал к основному процессу.
+        self.shard_channel = None
+        self.shard_reports = set()
+        # Сервер метрик процесса.
+        self.metrics_server = None
+
+    @cached_property
+    def bot(self):
+        from aiogram import Bot
+        if self.settings.telegram_token is None:
+            raise RuntimeError("Был передан токен с значанием None. Возможно, Неверно передана переменная окружения")
+        try:
+            bot = Bot(token=self.settings.telegram_token)
+        except aioex.ValidationError:
+            logger.exception("Использован невалидный токен/Такой токен не был зарегистрирован")
+            raise
+        logger.info("Бот создан")
+        return bot
+
+    @cached_property
+    def storage(self):
+        # По умолчанию состояния диалогов сохраняются в SQLite.
+        if self.settings.fsm_storage == 'memory':
+            from aiogram.contrib.fsm_storage.memory import MemoryStorage
+            return MemoryStorage()
+        return SQLiteStorage(self.settings.fsm_storage)
+
+    @cached_property
+    def dp(self) -> Dispatcher:
+        dp = Dispatcher(self.bot, storage=self.storage)
+        # Длительность обработчиков и трассы запросов пользователей.
+        dp.middleware.setup(HandlerMetricsMiddleware())
+        register_handlers(dp)
+        logger.info("Создан диспетчер")
+        return dp
+
+    @cached_property
+    def scheduler(self) -> SubscriptionScheduler:
+        # Планировщик владеет всеми подписками и опрашивает трекер для каждой из них раз в период.
+        return SubscriptionScheduler(poll_subscription)
+
+    @cached_property
+    def delivery(self) -> DeliveryQueue:
+        # Все сообщения с задачами уходят через общую очередь доставки.
+        return DeliveryQueue(self.bot, global_rate=self.settings.telegram_global_rate)
+
+    @cached_property
+    def ledger(self) -> DeliveryLedger:
+        # Журнал доставленных версий задач по чатам.
+        return DeliveryLedger()
+
+    @cached_property
+    def alerts(self) -> DeadlineEngine:
+        # Таймеры напоминаний о дедлайнах подписчиков.
+        return DeadlineEngine(send_alert)
+
+    @cached_property
+    def renderer(self) -> IssueRenderer:
+        # Шаблоны сообщений и кэш отформатированных задач.
+        return IssueRenderer()
+
+    @cached_property
+    def status_pages(self) -> StatusPages:
+        # Снимки задач /status для листания.
+        return StatusPages()
+
+    @cached_property
+    def shards(self):
+        # Рабочие процессы, между которыми распределяются подписчики. None, если шардирование выключено.
+        if not self.settings.shard_workers:
+            return None
+        # Настройки передаются рабочим процессам: иначе они собрали бы приложение из переменных окружения.
+        return ShardRouter(serve_shard, self.settings.shard_workers, on_report=store_shard_report,
+                           args=(self.settings,))
+
+    def export_queue_depth(self):
+        """
+        Подключает длины очередей приложения к метрике queue_depth. Они считаются при каждом чтении метрик.
+        """
+        queue_depth.set_function(lambda: {
+            ('subscriptions',): len(self.scheduler),
+            ('polls',): self.scheduler.pending,
+            ('delivery',): self.delivery.stats()['queued'],
+            ('alerts',): len(self.alerts),
+            ('tracker_interactive',): tracker_admission.pending(INTERACTIVE),
+            ('tracker_background',): tracker_admission.pending(BACKGROUND),
+        })
+
+
+def create_app(settings: Settings = settings) -> Application:
+    """
+    Создает приложение бота и делает его текущим для обработчиков. Компоненты собираются по мере обращения к ним.
+    """
+    global app
+    app = Application(settings)
+    return app
+
+
+# Текущее приложение. Его компоненты ничего не стоят, пока к ним не обратились.
+app = Application()
+# Прежние имена модуля ведут к компонентам текущего приложения.
+_components = ('bot', 'dp', 'storage', 'scheduler', 'delivery', 'ledger', 'alerts', 'renderer', 'status_pages',
+               'shards', 'teams')
+
+
+def __getattr__(name: str):
+    if name in _components:
+        return getattr(app, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main(settings: Settings = settings):
+    """
+    Запускает бота в режиме, заданном настройками: long polling или webhook.
+    """
+    # Файловый лог пишется фоновым потоком и не блокирует event loop.
+    setup_logging(settings.log_file, settings.log_level)
+    application = create_app(settings)
     try:
-        executor.start_polling(dp, skip_updates=True)
+        if settings.bot_mode == 'webhook':
+            run_webhook(application.dp, on_startup=on_startup, on_shutdown=on_shutdown, url=settings.webhook_url,
+                        path=settings.webhook_path, host=settings.webapp_host, port=settings.webapp_port,
+                        ssl_cert=settings.webhook_ssl_cert, ssl_key=settings.webhook_ssl_key,
+                        concurrency=settings.webhook_concurrency, drain_timeout=settings.webhook_drain_timeout,
+                        keep_pending=settings.keep_pending_updates)
+        else:
+            from aiogram.utils import executor
+            executor.start_polling(application.dp, skip_updates=not settings.keep_pending_updates,
+                                   on_startup=on_startup, on_shutdown=on_shutdown)
         logger.info("Бот запущен")
     except Exception as ex:
         logger.exception("Ошибка возникла при запуске приложения")
         logger.exception(str(ex))
+
+
+if __name__ == '__main__':
+    main()
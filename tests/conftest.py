@@ -0,0 +1,43 @@
+import asyncio
+import sys
+
+import pytest
+
+from .. import yandex_api_connector as yac
+from ..admission import AdmissionController
+from ..circuit_breaker import CircuitBreaker
+from ..issue_cache import IssueCache
+from ..token_cache import TokenCache
+from .stub_tracker import StubTracker, make_issue
+
+# Модули бота импортируют коннектор абсолютным импортом. Подставляем тот же объект модуля,
+# что используют тесты, чтобы подмены из фикстур действовали и на них.
+sys.modules.setdefault('yandex_api_connector', yac)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """
+    Заглушка трекера с двумя задачами. Коннектор перенаправляется на нее, кэши, предохранитель
+    и бюджет запросов коннектора создаются заново. Бюджет не ограничен, чтобы тесты не ждали очереди.
+    """
+    tracker = StubTracker(issues=[make_issue(1), make_issue(2)])
+    monkeypatch.setattr(yac, 'api_url', tracker.start())
+    monkeypatch.setattr(yac, 'token_cache', TokenCache())
+    monkeypatch.setattr(yac, 'issue_cache', IssueCache())
+    monkeypatch.setattr(yac, 'breaker', CircuitBreaker())
+    monkeypatch.setattr(yac, 'admission', AdmissionController(rate=0))
+    yield tracker
+    tracker.stop()
+
+
+def run(coro):
+    """
+    Выполняет корутину в новом loop и закрывает созданную для него сессию коннектора.
+    """
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await yac.close_session()
+    return asyncio.run(wrapper())
@@ -0,0 +1,69 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+
+class FakeBot:
+    """
+    Заглушка aiogram.Bot: запоминает отправленные сообщения вместо обращения к Telegram.
+    latency - задержка одного вызова api в секундах.
+    errors - исключения, которые будут выброшены следующими вызовами send_message по порядку.
+    """
+
+    def __init__(self, latency: float = 0.0, errors=None):
+        self.latency = latency
+        self.errors = list(errors or [])
+        self.sent = []
+        self.markups = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+        self.markups.append(kwargs.get('reply_markup'))
+        return {'chat': {'id': chat_id}, 'text': text}
+
+    def texts(self, chat_id) -> list:
+        return [text for sent_chat_id, text, _ in self.sent if sent_chat_id == chat_id]
+
+
+class FakeMessage:
+    """
+    Заглушка aiogram.types.Message для вызова обработчиков напрямую: запоминает ответы reply.
+    """
+
+    def __init__(self, chat_id: int, text: str):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = SimpleNamespace(id=chat_id)
+        self.text = text
+        self.replies = []
+
+    def get_args(self) -> str:
+        parts = self.text.split(maxsplit=1)
+        return parts[1] if len(parts) > 1 else ''
+
+    async def reply(self, text, **kwargs):
+        self.replies.append(text)
+
+
+class FakeCallbackQuery:
+    """
+    Заглушка aiogram.types.CallbackQuery: запоминает ответы answer и правки сообщения edit_text.
+    errors - исключения, которые будут выброшены следующими вызовами edit_text по порядку.
+    """
+
+    def __init__(self, chat_id: int, errors=None):
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), edit_text=self._edit_text)
+        self.errors = list(errors or [])
+        self.answers = []
+        self.edits = []
+
+    async def answer(self, text=None, **kwargs):
+        self.answers.append(text)
+
+    async def _edit_text(self, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.edits.append(text)
@@ -0,0 +1,99 @@
+import asyncio
+import itertools
+import time
+
+from aiohttp import web
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    """
+    Возвращает обновление Telegram с текстовым сообщением пользователя chat_id.
+    """
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'},
+            'text': text,
+        },
+    }
+
+
+class FakeTelegram:
+    """
+    Локальная заглушка Bot API: отдает обновления через getUpdates и запоминает отправленные сообщения и webhook.
+    Работает в текущем event loop. Бот подключается к ней через TelegramAPIServer.from_base(fake.url).
+    """
+
+    def __init__(self):
+        self.url = None
+        self.updates = asyncio.Queue()
+        self.sent = []
+        self.webhook = None
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    def push(self, update: dict):
+        self.updates.put_nowait(update)
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}'
+        return self.url
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        params = dict(await request.post())
+        if method == 'getupdates':
+            return web.json_response({'ok': True, 'result': await self._get_updates(float(params.get('timeout', 0)))})
+        if method == 'sendmessage':
+            self.sent.append((int(params['chat_id']), params['text'], time.monotonic()))
+            message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                       'chat': {'id': int(params['chat_id']), 'type': 'private'}, 'text': params['text']}
+            return web.json_response({'ok': True, 'result': message})
+        if method == 'setwebhook':
+            self.webhook = params
+            return web.json_response({'ok': True, 'result': True})
+        return web.json_response({'ok': True, 'result': True})
+
+    async def _get_updates(self, timeout: float) -> list:
+        # Long polling: ждем первое обновление не дольше timeout и забираем все накопившиеся.
+        try:
+            updates = [await asyncio.wait_for(self.updates.get(), timeout or 0.01)]
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+
+async def post_updates(session, url: str, updates: list, concurrency: int = 10) -> list:
+    """
+    Отправляет обновления на webhook так же, как Telegram: не больше concurrency запросов одновременно.
+    Возвращает коды ответов.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(update):
+        async with semaphore:
+            async with session.post(url, json=update) as response:
+                return response.status
+    return await asyncio.gather(*(post(update) for update in updates))
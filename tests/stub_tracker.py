@@ -0,0 +1,242 @@
+import asyncio
+import collections
+import hashlib
+import json
+import random
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from config import time_format, tz
+from issues import Issue, make_issue as parse_issue
+
+
+# Условие на время обновления в языке запросов трекера, которое понимает заглушка.
+UPDATED_SINCE = re.compile(r'Updated: >= "([^"]+)"')
+# Условие на очередь и сортировка по времени обновления.
+QUEUE_IN = re.compile(r'Queue: (.+?)(?= \w+:| "|$)')
+SORT_BY_UPDATED = '"Sort by": Updated ASC'
+
+
+def stamp(moment: datetime) -> str:
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + '+0000'
+
+
+def make_issue(number: int, queue: str = 'PCR', fail_in: timedelta = timedelta(hours=10), **fields):
+    """
+    Возвращает задачу в формате ответа трекера с одной запущенной и одной остановленной SLA.
+    """
+    now = datetime.now(timezone.utc)
+    fail_at = stamp(now + fail_in)
+    issue = {
+        'key': f'{queue}-{number}',
+        'summary': f'Задача номер {number}',
+        'status': {'key': 'open', 'display': 'Открыт'},
+        'createdAt': stamp(now),
+        'updatedAt': stamp(now),
+        'sla': [
+            {'clockStatus': 'STARTED', 'failAt': fail_at, 'warnAt': fail_at},
+            {'clockStatus': 'STOPPED', 'failAt': fail_at, 'warnAt': fail_at},
+        ],
+    }
+    issue.update(fields)
+    return issue
+
+
+def parsed_issue(number: int, **fields) -> Issue:
+    """
+    Задача make_issue, разобранная так же, как ответ трекера в коннекторе: только с запущенной SLA.
+    """
+    raw = make_issue(number, **fields)
+    raw['sla'] = raw['sla'][:1]
+    return parse_issue(raw)
+
+
+class StubTracker:
+    """
+    Локальная заглушка api трекера. Поднимается в отдельном потоке со своим event loop,
+    чтобы блокирующий клиент в тестах и бенчмарках не мешал ей отвечать.
+    token - основной валидный токен, ему соответствует логин stub-user.
+    users - дополнительные валидные токены и логины их владельцев.
+    latency - искусственная задержка каждого ответа в секундах.
+    error - код ошибки, которым заглушка отвечает на все запросы, пока он задан (имитация сбоя трекера).
+    error_rate - доля запросов, на которые заглушка случайно отвечает кодом 500.
+    retry_after - значение заголовка Retry-After в ответах с ошибкой.
+    payload - размер поля description каждой задачи в байтах, чтобы имитировать большие ответы.
+    """
+
+    def __init__(self, issues=None, token='stub-token', latency: float = 0.0, users: dict = None,
+                 error_rate: float = 0.0, payload: int = 0, seed: int = 0):
+        self.issues = issues if issues is not None else []
+        self.token = token
+        self.users = users or {}
+        self.latency = latency
+        self.error = None
+        self.error_rate = error_rate
+        self.retry_after = None
+        self.payload = payload
+        self._random = random.Random(seed)
+        # Индекс задач по исполнителю строится при первом запросе и перестраивается,
+        # когда список задач заменяют или меняют его длину.
+        self._by_assignee = None
+        self._unassigned = None
+        self._indexed = None
+        self._indexed_size = 0
+        # Счетчик запросов по пути, чтобы тесты могли проверить нагрузку на трекер.
+        self.requests = collections.Counter()
+        self.url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/v2/myself', self.myself)
+        app.router.add_get('/v2/issues', self.get_issues)
+        return app
+
+    def _login(self, request: web.Request):
+        """
+        Возвращает логин владельца токена из запроса или None, если токен невалиден.
+        """
+        token = request.headers.get('Authorization', '')[len('OAuth '):]
+        if token == self.token:
+            return 'stub-user'
+        return self.users.get(token)
+
+    def _authorized(self, request: web.Request) -> bool:
+        return self._login(request) is not None
+
+    async def _handle(self, request: web.Request):
+        self.requests[request.path] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _failing(self) -> bool:
+        return bool(self.error) or (self.error_rate and self._random.random() < self.error_rate)
+
+    def _error(self):
+        headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else None
+        return web.json_response({'errorMessages': ['Internal error']}, status=self.error or 500, headers=headers)
+
+    async def myself(self, request: web.Request):
+        await self._handle(request)
+        if self._failing():
+            return self._error()
+        if not self._authorized(request):
+            return web.json_response({'errorMessages': ['Not authorized']}, status=401)
+        return web.json_response({'login': self._login(request), 'display': 'Stub User'})
+
+    async def get_issues(self, request: web.Request):
+        await self._handle(request)
+        if self._failing():
+            return self._error()
+        if not self._authorized(request):
+            return web.json_response({'errorMessages': ['Not authorized']}, status=401)
+        issues = self.select_issues(request)
+        headers = {}
+        # Постраничная выдача, как у трекера: perPage и page в запросе, число страниц в заголовках ответа.
+        if 'perPage' in request.query:
+            per_page = int(request.query['perPage'])
+            page = int(request.query.get('page', 1))
+            headers['X-Total-Count'] = str(len(issues))
+            headers['X-Total-Pages'] = str(max(1, -(-len(issues) // per_page)))
+            issues = issues[(page - 1) * per_page:page * per_page]
+        if self.payload:
+            description = 'x' * self.payload
+            issues = [dict(issue, description=description) for issue in issues]
+        body = json.dumps(issues).encode()
+        # Как и трекер, отдаем ETag и отвечаем 304 на условный запрос, если задачи не изменились.
+        headers['ETag'] = '"%s"' % hashlib.md5(body).hexdigest()
+        if request.headers.get('If-None-Match') == headers['ETag']:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    def touch(self, key: str, **fields) -> dict:
+        """
+        Изменяет задачу key, как если бы ее изменили в трекере: обновляет поля и время обновления.
+        Так заглушка выдает ленту изменений для запросов с условием Updated >=.
+        """
+        issue = next(issue for issue in self.issues if issue['key'] == key)
+        issue.update(fields, updatedAt=stamp(datetime.now(timezone.utc)))
+        # Мог смениться исполнитель: индекс перестраивается при следующем запросе.
+        self._indexed = None
+        return issue
+
+    def select_issues(self, request: web.Request) -> list:
+        """
+        Применяет к задачам условия Queue и Updated >= из параметра query, сортировку по времени обновления
+        и фильтры queue и assignee:me(). Задачи без поля assignee считаются задачами любого пользователя.
+        """
+        issues = self.issues
+        filters = request.query.getall('filter', [])
+        if 'assignee:me()' in filters:
+            issues = self._assigned(self._login(request))
+        for condition in filters:
+            if condition.startswith('queue:'):
+                queues = condition[len('queue:'):].split(',')
+                issues = [issue for issue in issues if issue['key'].split('-')[0] in queues]
+        query = request.query.get('query', '')
+        match = QUEUE_IN.search(query)
+        if match:
+            queues = match.group(1).split(', ')
+            issues = [issue for issue in issues if issue['key'].split('-')[0] in queues]
+        match = UPDATED_SINCE.search(query)
+        if match:
+            # Заглушка считает, что время в запросе указано в таймзоне бота.
+            since = tz.localize(datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S'))
+            issues = [issue for issue in issues if datetime.strptime(issue['updatedAt'], time_format) >= since]
+        if SORT_BY_UPDATED in query:
+            issues = sorted(issues, key=lambda issue: datetime.strptime(issue['updatedAt'], time_format))
+        return issues
+
+    def _assigned(self, login: str) -> list:
+        """
+        Задачи исполнителя login и задачи без исполнителя, в исходном порядке. С индексом заглушка
+        отвечает тысячам пользователей, не просматривая для каждого весь список задач.
+        """
+        if self._indexed is not self.issues or self._indexed_size != len(self.issues):
+            self._by_assignee = collections.defaultdict(list)
+            self._unassigned = []
+            for position, issue in enumerate(self.issues):
+                if 'assignee' in issue:
+                    self._by_assignee[issue['assignee']['id']].append((position, issue))
+                else:
+                    self._unassigned.append((position, issue))
+            self._indexed = self.issues
+            self._indexed_size = len(self.issues)
+        merged = sorted(self._by_assignee.get(login, []) + self._unassigned, key=lambda item: item[0])
+        return [issue for _, issue in merged]
+
+    async def _start(self, port: int):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f'http://127.0.0.1:{port}/v2/'
+
+    def start(self, port: int = 0) -> str:
+        """
+        Запускает заглушку и возвращает адрес api, который подставляется вместо config.api_url.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='stub-tracker', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(port), self._loop).result()
+        return self.url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,124 @@
+import asyncio
+
+from .. import yandex_api_connector as yac
+from ..admission import AdmissionController, BACKGROUND, INTERACTIVE, background, request_class
+from ..issue_cache import IssueCache
+from .conftest import run
+
+
+async def admit(controller, requests: list) -> list:
+    """
+    Ставит запросы (пользователь, класс) в очередь при исчерпанном бюджете и возвращает порядок допуска.
+    """
+    controller.tokens = 0
+    order = []
+
+    async def request(number, user, name):
+        request_class.set(name)
+        await controller.acquire(user)
+        order.append(number)
+    await asyncio.gather(*(request(number, user, name) for number, (user, name) in enumerate(requests)))
+    return order
+
+
+def test_requests_within_burst_are_not_queued():
+    controller = AdmissionController(rate=1, burst=3)
+
+    async def scenario():
+        for _ in range(3):
+            await controller.acquire('user')
+    run(scenario())
+    assert controller.admitted[INTERACTIVE] == 3
+    assert controller.queued[INTERACTIVE] == 0
+
+
+def test_users_are_served_in_turn():
+    controller = AdmissionController(rate=1000, burst=1)
+    # Первый пользователь поставил много запросов раньше второго, но не занимает весь бюджет.
+    requests = [('noisy', INTERACTIVE)] * 6 + [('quiet', INTERACTIVE)] * 2
+    order = asyncio.run(admit(controller, requests))
+    assert order[:4] == [0, 6, 1, 7]
+    assert sorted(order) == list(range(8))
+    assert controller.pending() == 0
+
+
+def test_interactive_requests_go_first():
+    controller = AdmissionController(rate=1000, burst=1)
+    requests = [('poller', BACKGROUND)] * 3 + [('user', INTERACTIVE)] * 2
+    order = asyncio.run(admit(controller, requests))
+    assert order == [3, 4, 0, 1, 2]
+    assert controller.admitted == {INTERACTIVE: 2, BACKGROUND: 3}
+
+
+def test_rate_is_respected():
+    controller = AdmissionController(rate=100, burst=1)
+
+    async def scenario():
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(controller.acquire(user) for user in range(11)))
+        return asyncio.get_running_loop().time() - started
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_cancelled_request_does_not_use_budget():
+    controller = AdmissionController(rate=1000, burst=1)
+
+    async def scenario():
+        controller.tokens = 0
+        cancelled = asyncio.ensure_future(controller.acquire('user'))
+        waiting = asyncio.ensure_future(controller.acquire('other'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await waiting
+    asyncio.run(scenario())
+    assert controller.admitted[INTERACTIVE] == 1
+    assert controller.pending() == 0
+
+
+def test_zero_rate_disables_limit():
+    controller = AdmissionController(rate=0)
+
+    async def scenario():
+        controller.tokens = 0
+        await asyncio.gather(*(controller.acquire('user') for _ in range(100)))
+    asyncio.run(scenario())
+    assert controller.admitted[INTERACTIVE] == 100
+    assert controller.queued[INTERACTIVE] == 0
+
+
+def test_connector_requests_pass_admission(stub, monkeypatch):
+    controller = AdmissionController(rate=1000, burst=1)
+    monkeypatch.setattr(yac, 'admission', controller)
+    run(yac.get_issues_async(stub.token))
+    # Проверка токена и запрос задач - от команды пользователя.
+    assert controller.admitted == {INTERACTIVE: 2, BACKGROUND: 0}
+    # Опрос подписки перепроверяет устаревший список задач с фоновым приоритетом.
+    monkeypatch.setattr(yac, 'issue_cache', IssueCache(ttl=0))
+    run(background(yac.get_issues_async)(stub.token))
+    assert controller.admitted[BACKGROUND] == 1
+
+
+def test_interactive_call_promotes_background_flight(stub, monkeypatch):
+    # Класс запроса и бюджет берутся из тех же модулей, что использует коннектор.
+    controller = yac.AdmissionController(rate=20, burst=1)
+    monkeypatch.setattr(yac, 'admission', controller)
+    stub.users = {'other-token': 'other'}
+    finished = []
+
+    async def call(label, name, token):
+        yac.request_class.set(name)
+        await yac.get_user_issues_async({'Authorization': f'OAuth {token}'})
+        finished.append(label)
+
+    async def scenario():
+        controller.tokens = 0
+        other = asyncio.ensure_future(call('other', BACKGROUND, 'other-token'))
+        polling = asyncio.ensure_future(call('poll', BACKGROUND, stub.token))
+        await asyncio.sleep(0)
+        # Команда пользователя пришла, пока тот же запрос опроса ждет допуска за опросом другого пользователя.
+        await asyncio.gather(other, polling, call('status', INTERACTIVE, stub.token))
+    run(scenario())
+    # Запрос к трекеру один, и он допущен как команда пользователя, раньше чужого опроса.
+    assert stub.requests['/v2/issues'] == 2
+    assert controller.admitted == {INTERACTIVE: 1, BACKGROUND: 1}
+    assert finished[-1] == 'other'
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from datetime import datetime
+
+from .. import yandex_api_connector as yac
+from ..config import time_format
+from .conftest import run
+from .stub_tracker import make_issue
+
+
+def test_get_headers_async(stub):
+    assert run(yac.get_headers_async(stub.token)) == {'Authorization': f'OAuth {stub.token}'}
+
+
+def test_get_headers_async_with_wrong_token(stub):
+    assert run(yac.get_headers_async('kawabanga')) is None
+
+
+def test_get_issues_async(stub):
+    issues = run(yac.get_issues_async(stub.token))
+    assert [issue.summary for issue in issues] == ['Задача номер 1', 'Задача номер 2']
+
+
+def test_sync_wrapper_uses_stub(stub):
+    issues = yac.get_issues(stub.token)
+    assert type(issues) == list
+    assert len(issues) == 2
+    assert stub.requests['/v2/issues'] == 1
+
+
+def test_concurrent_requests_do_not_block(stub):
+    stub.latency = 0.2
+
+    async def many():
+        return await asyncio.gather(*(yac.get_issues_async(stub.token) for _ in range(20)))
+
+    started = time.monotonic()
+    results = run(many())
+    assert all(len(issues) == 2 for issues in results)
+    # Последовательно 20 пользователей ждали бы 20 * 2 * 0.2 секунды.
+    assert time.monotonic() - started < 2
+
+
+def test_request_timeout(stub, monkeypatch):
+    stub.latency = 1
+    monkeypatch.setattr(yac, 'http_timeout', 0.1)
+    assert run(yac.get_issues_async(stub.token)) is None
+
+
+def test_updated_issues_since_watermark(stub):
+    old = make_issue(1, updatedAt='2020-01-01T10:00:00.000+0000')
+    fresh = make_issue(2, updatedAt='2020-01-01T12:00:00.500+0000')
+    stub.issues = [old, fresh]
+    since = datetime.strptime('2020-01-01T11:00:00.000+0000', time_format)
+
+    issues, watermark = run(yac.get_updated_issues_async(stub.token, since))
+    assert [issue.summary for issue in issues] == ['Задача номер 2']
+    assert watermark == datetime.strptime(fresh['updatedAt'], time_format)
+    # С новой отметкой уже доставленная задача не возвращается повторно.
+    issues, next_watermark = run(yac.get_updated_issues_async(stub.token, watermark))
+    assert issues == []
+    assert next_watermark == watermark
+
+
+def test_filter_issues_by_time_uses_current_time():
+    issue = make_issue(1)
+    assert yac.filter_issues_by_time([issue]) == [issue]
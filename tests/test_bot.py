@@ -0,0 +1,255 @@
+import asyncio
+from dataclasses import replace
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from aiogram.dispatcher import FSMContext
+from aiogram.utils.exceptions import MessageNotModified, RetryAfter
+
+from .. import telegram_bot_logic as bot
+from .. import yandex_api_connector as yac
+from ..circuit_breaker import CircuitBreaker
+from ..config import tz
+from ..delivery import DeliveryQueue
+from ..issue_cache import IssueCache
+from ..scheduler import Subscription
+from .conftest import run
+from .fake_bot import FakeBot, FakeCallbackQuery, FakeMessage
+from .stub_tracker import make_issue
+
+
+@pytest.fixture
+def app(stub, monkeypatch):
+    """
+    Приложение бота с хранилищем в памяти и заглушкой Bot вместо Telegram. Трекер - заглушка stub,
+    кэш задач не хранит ответы, чтобы каждый опрос видел текущие задачи заглушки.
+    """
+    application = bot.Application(replace(bot.settings, fsm_storage='memory', shard_workers=0))
+    application.bot = FakeBot()
+    application.delivery = DeliveryQueue(application.bot, global_rate=1e9, chat_rate=1e9)
+    monkeypatch.setattr(bot, 'app', application)
+    monkeypatch.setattr(yac, 'issue_cache', IssueCache(ttl=0))
+    return application
+
+
+async def subscriber(app, chat_id: int, token: str, **data) -> FSMContext:
+    """
+    Состояние диалога пользователя, который передал токен и подписался на обновления.
+    """
+    state = FSMContext(app.storage, chat=chat_id, user=chat_id)
+    await state.set_state(bot.Form.yes_or_not)
+    await state.update_data({'token': token, 'answer': 'да', **data})
+    return state
+
+
+def test_incremental_poll_drops_alerts_of_closed_issues(app, stub, monkeypatch):
+    app.settings = replace(app.settings, sync_mode='incremental')
+    monkeypatch.setattr(bot, 'alerts_resync', 0)
+    subscription = Subscription(1, stub.token, 0)
+
+    async def scenario():
+        await bot.poll_subscription(subscription)
+        scheduled = len(app.alerts)
+        # Задачу закрыли: в выдачу обновленных открытых задач она больше не попадает.
+        del stub.issues[0]
+        await bot.poll_subscription(subscription)
+        return scheduled
+    assert run(scenario()) == 2
+    assert len(app.alerts) == 1
+    assert 1 in app.alerts and subscription.retained_at is not None
+
+
+def test_incremental_poll_resyncs_alerts_once_per_period(app, stub):
+    app.settings = replace(app.settings, sync_mode='incremental')
+    subscription = Subscription(1, stub.token, 0)
+
+    async def scenario():
+        await bot.poll_subscription(subscription)
+        stub.requests.clear()
+        await bot.poll_subscription(subscription)
+    run(scenario())
+    # Первый опрос вернул все открытые задачи, поэтому до конца периода полный список не запрашивается.
+    assert stub.requests['/v2/issues'] == 1
+    assert len(app.alerts) == 2
+
+
+def test_incremental_poll_arms_alerts_of_existing_issues(app, stub):
+    app.settings = replace(app.settings, sync_mode='incremental')
+    # Подписка только что оформлена или восстановлена: отметка есть, таймеров еще нет.
+    subscription = Subscription(1, stub.token, 0, watermark=datetime.now(tz))
+
+    async def scenario():
+        await bot.poll_subscription(subscription)
+        await bot.poll_subscription(subscription)
+    run(scenario())
+    assert len(app.alerts) == 2
+
+
+@pytest.mark.parametrize('sync_mode', ['full', 'incremental'])
+def test_poll_in_flight_does_nothing_after_cancel(app, stub, sync_mode):
+    app.settings = replace(app.settings, sync_mode=sync_mode)
+    stub.latency = 0.2
+
+    async def scenario():
+        state = await subscriber(app, 1, stub.token)
+        subscription = app.scheduler.subscribe(1, stub.token, delay=3600)
+        poll = asyncio.ensure_future(bot.poll_subscription(subscription))
+        await asyncio.sleep(0.1)
+        # Пользователь отписался, пока опрос ждал ответа трекера.
+        await bot.cancel_handler(FakeMessage(1, '/cancel'), state)
+        await poll
+    run(scenario())
+    assert len(app.alerts) == 0
+    assert app.bot.texts(1) == []
+    assert app.ledger.dump(1) == {}
+
+
+def test_alerts_command_validates_and_applies_thresholds(app, stub):
+    async def scenario():
+        state = await subscriber(app, 1, stub.token)
+        replies = []
+        for text in ('/alerts -2h', '/alerts 1e12h', '/alerts 2h 15m'):
+            message = FakeMessage(1, text)
+            await bot.set_alerts(message, state)
+            replies += message.replies
+        return replies, await state.get_data()
+    replies, data = run(scenario())
+    assert [reply.startswith('Не понял пороги') for reply in replies] == [True, True, False]
+    assert data['alerts'] == [2 * 60 * 60, 15 * 60]
+    assert app.alerts.thresholds_for(1) == (timedelta(hours=2), timedelta(minutes=15))
+
+
+def test_team_poll_resolves_missing_login(app, stub, monkeypatch):
+    app.settings = replace(app.settings, sync_mode='team')
+    stub.users = {'service-token': 'robot'}
+    stub.issues = [make_issue(1, assignee={'id': 'stub-user', 'display': 'stub-user'})]
+    app.teams[bot.default_filter] = bot.TeamPoller(
+        token='service-token', query=bot.compile_filter(bot.default_filter, mine=False), ttl=60)
+    # Подписка без логина: при подписке трекер не ответил или она оформлена в режиме full.
+    subscription = Subscription(1, stub.token, 0)
+
+    async def scenario():
+        await subscriber(app, 1, stub.token)
+        stub.error = 503
+        failed = await bot.poll_subscription(subscription)
+        stub.error = None
+        monkeypatch.setattr(yac, 'breaker', CircuitBreaker())
+        retried = await bot.poll_subscription(subscription)
+        return failed, retried, await app.storage.get_data(chat=1, user=1)
+    failed, retried, data = run(scenario())
+    # Неудача откладывает опрос, а не оставляет подписку без задач навсегда.
+    assert failed is not None
+    assert retried is None
+    assert subscription.login == data['login'] == 'stub-user'
+    assert len(app.bot.texts(1)) == 1
+
+
+def test_team_pollers_are_dropped_with_last_subscriber(app, stub):
+    app.settings = replace(app.settings, sync_mode='team')
+    ops, web = bot.parse_filter('queue=OPS'), bot.parse_filter('queue=WEB')
+
+    async def scenario():
+        for chat_id in (1, 2):
+            bot.start_subscription(chat_id, chat_id, {'token': stub.token, 'login': 'stub-user',
+                                                      'filter': ops.as_dict()})
+        bot.team_for(ops)
+        # Один из подписчиков сменил фильтр: опрос прежнего остается для второго.
+        bot.update_subscription(1, {'filter': web.as_dict()})
+        bot.team_for(web)
+        assert set(app.teams) == {ops, web}
+        bot.stop_subscription(2)
+        assert set(app.teams) == {web}
+        bot.stop_subscription(1)
+    run(scenario())
+    assert app.teams == {} and not app.team_users
+
+
+def test_settings_reach_components(monkeypatch):
+    custom = replace(bot.settings, telegram_token='123456:' + 'A' * 35, fsm_storage='memory', bot_mode='webhook',
+                     telegram_global_rate=5, webhook_url='https://bot.example/', webapp_port=8443,
+                     keep_pending_updates=True, shard_workers=2)
+    started = {}
+    monkeypatch.setattr(bot, 'app', bot.app)
+    monkeypatch.setattr(bot, 'setup_logging', lambda *args: None)
+    monkeypatch.setattr(bot, 'run_webhook', lambda dp, **kwargs: started.update(kwargs, dp=dp))
+    bot.main(custom)
+    assert bot.app.settings is custom
+    assert bot.app.delivery.global_bucket.rate == 5
+    assert started['dp'] is bot.app.dp
+    # Рабочие процессы шардов собирают приложение с теми же настройками.
+    assert bot.app.shards.args == (custom,)
+    assert (started['url'], started['port'], started['keep_pending']) == ('https://bot.example/', 8443, True)
+
+
+def test_status_pages_are_turned_in_place(app, stub):
+    stub.issues = [make_issue(number) for number in range(1, 6)]
+    app.status_pages = bot.StatusPages(page_size=2)
+
+    async def scenario():
+        state = await subscriber(app, 1, stub.token)
+        await bot.get_all_tasks(FakeMessage(1, '/status'), state)
+        snapshot = app.status_pages.get(1, 1)
+        # Номер страницы за пределами списка приводится к последней.
+        last = FakeCallbackQuery(1)
+        await bot.turn_status_page(last, {'snapshot': str(snapshot.id), 'page': '99', 'hot': '0'})
+        # Повторное нажатие той же кнопки: Telegram отвечает, что сообщение не изменилось.
+        again = FakeCallbackQuery(1, errors=[MessageNotModified('Message is not modified')])
+        await bot.turn_status_page(again, {'snapshot': str(snapshot.id), 'page': '2', 'hot': '0'})
+        # После нового /status кнопки старого сообщения не работают.
+        await bot.get_all_tasks(FakeMessage(1, '/status'), state)
+        stale = FakeCallbackQuery(1)
+        await bot.turn_status_page(stale, {'snapshot': str(snapshot.id), 'page': '1', 'hot': '0'})
+        return snapshot, last, again, stale
+    # Telegram попросил подождать с первым /status: сообщение отправлено повторно через очередь доставки.
+    app.bot.errors = [RetryAfter(0)]
+    snapshot, last, again, stale = run(scenario())
+    texts = app.bot.texts(1)
+    assert len(texts) == 2 and '(страница 1 из 3)' in texts[0]
+    assert app.delivery.retried == 1 and app.bot.markups[0] is not None
+    assert len(last.edits) == 1 and '(страница 3 из 3)' in last.edits[0] and 'Задача номер 5' in last.edits[0]
+    assert again.edits == [] and again.answers == [None]
+    assert stale.edits == [] and 'устарел' in stale.answers[0]
+    # Весь снимок, а не только первая страница, отмечен в журнале доставки как показанный.
+    assert app.ledger.diff(1, list(snapshot.issues)) == []
+
+
+def test_filter_command_updates_subscription(app, stub):
+    async def scenario():
+        state = await subscriber(app, 1, stub.token)
+        subscription = app.scheduler.subscribe(1, stub.token, delay=3600, watermark=datetime.now(tz))
+        replies = []
+        for text in ('/filter queue=OPS priority=critical', '/filter queue', '/filter'):
+            message = FakeMessage(1, text)
+            await bot.set_filter(message, state)
+            replies += message.replies
+        return subscription, replies, await state.get_data()
+    subscription, replies, data = run(scenario())
+    assert replies[0].startswith('Фильтр сохранен') and replies[1].startswith('Не понял фильтр')
+    assert replies[2].startswith('Текущий фильтр')
+    assert data['filter'] == subscription.issue_filter.as_dict()
+    assert subscription.issue_filter.queues == ('OPS',)
+    # Задачи новой очереди могли обновиться раньше отметки: следующий опрос запросит все открытые.
+    assert subscription.watermark is None
+
+
+def test_subscriptions_are_resumed_from_storage(app, stub, tmp_path):
+    app.storage = bot.SQLiteStorage(str(tmp_path / 'fsm.sqlite3'))
+
+    async def scenario():
+        await subscriber(app, 1, stub.token, alerts=[3600], login='stub-user',
+                         filter=bot.parse_filter('queue=OPS').as_dict(),
+                         watermark=datetime.now(tz).isoformat(), ledger={'OPS-1': '00'})
+        # Диалог без подписки и диалог другого состояния не восстанавливаются.
+        await subscriber(app, 2, stub.token, answer=None)
+        await app.storage.set_state(chat=3, user=3, state=bot.Form.token.state)
+        await bot.resume_subscriptions(SimpleNamespace(storage=app.storage))
+        await app.storage.close()
+        await app.storage.wait_closed()
+    run(scenario())
+    assert len(app.scheduler) == 1
+    subscription = app.scheduler.get(1)
+    assert (subscription.token, subscription.login) == (stub.token, 'stub-user')
+    assert subscription.issue_filter.queues == ('OPS',) and subscription.watermark is not None
+    assert app.alerts.thresholds_for(1) == (timedelta(hours=1),)
+    assert app.ledger.dump(1) == {'OPS-1': '00'}
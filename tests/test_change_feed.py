@@ -0,0 +1,103 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from ..change_feed import ChangeFeed
+from ..config import tz
+from ..query_builder import make_filter
+from .conftest import run
+from .stub_tracker import make_issue
+
+
+def assigned(number: int, login: str, **fields):
+    # Задачи изменены давно: в ленту изменений попадают только те, что тронуты в тесте.
+    fields.setdefault('updatedAt', (datetime.now(tz) - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S.000+0300'))
+    return make_issue(number, assignee={'id': login, 'display': login}, **fields)
+
+
+def keys(issues) -> list:
+    return [issue.key for issue in issues]
+
+
+def feed_for(stub, **kwargs) -> ChangeFeed:
+    stub.users = {'service-token': 'robot'}
+    return ChangeFeed(token='service-token', ttl=60, **kwargs)
+
+
+def test_changes_are_routed_by_assignee(stub):
+    stub.issues = [assigned(1, 'alice'), assigned(2, 'bob'), assigned(3, 'alice')]
+    feed = feed_for(stub)
+
+    async def scenario():
+        first = await feed.issues_for('alice')
+        stub.touch('PCR-1', assignee={'id': 'bob', 'display': 'bob'})
+        stub.touch('PCR-2', status={'key': 'closed', 'display': 'Закрыт'})
+        stub.issues.append(assigned(4, 'carol'))
+        stub.touch('PCR-4')
+        await feed.refresh()
+        return first, await asyncio.gather(*(feed.issues_for(login) for login in ('alice', 'bob', 'carol')))
+    first, (alice, bob, carol) = run(scenario())
+    assert keys(first) == ['PCR-1', 'PCR-3']
+    # Переназначенная задача перешла к новому исполнителю, закрытая пропала, новая появилась.
+    assert (keys(alice), keys(bob), keys(carol)) == (['PCR-3'], ['PCR-1'], ['PCR-4'])
+    # Во второй раз запрошены только изменения, а не все открытые задачи.
+    assert feed.changes == 3
+    assert feed.refreshes == 2
+
+
+def test_cycle_without_changes_is_one_request_per_queue(stub):
+    stub.issues = [assigned(number, 'alice') for number in range(50)]
+    stub.issues += [assigned(number, 'bob', queue='OPS') for number in range(50)]
+    feed = feed_for(stub, issue_filter=make_filter(queues=['PCR', 'OPS']))
+
+    async def scenario():
+        await feed.issues_for('alice')
+        stub.requests.clear()
+        for _ in range(3):
+            await feed.refresh()
+    run(scenario())
+    assert stub.requests['/v2/issues'] == 3 * 2
+    assert feed.changes == 0
+    assert len(run(feed.issues_for('bob'))) == 50
+
+
+def test_changes_outside_filter_are_dropped(stub):
+    stub.issues = [assigned(1, 'alice', priority={'key': 'critical'})]
+    feed = feed_for(stub, issue_filter=make_filter(priorities=['critical']))
+
+    async def scenario():
+        await feed.issues_for('alice')
+        stub.touch('PCR-1', priority={'key': 'minor'})
+        await feed.refresh()
+        return await feed.issues_for('alice')
+    assert run(scenario()) == []
+
+
+def test_failed_pull_keeps_cursor(stub):
+    stub.issues = [assigned(1, 'alice')]
+    feed = feed_for(stub)
+
+    async def scenario():
+        await feed.issues_for('alice')
+        cursors = dict(feed.cursors)
+        stub.error = 503
+        assert not await feed.refresh()
+        assert feed.cursors == cursors
+        stub.error = None
+        stub.touch('PCR-1', summary='Новое название')
+        assert await feed.refresh()
+        return await feed.issues_for('alice')
+    assert run(scenario())[0].summary == 'Новое название'
+
+
+def test_resync_reloads_everything(stub):
+    stub.issues = [assigned(1, 'alice')]
+    feed = feed_for(stub, resync=0)
+
+    async def scenario():
+        await feed.issues_for('alice')
+        # Задача пропала без изменения времени обновления - такое исправляет только полная загрузка.
+        stub.issues.clear()
+        await feed.refresh()
+        return await feed.issues_for('alice')
+    assert run(scenario()) == []
+    assert feed.changes == 0
@@ -0,0 +1,70 @@
+import time
+
+from .. import yandex_api_connector as yac
+from ..circuit_breaker import CLOSED, OPEN, HALF_OPEN, CircuitBreaker, parse_retry_after
+from .conftest import run
+
+
+def test_opens_on_failure_ratio():
+    breaker = CircuitBreaker(window=60, min_calls=4, failure_ratio=0.5, cooldown=30)
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    # Запросов в окне пока меньше min_calls.
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+    assert 20 < breaker.retry_in() <= 36
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker(min_calls=1, cooldown=0.02, max_cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.03)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    # Неудачная проба размыкает предохранитель с удвоенной паузой.
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.retry_in() > 0.03
+    time.sleep(0.05)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_retry_after_opens_immediately():
+    breaker = CircuitBreaker(min_calls=10, cooldown=1)
+    breaker.record_failure(retry_after=120)
+    assert breaker.state == OPEN
+    assert breaker.retry_in() > 100
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') is None
+    assert parse_retry_after(None) is None
+
+
+def test_outage_serves_stale_issues(stub, monkeypatch):
+    monkeypatch.setattr(yac, 'breaker', CircuitBreaker(min_calls=2, cooldown=60))
+    monkeypatch.setattr(yac.issue_cache, 'ttl', 0)
+
+    async def scenario():
+        headers = await yac.get_headers_async(stub.token)
+        fresh = await yac.load_user_issues(headers)
+        assert not fresh.stale
+        stub.error = 503
+        stub.retry_after = 0
+        failed = [await yac.load_user_issues(headers) for _ in range(2)]
+        requests = sum(stub.requests.values())
+        # Предохранитель разомкнулся: трекер больше не опрашивается, задачи отдаются из кэша.
+        served = [await yac.load_user_issues(headers) for _ in range(5)]
+        assert sum(stub.requests.values()) == requests
+        return fresh, failed, served
+    fresh, failed, served = run(scenario())
+    assert all(entry is fresh and entry.stale for entry in failed + served)
+    # Пауза - cooldown с разбросом от 0.8 до 1.2.
+    assert yac.tracker_backoff() > 45
+    # Без кэша в разомкнутом состоянии нечего отдать.
+    assert run(yac.load_user_issues({'Authorization': 'OAuth other'})) is None
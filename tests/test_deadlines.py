@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from ..config import tz
+from ..deadlines import DeadlineEngine, parse_threshold
+from ..issues import make_issue
+from .stub_tracker import make_issue as make_raw_issue
+
+
+def issue(number: int, fail_in: float, warn_in: float = None):
+    now = datetime.now(tz)
+    deadline = now + timedelta(seconds=fail_in)
+    warn_at = now + timedelta(seconds=warn_in) if warn_in is not None else deadline
+    return make_issue(make_raw_issue(number))._replace(deadline=deadline, warn_at=warn_at)
+
+
+def test_alerts_fire_at_thresholds_and_warn_at():
+    fired = []
+
+    async def callback(chat_id, task, threshold):
+        fired.append((chat_id, task.key, threshold, datetime.now(tz) - task.deadline))
+
+    async def scenario():
+        engine = DeadlineEngine(callback, thresholds=(timedelta(seconds=0.1), timedelta(0)))
+        await engine.start()
+        engine.update(1, [issue(1, fail_in=0.2, warn_in=0.05)])
+        await asyncio.sleep(0.35)
+        await engine.stop()
+    asyncio.run(scenario())
+    assert [(chat, key, threshold) for chat, key, threshold, _ in fired] == [
+        (1, 'PCR-1', None), (1, 'PCR-1', timedelta(seconds=0.1)), (1, 'PCR-1', timedelta(0))]
+    # Напоминание о самом дедлайне приходит без ожидания следующего опроса.
+    assert abs(fired[-1][3]) < timedelta(seconds=0.05)
+
+
+def test_moved_deadline_and_closed_issues_invalidate_timers():
+    fired = []
+
+    async def callback(chat_id, task, threshold):
+        fired.append((chat_id, task.key))
+
+    async def scenario():
+        engine = DeadlineEngine(callback, thresholds=(timedelta(0),))
+        await engine.start()
+        engine.update(1, [issue(1, fail_in=0.1), issue(2, fail_in=0.1)])
+        engine.update(2, [issue(3, fail_in=0.1)])
+        # Дедлайн первой задачи перенесли, вторую закрыли, второй пользователь отписался.
+        engine.update(1, [issue(1, fail_in=10)])
+        engine.retain(1, {'PCR-1'})
+        engine.remove(2)
+        await asyncio.sleep(0.2)
+        await engine.stop()
+        assert len(engine) == 1
+    asyncio.run(scenario())
+    assert fired == []
+
+
+def test_user_thresholds_reschedule_known_issues():
+    fired = []
+
+    async def callback(chat_id, task, threshold):
+        fired.append((chat_id, threshold))
+
+    async def scenario():
+        engine = DeadlineEngine(callback, thresholds=(timedelta(hours=4),))
+        await engine.start()
+        engine.update(1, [issue(1, fail_in=0.2)])
+        engine.update(2, [issue(1, fail_in=0.2)])
+        engine.set_thresholds(1, [timedelta(seconds=0.1)])
+        await asyncio.sleep(0.15)
+        await engine.stop()
+    asyncio.run(scenario())
+    assert fired == [(1, timedelta(seconds=0.1))]
+
+
+def test_slow_chat_does_not_delay_other_alerts():
+    fired = {}
+    cancelled = []
+
+    async def callback(chat_id, task, threshold):
+        fired[chat_id] = datetime.now(tz) - task.deadline
+        if chat_id == 1:
+            # Чат упирается в лимит Telegram: отправка ждет дольше, чем идет тест.
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(chat_id)
+                raise
+
+    async def scenario():
+        engine = DeadlineEngine(callback, thresholds=(timedelta(0),), senders=2)
+        await engine.start()
+        engine.update(1, [issue(1, fail_in=0.05)])
+        engine.update(2, [issue(2, fail_in=0.1)])
+        await asyncio.sleep(0.2)
+        # Остановка отменяет напоминания, которые еще отправляются.
+        await engine.stop()
+    asyncio.run(scenario())
+    assert set(fired) == {1, 2}
+    assert abs(fired[2]) < timedelta(seconds=0.05)
+    assert cancelled == [1]
+
+
+def test_parse_threshold():
+    assert parse_threshold('4h') == timedelta(hours=4)
+    assert parse_threshold('30m') == timedelta(minutes=30)
+    assert parse_threshold('0') == timedelta(0)
+    with pytest.raises(ValueError):
+        parse_threshold('скоро')
+    # Отрицательный порог напоминал бы после дедлайна, огромный переполняет вычисление момента срабатывания.
+    for value in ('-2h', '1e12h', '31d', 'inf', 'nan', str(31 * 24 * 60)):
+        with pytest.raises(ValueError):
+            parse_threshold(value)
@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter, BotBlocked
+
+from ..delivery import DeliveryQueue, TokenBucket, pack_messages
+from .fake_bot import FakeBot
+
+
+def test_pack_messages_respects_limit():
+    texts = ['a' * 40, 'b' * 40, 'c' * 40]
+    assert pack_messages(texts, limit=90) == ['a' * 40 + '\n\n' + 'b' * 40, 'c' * 40]
+    assert pack_messages(['x' * 25], limit=10) == ['x' * 10, 'x' * 10, 'x' * 5]
+    assert pack_messages([]) == []
+
+
+def test_token_bucket_limits_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_issues_are_packed_into_few_messages():
+    bot = FakeBot()
+
+    async def scenario():
+        delivery = DeliveryQueue(bot, global_rate=1000, chat_rate=1000)
+        await delivery.send(1, [f'задача {n} ' + 'x' * 200 for n in range(40)])
+        await delivery.close()
+        return delivery
+    delivery = asyncio.run(scenario())
+    assert len(bot.sent) == 3
+    assert all(len(text) <= 4096 for _, text, _ in bot.sent)
+    assert delivery.stats()['texts'] == 40
+
+
+def test_order_is_kept_per_chat():
+    bot = FakeBot()
+
+    async def scenario():
+        delivery = DeliveryQueue(bot, global_rate=1000, chat_rate=1000, limit=10)
+        await asyncio.gather(
+            delivery.send(1, ['1-first', '1-second']),
+            delivery.send(2, ['2-first']),
+            delivery.send(1, ['1-third']),
+        )
+        await delivery.close()
+    asyncio.run(scenario())
+    assert bot.texts(1) == ['1-first', '1-second', '1-third']
+    assert bot.texts(2) == ['2-first']
+
+
+def test_chat_rate_is_respected():
+    bot = FakeBot()
+
+    async def scenario():
+        delivery = DeliveryQueue(bot, global_rate=1000, chat_rate=20, limit=10)
+        await delivery.send(1, ['message %s' % n for n in range(4)])
+        await delivery.close()
+    asyncio.run(scenario())
+    stamps = [stamp for _, _, stamp in bot.sent]
+    assert stamps[-1] - stamps[0] >= 0.14
+
+
+def test_retry_after_is_retried():
+    bot = FakeBot(errors=[RetryAfter(0.01)])
+
+    async def scenario():
+        delivery = DeliveryQueue(bot, global_rate=1000, chat_rate=1000)
+        await delivery.send(1, ['text'])
+        return delivery
+    delivery = asyncio.run(scenario())
+    assert bot.texts(1) == ['text']
+    assert delivery.retried == 1
+
+
+def test_reply_markup_goes_with_last_message():
+    bot = FakeBot()
+    markup = object()
+
+    async def scenario():
+        delivery = DeliveryQueue(bot, global_rate=1000, chat_rate=1000, limit=10)
+        await delivery.send(1, ['first', 'second'], reply_markup=markup)
+        await delivery.close()
+    asyncio.run(scenario())
+    assert bot.texts(1) == ['first', 'second']
+    assert bot.markups == [None, markup]
+
+
+def test_delivery_error_is_raised_to_caller():
+    bot = FakeBot(errors=[BotBlocked('Forbidden: bot was blocked by the user')])
+
+    async def scenario():
+        delivery = DeliveryQueue(bot, global_rate=1000, chat_rate=1000)
+        await delivery.send(1, ['text'])
+    with pytest.raises(BotBlocked):
+        asyncio.run(scenario())
+
+
+def test_load_many_chats():
+    bot = FakeBot(latency=0.001)
+
+    async def scenario():
+        delivery = DeliveryQueue(bot, global_rate=2000, chat_rate=1000)
+        await asyncio.gather(*(delivery.send(chat_id, ['issue ' + 'x' * 300] * 40) for chat_id in range(50)))
+        await delivery.close()
+        return delivery
+    delivery = asyncio.run(scenario())
+    # 40 задач по ~300 символов укладываются в 4 сообщения на чат вместо 40 вызовов api.
+    assert delivery.messages == len(bot.sent) == 50 * 4
+    assert delivery.failed == 0
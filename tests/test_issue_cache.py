@@ -0,0 +1,65 @@
+from .. import yandex_api_connector as yac
+from ..issue_cache import CacheEntry, IssueCache
+from .conftest import run
+from .stub_tracker import make_issue
+
+
+def test_fresh_entry_is_a_hit():
+    cache = IssueCache(ttl=60)
+    key = cache.key('OAuth token', 'url')
+    assert cache.get(key) is None
+    cache.store(key, CacheEntry([], size=10))
+    assert cache.get(key).is_fresh()
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['bytes_saved']) == (1, 1, 10)
+    assert stats['hit_ratio'] == 0.5
+
+
+def test_memory_cap_evicts_least_recently_used():
+    cache = IssueCache(max_bytes=100)
+    cache.store(b'a', CacheEntry([], size=60))
+    cache.store(b'b', CacheEntry([], size=30))
+    cache.get(b'a')
+    cache.store(b'c', CacheEntry([], size=30))
+    assert cache.get(b'b') is None
+    assert cache.total_bytes == 90
+    assert cache.evictions == 1
+    # Ответ больше лимита не кэшируется совсем.
+    cache.store(b'd', CacheEntry([], size=1000))
+    assert cache.get(b'd') is None
+
+
+def test_status_and_poll_share_cached_issues(stub):
+    async def scenario():
+        first = await yac.get_issues_async(stub.token)
+        second = await yac.get_latest_issues_async(stub.token)
+        return first, second
+    first, second = run(scenario())
+    assert len(first) == 2 and len(second) == 2
+    assert stub.requests['/v2/issues'] == 1
+
+
+def test_not_modified_reuses_parsed_issues(stub, monkeypatch):
+    monkeypatch.setattr(yac, 'issue_cache', IssueCache(ttl=0))
+
+    async def scenario():
+        first = await yac.get_issues_async(stub.token)
+        second = await yac.get_issues_async(stub.token)
+        return first, second
+    first, second = run(scenario())
+    assert first == second
+    assert stub.requests['/v2/issues'] == 2
+    stats = yac.issue_cache.stats()
+    assert stats['revalidations'] == 1
+    assert stats['bytes_saved'] > 0
+
+
+def test_changed_issues_are_downloaded_again(stub, monkeypatch):
+    monkeypatch.setattr(yac, 'issue_cache', IssueCache(ttl=0))
+
+    async def scenario():
+        await yac.get_issues_async(stub.token)
+        stub.issues.append(make_issue(3))
+        return await yac.get_issues_async(stub.token)
+    assert len(run(scenario())) == 3
+    assert yac.issue_cache.stats()['revalidations'] == 0
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from .. import yandex_api_connector as yac
+from ..config import time_format, tz
+from ..issues import parse_time
+from .stub_tracker import make_issue as make_raw_issue, parsed_issue
+
+
+@pytest.mark.parametrize('value', [
+    '2017-06-11T05:16:01.339+0030',
+    '2021-02-28T23:59:59.000-0300',
+    '2021-02-28T23:59:59.123456+0000',
+])
+def test_parse_time_matches_strptime(value):
+    assert parse_time(value) == datetime.strptime(value, time_format)
+    assert parse_time(value).utcoffset() == datetime.strptime(value, time_format).utcoffset()
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_parse_time_with_corrupted_value():
+    parse_time('str')
+
+
+def test_issue_record():
+    issue = parsed_issue(7, fail_in=timedelta(hours=3))
+    assert issue.key == 'PCR-7'
+    assert issue.summary == 'Задача номер 7'
+    assert issue.deadline.tzinfo.zone == tz.zone
+    assert issue.is_hot(datetime.now(tz))
+    assert issue.deadline_text == issue.deadline.strftime('%H:%M:%S %d.%m.%Y (%Z)')
+
+
+def test_latest_issues_keeps_only_fresh_and_newly_hot():
+    old_stamp = (datetime.now(tz) - timedelta(days=1)).strftime(time_format)
+    fresh = make_raw_issue(1)
+    stale = make_raw_issue(2, createdAt=old_stamp, updatedAt=old_stamp)
+    newly_hot = make_raw_issue(3, fail_in=timedelta(hours=3, minutes=50), createdAt=old_stamp, updatedAt=old_stamp)
+    long_hot = make_raw_issue(4, fail_in=timedelta(hours=1), createdAt=old_stamp, updatedAt=old_stamp)
+    raw = [fresh, stale, newly_hot, long_hot]
+    for issue in raw:
+        issue['sla'] = issue['sla'][:1]
+    assert [issue.key for issue in yac.latest_issues(yac.get_list_issues(raw))] == ['PCR-1', 'PCR-3']
+    assert [issue['key'] for issue in yac.filter_issues_by_time(raw)] == ['PCR-1', 'PCR-3']
@@ -0,0 +1,39 @@
+from ..issues import make_issue
+from ..ledger import DeliveryLedger
+from .stub_tracker import make_issue as make_raw_issue, parsed_issue
+
+
+def test_unchanged_issues_are_not_resent():
+    ledger = DeliveryLedger()
+    raw = [make_raw_issue(1), make_raw_issue(2)]
+    issues = [make_issue(task) for task in raw]
+    assert ledger.diff(1, issues) == issues
+    ledger.commit(1, issues)
+    # Повторный опрос вернул те же задачи: отправлять нечего.
+    assert ledger.diff(1, [make_issue(task) for task in raw]) == []
+    # Журналы пользователей независимы.
+    assert ledger.diff(2, issues) == issues
+
+
+def test_changed_fields_are_detected():
+    ledger = DeliveryLedger()
+    raw = [make_raw_issue(n) for n in (1, 2, 3)]
+    ledger.commit(1, [make_issue(task) for task in raw])
+    raw[0]['summary'] = 'Новое название'
+    raw[1]['status'] = {'key': 'closed', 'display': 'Закрыт'}
+    fetched = [make_issue(task) for task in raw]
+    assert ledger.diff(1, fetched) == fetched[:2]
+
+
+def test_ledger_is_bounded_and_persistable():
+    ledger = DeliveryLedger(max_issues=2)
+    issues = [parsed_issue(1), parsed_issue(2), parsed_issue(3)]
+    ledger.commit(1, issues)
+    dumped = ledger.dump(1)
+    assert list(dumped) == ['PCR-2', 'PCR-3']
+
+    restored = DeliveryLedger()
+    restored.load(1, dumped)
+    assert restored.diff(1, issues[1:]) == []
+    restored.forget(1)
+    assert len(restored) == 0
@@ -0,0 +1,80 @@
+import json
+import os
+import time
+
+from loguru import logger
+
+from .. import logging_setup
+from ..logging_setup import BatchingFileSink
+
+
+def read_lines(path) -> list:
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_records_are_written_in_batches(tmp_path):
+    path = tmp_path / 'logs.json'
+    sink = BatchingFileSink(str(path), flush_interval=60)
+    handler = logger.add(sink.write, format='{message}')
+    try:
+        logger.bind(chat=1).info('Опрос трекера')
+        logger.warning('Сервер вернул плохой статус код: 500')
+        # Вызов логгера только ставит запись в очередь.
+        assert not path.exists()
+        sink.flush()
+    finally:
+        logger.remove(handler)
+        sink.close()
+    lines = read_lines(path)
+    assert [line['message'] for line in lines] == ['Опрос трекера', 'Сервер вернул плохой статус код: 500']
+    assert [line['level'] for line in lines] == ['INFO', 'WARNING']
+    assert lines[0]['extra'] == {'chat': 1}
+    assert sink.batches == 1
+
+
+def test_rotation_compresses_and_keeps_retention(tmp_path):
+    path = tmp_path / 'logs.json'
+    sink = BatchingFileSink(str(path), rotation_bytes=300, retention=2, flush_interval=60)
+    handler = logger.add(sink.write, format='{message}')
+    try:
+        for batch in range(6):
+            for number in range(3):
+                logger.info(f'Пачка {batch}, сообщение {number}')
+            sink.flush()
+    finally:
+        logger.remove(handler)
+        sink.close()
+    rotated = sorted(name for name in os.listdir(tmp_path) if name != 'logs.json')
+    assert len(rotated) == 2
+    assert all(name.endswith('.json.gz') for name in rotated)
+    # Последняя пачка осталась в текущем файле.
+    assert read_lines(path)[-1]['message'] == 'Пачка 5, сообщение 2'
+
+
+def test_setup_logging_is_idempotent(tmp_path):
+    path = str(tmp_path / 'logs.json')
+    sink = logging_setup.setup_logging(path)
+    try:
+        assert logging_setup.setup_logging(path) is sink
+        logger.info('Одна запись')
+    finally:
+        logging_setup.shutdown_logging()
+    assert [line['message'] for line in read_lines(path)] == ['Одна запись']
+
+
+def test_failed_batches_are_counted_and_reported(tmp_path, capsys):
+    # Вместо файла лога - каталог: открыть его на запись нельзя.
+    sink = BatchingFileSink(str(tmp_path), flush_interval=0.01)
+    handler = logger.add(sink.write, format='{message}')
+    try:
+        logger.info('Запись, которую не удастся сохранить')
+        deadline = time.monotonic() + 5
+        while not sink.failed_batches and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        logger.remove(handler)
+        sink.close()
+    assert sink.failed_batches == 1
+    assert sink.batches == 0
+    assert 'Не удалось записать логи' in capsys.readouterr().err
@@ -0,0 +1,74 @@
+import asyncio
+
+import aiohttp
+
+from .. import metrics
+from .. import yandex_api_connector as yac
+from .conftest import run
+
+
+def test_registry_renders_prometheus_text():
+    registry = metrics.Registry()
+    requests = registry.counter('requests_total', 'Запросы', ('status',))
+    latency = registry.histogram('latency_seconds', 'Задержка', buckets=(0.1, 1))
+    requests.inc(status=200)
+    requests.inc(2, status=200)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert 'requests_total{status="200"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'latency_seconds_count 3' in text
+
+
+def test_timed_records_latency_and_nested_spans():
+    @metrics.timed('test_inner')
+    def inner():
+        return 'inner'
+
+    @metrics.timed('test_outer')
+    async def outer():
+        await asyncio.sleep(0)
+        return inner()
+
+    assert asyncio.run(outer()) == 'inner'
+    assert metrics.call_latency.count(call='test_inner') == 1
+    assert metrics.call_latency.count(call='test_outer') == 1
+    inner_span, outer_span = list(metrics.finished_spans)[-2:]
+    # Вложенный вызов попадает в трассу внешнего.
+    assert (inner_span.name, outer_span.name) == ('test_inner', 'test_outer')
+    assert inner_span.trace_id == outer_span.trace_id
+    assert inner_span.parent_id == outer_span.span_id
+
+
+def test_tracker_responses_are_counted(stub):
+    responses = yac.tracker_responses
+    before = responses.value(call='get_user_issues', status=200)
+    issues = run(yac.get_issues_async('stub-token'))
+    assert len(issues) == 2
+    assert responses.value(call='get_user_issues', status=200) == before + 1
+    assert run(yac.get_headers_async('wrong-token')) is None
+    assert responses.value(call='get_headers', status=401) >= 1
+
+
+def test_metrics_endpoint():
+    async def scenario():
+        runner = await metrics.start_server(port=0)
+        port = runner.addresses[0][1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'http://127.0.0.1:{port}/metrics') as response:
+                    text = await response.text()
+                async with session.get(f'http://127.0.0.1:{port}/traces') as response:
+                    traces = await response.json()
+        finally:
+            await runner.cleanup()
+        return text, traces
+    text, traces = asyncio.run(scenario())
+    assert '# TYPE bot_call_duration_seconds histogram' in text
+    assert '# TYPE poll_lag_seconds histogram' in text
+    assert isinstance(traces, list)
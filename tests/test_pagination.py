@@ -0,0 +1,39 @@
+from .. import yandex_api_connector as yac
+from .conftest import run
+from .stub_tracker import make_issue
+
+
+def test_paged_query():
+    assert yac.paged('issues?filter=queue:PCR&', 2, 10) == 'issues?filter=queue:PCR&perPage=10&page=2'
+    assert yac.paged('issues?query=Queue', 1, 10) == 'issues?query=Queue&perPage=10&page=1'
+
+
+def test_all_pages_are_fetched(stub, monkeypatch):
+    monkeypatch.setattr(yac, 'issues_per_page', 10)
+    stub.issues = [make_issue(n) for n in range(25)]
+    issues = run(yac.get_issues_async(stub.token))
+    assert len(issues) == 25
+    assert stub.requests['/v2/issues'] == 3
+
+
+def test_pages_are_streamed(stub, monkeypatch):
+    monkeypatch.setattr(yac, 'issues_per_page', 10)
+    stub.issues = [make_issue(n) for n in range(25)]
+
+    async def scenario():
+        pages = await yac.get_issue_pages_async(stub.token)
+        return [len(page) async for page in pages]
+    assert run(scenario()) == [10, 10, 5]
+
+
+def test_raw_issues_from_all_pages(stub, monkeypatch):
+    monkeypatch.setattr(yac, 'issues_per_page', 2)
+    stub.issues = [make_issue(n) for n in range(5)]
+    issues = run(yac.get_user_issues_async({'Authorization': f'OAuth {stub.token}'}))
+    assert [issue['key'] for issue in issues] == [f'PCR-{n}' for n in range(5)]
+    # SLA фильтруется на каждой странице.
+    assert all(len(issue['sla']) == 1 for issue in issues)
+
+
+def test_invalid_token_returns_none(stub):
+    assert run(yac.get_issue_pages_async('kawabanga')) is None
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+from ..config import tz
+from ..paging import StatusPages, status_page
+from ..rendering import IssueRenderer
+from .stub_tracker import parsed_issue
+
+
+def issues(*hours) -> list:
+    return [parsed_issue(number, fail_in=timedelta(hours=fail_in)) for number, fail_in in enumerate(hours)]
+
+
+def buttons(markup) -> list:
+    return [status_page.parse(button.callback_data) for button in markup.inline_keyboard[0]] if markup else []
+
+
+def test_snapshot_is_sorted_by_deadline():
+    pages = StatusPages(page_size=2)
+    snapshot = pages.take(1, issues(10, 1, 5, 2), datetime.now(tz))
+    assert [issue.key for issue in snapshot.issues] == ['PCR-1', 'PCR-3', 'PCR-2', 'PCR-0']
+    # Горящие задачи (до дедлайна меньше hot_before) отобраны заранее.
+    assert [issue.key for issue in snapshot.hot] == ['PCR-1', 'PCR-3']
+    tasks, number, total = pages.page(snapshot, 1)
+    assert ([issue.key for issue in tasks], number, total) == (['PCR-2', 'PCR-0'], 1, 2)
+    # Номер за пределами списка приводится к последней странице.
+    assert pages.page(snapshot, 5)[1:] == (1, 2)
+    assert pages.page(snapshot, 0, hot_only=True)[1:] == (0, 1)
+
+
+def test_keyboard():
+    pages = StatusPages(page_size=2)
+    snapshot = pages.take(1, issues(10, 1, 5, 2, 20), datetime.now(tz))
+    first = buttons(pages.keyboard(snapshot, 0, 3))
+    assert [(button['page'], button['hot']) for button in first] == [('1', '0'), ('0', '1')]
+    middle = buttons(pages.keyboard(snapshot, 1, 3))
+    assert [button['page'] for button in middle] == ['0', '2', '0']
+    assert all(button['snapshot'] == str(snapshot.id) for button in middle)
+    # Все горящие задачи на одной странице: остается только возврат ко всем задачам.
+    assert [button['hot'] for button in buttons(pages.keyboard(snapshot, 0, 1, hot_only=True))] == ['0']
+    single = pages.take(2, issues(10), datetime.now(tz))
+    assert pages.keyboard(single, 0, 1) is None
+
+
+def test_new_status_replaces_snapshot():
+    pages = StatusPages(max_snapshots=2)
+    now = datetime.now(tz)
+    old = pages.take(1, issues(10), now)
+    new = pages.take(1, issues(5), now)
+    assert pages.get(1, old.id) is None
+    assert pages.get(1, new.id) is new
+    pages.take(2, issues(10), now)
+    pages.take(3, issues(10), now)
+    # Снимков не больше max_snapshots, давно не листавшие вытесняются.
+    assert len(pages) == 2
+    assert pages.get(1, new.id) is None
+
+
+def test_page_header():
+    renderer = IssueRenderer()
+    assert renderer.page_header(0, 1) == 'Ваши текущие задачи:'
+    assert renderer.page_header(1, 3) == 'Ваши текущие задачи (страница 2 из 3):'
+    assert 'Горящие задачи (страница 1 из 2)' in renderer.page_header(0, 2, hot_only=True)
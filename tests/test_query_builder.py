@@ -0,0 +1,70 @@
+import asyncio
+import gc
+
+import pytest
+
+from .. import yandex_api_connector as yac
+from .. import query_builder
+from ..config import filter_cache_size, issue_filter, issue_query, team_filter
+from ..query_builder import compile_filter, compile_query, default_filter, filter_from_data, parse_filter
+from .conftest import run
+from .stub_tracker import make_issue
+
+
+def test_default_filter_matches_config():
+    assert compile_filter(default_filter) == issue_filter
+    assert compile_filter(default_filter, mine=False) == team_filter
+    assert compile_query(default_filter) == issue_query
+
+
+def test_equal_filters_are_one_object():
+    first = parse_filter('queue=ops,PCR status=open,inProgress priority=Critical')
+    second = parse_filter('status=inProgress,open queue=PCR,OPS,ops priority=critical')
+    assert first is second
+    assert filter_from_data(first.as_dict()) is first
+    assert filter_from_data(None) is default_filter
+    assert compile_filter(first) == ('issues?filter=queue:OPS,PCR&filter=assignee:me()&'
+                                     'filter=status:inProgress,open&filter=priority:critical&')
+    assert compile_query(parse_filter('queue=PCR component="Мобильное приложение"')) == (
+        'Queue: PCR Assignee: me() Status: open Components: "Мобильное приложение"')
+
+
+def test_unused_filters_are_not_kept():
+    for number in range(filter_cache_size + 10):
+        compile_filter(parse_filter(f'queue=Q{number}'))
+    gc.collect()
+    # Строки запросов хранятся только для последних фильтров, а сами фильтры - пока на них есть ссылки.
+    assert compile_filter.cache_info().currsize <= filter_cache_size
+    assert not any(cached.queues == ('Q0',) for cached in list(query_builder._filters.values()))
+
+
+def test_invalid_filters():
+    with pytest.raises(ValueError):
+        parse_filter('owner=me')
+    with pytest.raises(ValueError):
+        parse_filter('queue')
+    with pytest.raises(ValueError):
+        parse_filter('queue=,')
+
+
+def test_filter_matches_raw_issue():
+    issue_filter = parse_filter('queue=PCR status=open,inProgress component=Backend')
+    assert issue_filter.matches(make_issue(1, components=[{'id': '1', 'display': 'Backend'}]))
+    assert not issue_filter.matches(make_issue(1))
+    assert not issue_filter.matches(make_issue(1, queue='OPS', components=[{'display': 'Backend'}]))
+    assert not issue_filter.matches(make_issue(1, status={'key': 'closed'}, components=[{'display': 'Backend'}]))
+
+
+def test_users_with_equal_filters_share_fetches(stub):
+    stub.latency = 0.05
+    stub.issues = [make_issue(1), make_issue(2, queue='OPS'), make_issue(3, queue='WEB')]
+
+    async def scenario():
+        return await asyncio.gather(yac.get_issues_async(stub.token, parse_filter('queue=pcr,ops')),
+                                    yac.get_issues_async(stub.token, parse_filter('queue=OPS,PCR')))
+    first, second = run(scenario())
+    assert [issue.key for issue in first] == ['PCR-1', 'OPS-2'] == [issue.key for issue in second]
+    assert stub.requests['/v2/issues'] == 1
+    # Второй запрос с тем же фильтром отдается из кэша.
+    run(yac.get_issues_async(stub.token, parse_filter('queue=ops,pcr')))
+    assert stub.requests['/v2/issues'] == 1
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import aiogram.utils.markdown as md
+from aiogram.utils.emoji import emojize
+
+from ..config import time_remain, tz
+from ..rendering import IssueRenderer
+from .stub_tracker import parsed_issue
+
+
+def legacy_text(task, now) -> str:
+    # Прежнее форматирование из send_issues.
+    if task.is_hot(now):
+        return md.text(
+            md.text(f'{emojize(":red_exclamation_mark:" * 3)}Эта задача в огне!'
+                    f'{emojize(":red_exclamation_mark:" * 3)}'),
+            md.text(f'*Наименование задачи*: {task.summary}'),
+            md.text(f'{emojize(":fire:" * 3)}*Дедлайн*: {task.deadline_text}'),
+            md.text(f'*До сгорания осталось*: {time_remain(task.deadline, now)}'),
+            sep='\n',
+        )
+    return md.text(
+        md.text(f'*Наименование задачи*: {task.summary}'),
+        md.text(f'*Дедлайн*: {task.deadline_text}'),
+        md.text(f'*До сгорания осталось*: {time_remain(task.deadline, now)}'),
+        sep='\n',
+    )
+
+
+def test_matches_legacy_formatting():
+    renderer = IssueRenderer()
+    now = datetime.now(tz)
+    for task in (parsed_issue(1, fail_in=timedelta(hours=10)), parsed_issue(2, fail_in=timedelta(hours=1)),
+                 parsed_issue(3, fail_in=timedelta(hours=-1))):
+        assert renderer.render(task, now) == legacy_text(task, now)
+
+
+def test_only_time_remaining_is_recomputed():
+    renderer = IssueRenderer()
+    task = parsed_issue(1, fail_in=timedelta(hours=10))
+    now = datetime.now(tz)
+    first = renderer.render(task, now)
+    later = renderer.render(task, now + timedelta(minutes=5))
+    assert (renderer.misses, renderer.hits) == (1, 1)
+    assert first != later
+    assert later.endswith(time_remain(task.deadline, now + timedelta(minutes=5)))
+    # Задача стала горящей: нужен другой шаблон.
+    renderer.render(task, task.hot_at + timedelta(seconds=1))
+    # Изменилось название: отпечаток другой, текст собирается заново.
+    renamed = renderer.render(task._replace(summary='Новое название'), now)
+    assert 'Новое название' in renamed
+    assert renderer.misses == 3
+
+
+def test_cache_is_bounded():
+    renderer = IssueRenderer(max_entries=10)
+    now = datetime.now(tz)
+    for number in range(30):
+        renderer.render(parsed_issue(number, fail_in=timedelta(hours=10)), now)
+    assert len(renderer) == 10
@@ -0,0 +1,135 @@
+import asyncio
+
+from ..scheduler import SubscriptionScheduler
+
+
+def test_subscribe_and_unsubscribe():
+    async def job(subscription):
+        pass
+
+    async def scenario():
+        scheduler = SubscriptionScheduler(job, interval=60)
+        scheduler.subscribe(1, 'token')
+        scheduler.subscribe(2, 'token')
+        # Повторная подписка заменяет старую, а не дублирует ее.
+        scheduler.subscribe(1, 'new-token')
+        assert len(scheduler) == 2
+        assert scheduler.unsubscribe(1)
+        assert not scheduler.unsubscribe(1)
+        assert 1 not in scheduler and 2 in scheduler
+    asyncio.run(scenario())
+
+
+def test_due_subscriptions_are_polled_repeatedly():
+    polls = []
+
+    async def job(subscription):
+        polls.append((subscription.chat_id, subscription.token))
+
+    async def scenario():
+        scheduler = SubscriptionScheduler(job, interval=0.05, workers=2, jitter=0)
+        scheduler.subscribe(1, 'a', delay=0)
+        scheduler.subscribe(2, 'b', delay=0)
+        await scheduler.start()
+        await asyncio.sleep(0.13)
+        await scheduler.stop()
+    asyncio.run(scenario())
+    assert polls.count((1, 'a')) >= 2
+    assert polls.count((2, 'b')) >= 2
+
+
+def test_cancelled_subscription_is_not_polled():
+    polls = []
+
+    async def job(subscription):
+        polls.append(subscription.chat_id)
+
+    async def scenario():
+        scheduler = SubscriptionScheduler(job, interval=0.05, jitter=0)
+        scheduler.subscribe(1, 'a', delay=0.02)
+        scheduler.subscribe(2, 'b', delay=0.02)
+        scheduler.unsubscribe(1)
+        await scheduler.start()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+    asyncio.run(scenario())
+    assert polls and set(polls) == {2}
+
+
+def test_worker_pool_is_bounded():
+    running = 0
+    peak = 0
+
+    async def job(subscription):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def scenario():
+        scheduler = SubscriptionScheduler(job, interval=10, workers=3)
+        for chat_id in range(20):
+            scheduler.subscribe(chat_id, 'token', delay=0)
+        await scheduler.start()
+        await asyncio.sleep(0.1)
+        await scheduler.stop()
+    asyncio.run(scenario())
+    assert peak == 3
+
+
+def test_heap_is_compacted_after_mass_unsubscribe():
+    async def job(subscription):
+        pass
+
+    async def scenario():
+        scheduler = SubscriptionScheduler(job, interval=60)
+        for chat_id in range(100):
+            scheduler.subscribe(chat_id, 'token')
+        for chat_id in range(90):
+            scheduler.unsubscribe(chat_id)
+        assert len(scheduler._heap) < 50
+    asyncio.run(scenario())
+
+
+def test_failed_polls_back_off():
+    polls = []
+
+    async def job(subscription):
+        polls.append(subscription.chat_id)
+        # Первый чат получает ошибки, второй - Retry-After от трекера.
+        return 0.0 if subscription.chat_id == 1 else 0.15
+
+    async def scenario():
+        scheduler = SubscriptionScheduler(job, interval=0.02, jitter=0, max_backoff=0.08)
+        subscription = scheduler.subscribe(1, 'a', delay=0)
+        scheduler.subscribe(2, 'b', delay=0)
+        await scheduler.start()
+        await asyncio.sleep(0.25)
+        await scheduler.stop()
+        return subscription
+    subscription = asyncio.run(scenario())
+    # Без паузы за это время было бы больше 12 опросов: паузы 0.02, 0.04, 0.08, 0.08...
+    assert 3 <= polls.count(1) <= 5
+    assert subscription.failures == polls.count(1)
+    assert polls.count(2) == 2
+
+
+def test_unsubscribe_during_poll_keeps_heap_accounting():
+    async def job(subscription):
+        # Подписка отменяется, пока идет ее опрос (как /cancel во время опроса).
+        scheduler.unsubscribe(subscription.chat_id)
+
+    async def scenario():
+        for chat_id in range(10):
+            scheduler.subscribe(chat_id, 'token', delay=0)
+        for chat_id in range(100, 110):
+            scheduler.subscribe(chat_id, 'token', delay=60)
+        await scheduler.start()
+        await asyncio.sleep(0.05)
+        await scheduler.stop()
+    scheduler = SubscriptionScheduler(job, interval=60)
+    asyncio.run(scenario())
+    assert len(scheduler) == 10
+    # Отмененные во время опроса подписки не считаются лежащими в куче.
+    assert scheduler._removed == 0
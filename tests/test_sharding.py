@@ -0,0 +1,111 @@
+import asyncio
+import os
+from collections import Counter
+
+from ..sharding import HashRing, ShardRouter, ShardChannel
+
+
+def test_keys_are_spread_evenly():
+    ring = HashRing(range(4))
+    owners = Counter(ring.node_for(chat_id) for chat_id in range(10000))
+    assert set(owners) == {0, 1, 2, 3}
+    assert max(owners.values()) < 2 * min(owners.values())
+
+
+def test_adding_and_removing_nodes_moves_minimal_set():
+    ring = HashRing(range(4))
+    before = {chat_id: ring.node_for(chat_id) for chat_id in range(10000)}
+
+    ring.add(4)
+    after = {chat_id: ring.node_for(chat_id) for chat_id in range(10000)}
+    moved = [chat_id for chat_id in before if before[chat_id] != after[chat_id]]
+    # Переезжают только ключи нового узла, примерно пятая часть.
+    assert all(after[chat_id] == 4 for chat_id in moved)
+    assert 1000 < len(moved) < 3000
+
+    ring.remove(4)
+    assert {chat_id: ring.node_for(chat_id) for chat_id in range(10000)} == before
+
+
+async def serve_echo(channel: ShardChannel, label: str = None):
+    # Рабочий процесс для теста: на каждую команду отвечает отчетом со своим номером, числом процессов
+    # и переданным роутером аргументом. Команда update с данными crash имитирует падение процесса.
+    async for command, chat_id, payload in channel.commands():
+        if command == 'update' and payload.get('crash'):
+            os._exit(1)
+        channel.report((chat_id, None, {'worker': channel.index, 'command': command, 'workers': channel.workers,
+                                        'label': label}))
+
+
+def test_router_routes_commands_and_rebalances():
+    reports = []
+
+    def on_report(chat_id, user_id, data):
+        reports.append((chat_id, data))
+
+    async def wait_reports(count):
+        while len(reports) < count:
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        router = ShardRouter(serve_echo, workers=2, on_report=on_report, args=('echo',))
+        await router.start()
+        for chat_id in range(1, 41):
+            router.subscribe(chat_id, chat_id, {'token': f'token-{chat_id}'})
+        await asyncio.wait_for(wait_reports(40), 30)
+        assert all(data['worker'] == router.ring.node_for(chat_id) for chat_id, data in reports)
+        assert all(data['label'] == 'echo' for _, data in reports)
+
+        reports.clear()
+        await router.resize(3)
+        moved = router.moved
+        # Старый владелец получает unsubscribe, новый - subscribe, оставшиеся процессы - новое число процессов.
+        await asyncio.wait_for(wait_reports(2 * moved + 2), 30)
+        assert 0 < moved < 40
+        assert {data['worker'] for _, data in reports if data['command'] == 'subscribe'} == {2}
+        assert {data['worker'] for _, data in reports if data['command'] == 'unsubscribe'} <= {0, 1}
+        assert sorted(data['worker'] for _, data in reports if data['command'] == 'workers') == [0, 1]
+        assert all(data['workers'] == 3 for _, data in reports if data['command'] in ('subscribe', 'workers'))
+
+        router.unsubscribe(1)
+        assert len(router) == 39
+        await router.stop()
+    asyncio.run(scenario())
+
+
+def test_crashed_worker_is_restarted_with_its_subscriptions():
+    reports = []
+
+    def on_report(chat_id, user_id, data):
+        reports.append((chat_id, data))
+
+    async def wait_reports(count):
+        while len(reports) < count:
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        router = ShardRouter(serve_echo, workers=1, on_report=on_report)
+        await router.start()
+        for chat_id in range(1, 6):
+            router.subscribe(chat_id, chat_id, {'token': f'token-{chat_id}'})
+        await asyncio.wait_for(wait_reports(5), 30)
+        reports.clear()
+        router.update(1, {'crash': True})
+        # Новый процесс получает все подписки упавшего заново, с последними данными.
+        await asyncio.wait_for(wait_reports(5), 30)
+        assert router.restarts == 1
+        assert sorted(chat_id for chat_id, data in reports if data['command'] == 'subscribe') == [1, 2, 3, 4, 5]
+        await router.stop()
+        assert router.restarts == 1
+    asyncio.run(scenario())
+
+
+def test_scale_keeps_at_least_one_worker():
+    async def scenario():
+        router = ShardRouter(serve_echo, workers=1)
+        await router.start()
+        added = await router.scale(1)
+        removed = await router.scale(-5)
+        await router.stop()
+        return added, removed, router.workers
+    assert asyncio.run(scenario()) == (2, 1, 1)
@@ -0,0 +1,83 @@
+import asyncio
+
+from .. import yandex_api_connector as yac
+from ..singleflight import SingleFlight
+from .conftest import run
+
+
+def test_concurrent_status_calls_share_one_request(stub):
+    stub.latency = 0.1
+
+    async def many():
+        return await asyncio.gather(*(yac.get_issues_async(stub.token) for _ in range(20)))
+    results = run(many())
+    assert all(issues == results[0] and len(issues) == 2 for issues in results)
+    assert stub.requests['/v2/myself'] == 1
+    assert stub.requests['/v2/issues'] == 1
+
+
+def test_uncached_queries_are_coalesced(stub):
+    stub.latency = 0.1
+
+    async def many():
+        return await asyncio.gather(*(yac.get_updated_issues_async(stub.token, None) for _ in range(10)))
+    results = run(many())
+    assert all(len(issues) == 2 for issues, _ in results)
+    assert stub.requests['/v2/issues'] == 1
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    flights = SingleFlight()
+    started = 0
+
+    async def fetch():
+        nonlocal started
+        started += 1
+        await asyncio.sleep(0.05)
+        return 'issues'
+
+    async def scenario():
+        first = asyncio.ensure_future(flights.do('key', fetch))
+        second = asyncio.ensure_future(flights.do('key', fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == 'issues'
+        assert first.cancelled()
+    asyncio.run(scenario())
+    assert started == 1
+    assert (flights.calls, flights.shared, len(flights)) == (1, 1, 0)
+
+
+def test_request_is_cancelled_when_nobody_waits():
+    flights = SingleFlight()
+    finished = []
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        finished.append(True)
+        return 'issues'
+
+    async def scenario():
+        caller = asyncio.ensure_future(flights.do('key', fetch))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0)
+        # Новый вызов запускает запрос заново, а не ждет отмененный.
+        assert await flights.do('key', fetch) == 'issues'
+    asyncio.run(scenario())
+    assert finished == [True]
+    assert flights.calls == 2
+
+
+def test_only_joined_calls_are_counted_as_coalesced(stub):
+    stub.latency = 0.1
+    other = {'Authorization': 'OAuth other-token'}
+    stub.users = {'other-token': 'other'}
+
+    async def many():
+        # Три одинаковых запроса и одновременный с ними одиночный запрос другого пользователя.
+        await asyncio.gather(*(yac.get_user_issues_async({'Authorization': f'OAuth {stub.token}'})
+                               for _ in range(3)), yac.get_user_issues_async(other))
+    before = yac.coalesced_calls.value(call='get_user_issues')
+    run(many())
+    assert yac.coalesced_calls.value(call='get_user_issues') - before == 2
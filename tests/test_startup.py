@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code: str, tmp_path) -> dict:
+    # Запуск в отдельном процессе: проверяется, что именно загружает импорт с холодными модулями.
+    env = dict(os.environ, TELEGRAM_TOKEN='123456:' + 'A' * 35, LOG_FILE=str(tmp_path / 'logs.json'))
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+                            stdout=subprocess.PIPE).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def test_import_has_no_side_effects(tmp_path):
+    result = run_python(
+        'import json, sys\n'
+        'import yandex_api_connector\n'
+        'connector_aiogram = "aiogram" in sys.modules\n'
+        'import telegram_bot_logic as bot\n'
+        'print(json.dumps({"connector_aiogram": connector_aiogram, "built": sorted(vars(bot.app))}))\n',
+        tmp_path)
+    # Коннектор трекера не тянет aiogram, а импорт бота не создает ни Bot, ни диспетчер, ни хранилище.
+    assert not result['connector_aiogram']
+    assert result['built'] == ['metrics_server', 'settings', 'shard_channel', 'shard_reports', 'team_users', 'teams']
+    assert not (tmp_path / 'logs.json').exists()
+
+
+def test_create_app_builds_dispatcher_on_demand(tmp_path):
+    result = run_python(
+        'import json\n'
+        'from dataclasses import replace\n'
+        'import telegram_bot_logic as bot\n'
+        'from config import settings\n'
+        'app = bot.create_app(replace(settings, fsm_storage="memory"))\n'
+        'handlers = len(app.dp.message_handlers.handlers)\n'
+        'print(json.dumps({"handlers": handlers, "same": bot.dp is app.dp and bot.app is app,\n'
+        '                  "storage": type(app.storage).__name__, "shards": app.shards is None}))\n',
+        tmp_path)
+    assert result == {'handlers': 9, 'same': True, 'storage': 'MemoryStorage', 'shards': True}
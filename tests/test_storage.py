@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from ..storage import SQLiteStorage
+
+
+def test_state_and_data_survive_restart(tmp_path):
+    path = str(tmp_path / 'fsm.sqlite3')
+
+    async def first_run():
+        storage = SQLiteStorage(path)
+        await storage.set_state(chat=1, user=1, state='Form:yes_or_not')
+        await storage.set_data(chat=1, user=1, data={'token': 'secret', 'answer': 'да'})
+        await storage.update_data(chat=1, user=1, data={'watermark': '2021-01-01T00:00:00+03:00'})
+        await storage.close()
+        await storage.wait_closed()
+
+    async def second_run():
+        storage = SQLiteStorage(path)
+        state = await storage.get_state(chat=1, user=1)
+        data = await storage.get_data(chat=1, user=1)
+        await storage.close()
+        return state, data
+
+    asyncio.run(first_run())
+    state, data = asyncio.run(second_run())
+    assert state == 'Form:yes_or_not'
+    assert data == {'token': 'secret', 'answer': 'да', 'watermark': '2021-01-01T00:00:00+03:00'}
+
+
+def test_writes_are_batched(tmp_path):
+    path = str(tmp_path / 'fsm.sqlite3')
+    writes = []
+
+    async def scenario():
+        storage = SQLiteStorage(path, flush_interval=0.05)
+        original = storage._write
+        storage._write = lambda rows: (writes.append(len(rows)), original(rows))
+        for chat in range(100):
+            await storage.set_state(chat=chat, user=chat, state='Form:token')
+        await asyncio.sleep(0.1)
+        await storage.close()
+    asyncio.run(scenario())
+    assert writes == [100]
+
+
+def test_finished_dialogs_are_removed(tmp_path):
+    path = str(tmp_path / 'fsm.sqlite3')
+
+    async def scenario():
+        storage = SQLiteStorage(path)
+        await storage.set_state(chat=1, user=1, state='Form:token')
+        await storage.flush()
+        await storage.finish(chat=1, user=1)
+        await storage.flush()
+        rows = await storage.states('Form:token')
+        await storage.close()
+        return rows
+    assert asyncio.run(scenario()) == []
+
+
+def test_subscriptions_are_loaded_quickly(tmp_path):
+    path = str(tmp_path / 'fsm.sqlite3')
+
+    async def fill():
+        storage = SQLiteStorage(path)
+        for chat in range(10000):
+            await storage.set_state(chat=chat, user=chat, state='Form:yes_or_not')
+            await storage.set_data(chat=chat, user=chat, data={'token': f'token-{chat}', 'answer': 'да'})
+        await storage.close()
+
+    async def resume():
+        storage = SQLiteStorage(path)
+        started = time.monotonic()
+        rows = await storage.states('Form:yes_or_not')
+        elapsed = time.monotonic() - started
+        await storage.close()
+        return rows, elapsed
+
+    asyncio.run(fill())
+    rows, elapsed = asyncio.run(resume())
+    assert len(rows) == 10000
+    assert elapsed < 2
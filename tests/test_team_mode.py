@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from .. import yandex_api_connector as yac
+from ..config import time_format, tz
+from ..team_mode import TeamPoller
+from .conftest import run
+from .stub_tracker import make_issue
+
+
+def assigned(number: int, login: str, **fields):
+    return make_issue(number, assignee={'id': login, 'display': login}, **fields)
+
+
+def test_issues_are_fanned_out_by_assignee(stub):
+    stub.users = {'service-token': 'robot'}
+    stub.issues = [assigned(1, 'alice'), assigned(2, 'bob'), assigned(3, 'alice'), make_issue(4)]
+    team = TeamPoller(token='service-token', ttl=60)
+
+    async def scenario():
+        return await asyncio.gather(*(team.issues_for(login) for login in ['alice', 'bob', 'carol'] * 10))
+    results = run(scenario())
+    assert [issue.key for issue in results[0]] == ['PCR-1', 'PCR-3']
+    assert [issue.key for issue in results[1]] == ['PCR-2']
+    assert results[2] == []
+    # Тридцать подписчиков - один запрос задач очереди.
+    assert stub.requests['/v2/issues'] == 1
+    assert team.refreshes == 1
+
+
+def test_snapshot_is_refreshed_after_ttl(stub):
+    stub.users = {'service-token': 'robot'}
+    stub.issues = [assigned(1, 'alice')]
+    team = TeamPoller(token='service-token', ttl=0)
+
+    async def scenario():
+        await team.issues_for('alice')
+        stub.issues.append(assigned(2, 'alice'))
+        return await team.issues_for('alice')
+    assert len(run(scenario())) == 2
+    assert team.refreshes == 2
+
+
+def test_updates_since_watermark(stub):
+    stub.users = {'service-token': 'robot'}
+    old_stamp = (datetime.now(tz) - timedelta(days=1)).strftime(time_format)
+    stub.issues = [assigned(1, 'alice', updatedAt=old_stamp), assigned(2, 'alice')]
+    team = TeamPoller(token='service-token')
+    since = datetime.now(tz) - timedelta(hours=1)
+    issues, watermark = run(team.updates_for('alice', since))
+    assert [issue.key for issue in issues] == ['PCR-2']
+    assert watermark > since
+
+
+def test_invalid_service_token(stub):
+    team = TeamPoller(token='kawabanga')
+    assert run(team.issues_for('alice')) is None
+
+
+def test_login_of_token(stub):
+    assert run(yac.get_login_async(stub.token)) == 'stub-user'
+    assert run(yac.get_login_async('kawabanga')) is None
@@ -0,0 +1,60 @@
+import time
+
+from .. import yandex_api_connector as yac
+from ..issue_cache import IssueCache
+from ..token_cache import TokenCache
+from .conftest import run
+
+
+def test_cache_hit_and_miss():
+    cache = TokenCache(ttl=60, maxsize=10)
+    assert not cache.get('token')
+    cache.add('token')
+    assert cache.get('token')
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+
+def test_cache_does_not_store_plaintext():
+    cache = TokenCache()
+    cache.add('secret-token')
+    assert all(b'secret-token' not in key for key in cache._entries)
+
+
+def test_cache_expires_entries():
+    cache = TokenCache(ttl=0.01)
+    cache.add('token')
+    time.sleep(0.02)
+    assert not cache.get('token')
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used():
+    cache = TokenCache(maxsize=2)
+    cache.add('a')
+    cache.add('b')
+    cache.get('a')
+    cache.add('c')
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert cache.evictions == 1
+
+
+def test_myself_is_requested_once(stub):
+    async def two_polls():
+        await yac.get_issues_async(stub.token)
+        await yac.get_issues_async(stub.token)
+    run(two_polls())
+    assert stub.requests['/v2/myself'] == 1
+
+
+def test_revoked_token_is_dropped(stub, monkeypatch):
+    # Кэш задач без срока свежести, чтобы каждый вызов доходил до трекера.
+    monkeypatch.setattr(yac, 'issue_cache', IssueCache(ttl=0))
+    run(yac.get_issues_async(stub.token))
+    token = stub.token
+    # Токен отозвали: трекер начинает отвечать 401 на любой запрос.
+    stub.token = 'another-token'
+    assert run(yac.get_issues_async(token)) is None
+    assert token not in yac.token_cache
+    assert run(yac.get_issues_async(token)) is None
+    assert stub.requests['/v2/myself'] == 2
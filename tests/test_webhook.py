@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from ..webhook import make_app
+from .fake_telegram import FakeTelegram, make_update, post_updates
+
+
+TOKEN = '123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+def make_dispatcher(fake: FakeTelegram, delay: float = 0.0, stats: dict = None) -> Dispatcher:
+    dp = Dispatcher(Bot(TOKEN, server=TelegramAPIServer.from_base(fake.url)), storage=MemoryStorage())
+    stats = stats if stats is not None else {}
+
+    @dp.message_handler()
+    async def echo(message: types.Message):
+        stats['running'] = stats.get('running', 0) + 1
+        stats['peak'] = max(stats.get('peak', 0), stats['running'])
+        await asyncio.sleep(delay)
+        await message.answer(message.text)
+        stats['running'] -= 1
+    return dp
+
+
+def test_updates_are_processed_within_concurrency_limit():
+    stats = {}
+
+    async def scenario():
+        async with FakeTelegram() as fake:
+            dp = make_dispatcher(fake, delay=0.02, stats=stats)
+            server = TestServer(make_app(dp, url=None, concurrency=3))
+            await server.start_server()
+            async with ClientSession() as session:
+                url = str(server.make_url('/webhook'))
+                statuses = await post_updates(session, url, [make_update(n, n, f'msg {n}') for n in range(1, 21)])
+                async with session.post(url, data='не json') as response:
+                    assert response.status == 400
+            await server.close()
+            return statuses, fake.sent
+    statuses, sent = asyncio.run(scenario())
+    assert statuses == [200] * 20
+    assert sorted(text for _, text, _ in sent) == sorted(f'msg {n}' for n in range(1, 21))
+    assert stats['peak'] <= 3
+
+
+def test_shutdown_drains_in_flight_handlers():
+    events = []
+
+    async def on_shutdown(dispatcher):
+        events.append(('shutdown', time.monotonic()))
+
+    async def scenario():
+        async with FakeTelegram() as fake:
+            dp = make_dispatcher(fake, delay=0.2)
+            server = TestServer(make_app(dp, on_shutdown=on_shutdown, url=None))
+            await server.start_server()
+            async with ClientSession() as session:
+                await post_updates(session, str(server.make_url('/webhook')), [make_update(1, 1, 'медленно')])
+            # Ответ Telegram уже получен, а обработчик еще работает.
+            assert not fake.sent
+            await server.close()
+            events.extend((text, sent_at) for _, text, sent_at in fake.sent)
+    asyncio.run(scenario())
+    # Сообщение успело уйти до остановки планировщика и закрытия сессии.
+    assert [name for name, _ in sorted(events, key=lambda event: event[1])] == ['медленно', 'shutdown']
+
+
+def test_startup_registers_webhook():
+    started = []
+
+    async def on_startup(dispatcher):
+        started.append(dispatcher)
+
+    async def scenario():
+        async with FakeTelegram() as fake:
+            dp = make_dispatcher(fake)
+            app = make_app(dp, on_startup=on_startup, url='https://bot.example/', keep_pending=True)
+            server = TestServer(app)
+            await server.start_server()
+            await server.close()
+            return dp, fake.webhook
+    dp, registered = asyncio.run(scenario())
+    assert started == [dp]
+    assert registered['url'] == 'https://bot.example/webhook'
+    assert registered['drop_pending_updates'] == 'False'
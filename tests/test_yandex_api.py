@@ -3,10 +3,13 @@ from requests import exceptions
 import pytest
 
 from .. import yandex_api_connector as yac
-from ..config import YANDEX_TOKEN, api_url, issue_filter
+from ..circuit_breaker import CircuitBreaker
+from .conftest import run
 
 
-headers = {'Authorization': f'OAuth {YANDEX_TOKEN}'}
+# Тесты работают с локальной заглушкой трекера (фикстура stub), а не с настоящим api.
+def auth(stub) -> dict:
+    return {'Authorization': f'OAuth {stub.token}'}
 
 list_of_issue = [{
     'summary': 'str',
@@ -57,24 +60,24 @@ list_of_invalid_key_issue = [{
 }]
 
 
-def test_token_check_status_code_equels_200():
-    response = requests.get(api_url+'myself', headers=headers)
+def test_token_check_status_code_equels_200(stub):
+    response = requests.get(stub.url + 'myself', headers=auth(stub))
     assert response.status_code == 200
 
 
-def test_get_heders_func():
-    func_header = yac.get_headers(YANDEX_TOKEN)
-    response = requests.get(api_url + 'myself', headers=func_header)
+def test_get_heders_func(stub):
+    func_header = yac.get_headers(stub.token)
+    response = requests.get(stub.url + 'myself', headers=func_header)
     assert response.status_code == 200
 
 
-def test_get_heders_with_wrong_token():
+def test_get_heders_with_wrong_token(stub):
     func_header = yac.get_headers('kawabanga')
     assert func_header is None
 
 
-def test_get_issues_func():
-    response = yac.get_user_issues(headers)
+def test_get_issues_func(stub):
+    response = yac.get_user_issues(auth(stub))
     assert type(response) == list
 
     for issue in response:
@@ -86,8 +89,9 @@ def test_get_issues_func():
         assert issue['sla'][-1]['warnAt']
 
 
-def test_valid_dict_value():
-    response = yac.get_user_issues(headers)
+def test_valid_dict_value(stub):
+    response = yac.get_user_issues(auth(stub))
+    assert response
 
     for issue in response:
         assert type(issue['summary']) == str
@@ -99,18 +103,18 @@ def test_valid_dict_value():
 
 
 @pytest.mark.xfail(raises=AttributeError)
-def test_get_issues_whith_attribute_error():
+def test_get_issues_whith_attribute_error(stub):
     response = yac.get_user_issues('kawabanga')
     assert response is None
 
 
 @pytest.mark.xfail(raises=exceptions.InvalidHeader)
-def test_get_issues_whith_requests_error():
+def test_get_issues_whith_requests_error(stub):
     response = yac.get_user_issues({'kawabanga': 12})
     assert response is None
 
 
-def test_get_issues_whith_invalid_token_in_headers():
+def test_get_issues_whith_invalid_token_in_headers(stub):
     response = yac.get_user_issues({'kawabanga': '12'})
     assert response is None
 
@@ -145,21 +149,47 @@ def test_filter_issues():
     assert type(filter_list) == list
 
 
-def test_get_issues():
-    issues = yac.get_issues(YANDEX_TOKEN)
+def test_get_issues(stub):
+    issues = yac.get_issues(stub.token)
     assert type(issues) == list
 
 
-def test_get_issues_whith_invalid_token():
+def test_get_issues_whith_invalid_token(stub):
     issues = yac.get_issues('kawabanga')
     assert issues is None
 
 
-def test_get_latest_issues():
-    issues = yac.get_latest_issues(YANDEX_TOKEN)
+def test_get_latest_issues(stub):
+    issues = yac.get_latest_issues(stub.token)
     assert type(issues) == list
 
 
-def test_get_latest_issues_whith_invalid_token():
+def test_get_latest_issues_whith_invalid_token(stub):
     issues = yac.get_latest_issues('kawabanga')
     assert issues is None
+
+
+def test_server_errors_are_not_cached_as_issues(stub):
+    stub.error = 500
+    assert yac.get_issues(stub.token) is None
+    stub.error = None
+    assert len(yac.get_issues(stub.token)) == 2
+
+
+def test_large_payload(stub):
+    stub.payload = 64 * 1024
+    issues = yac.get_user_issues(auth(stub))
+    assert len(issues) == 2
+    assert len(issues[0]['description']) == 64 * 1024
+
+
+def test_get_login_goes_through_breaker(stub, monkeypatch):
+    monkeypatch.setattr(yac, 'breaker', CircuitBreaker(min_calls=1))
+    assert run(yac.get_login_async(stub.token)) == 'stub-user'
+    stub.error = 503
+    assert run(yac.get_login_async(stub.token)) is None
+    # Ошибка открыла предохранитель: следующий вызов к трекеру не идет и сообщает паузу.
+    assert yac.tracker_backoff() is not None
+    stub.requests.clear()
+    assert run(yac.get_login_async(stub.token)) is None
+    assert stub.requests['/v2/myself'] == 0
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from config import token_cache_ttl, token_cache_size
+
+
+class TokenCache:
+    """
+    Кэш проверенных токенов трекера с ограничением по времени жизни и размеру (LRU).
+    Токены хранятся только в виде sha256-хэша.
+    """
+
+    def __init__(self, ttl: float = token_cache_ttl, maxsize: int = token_cache_size):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # Кэшем пользуются и основной loop бота, и поток синхронных оберток.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(str(token).encode('utf-8', 'surrogatepass')).digest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, token: str):
+        return self._key(token) in self._entries
+
+    def get(self, token: str) -> bool:
+        """
+        Возвращает True, если токен недавно был успешно проверен.
+        """
+        key = self._key(token)
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                self.misses += 1
+                return False
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True
+
+    def add(self, token: str):
+        """
+        Запоминает успешно проверенный токен, вытесняя самый давно использованный при переполнении.
+        """
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, token: str):
+        """
+        Удаляет токен из кэша, например после ответа 401/403. Следующий запрос проверит его заново.
+        """
+        with self._lock:
+            self._entries.pop(self._key(token), None)
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,139 @@
+import asyncio
+import ssl
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from loguru import logger
+
+from config import (webhook_url, webhook_path, webapp_host, webapp_port, webhook_ssl_cert, webhook_ssl_key,
+                    webhook_concurrency, webhook_drain_timeout, keep_pending_updates)
+
+
+class UpdateHandler:
+    """
+    Принимает обновления от Telegram и передает их диспетчеру.
+    Telegram получает ответ сразу, а обновление обрабатывается в отдельной задаче. Одновременно обрабатывается
+    не больше concurrency обновлений: следующий запрос ждет свободного места, и Telegram притормаживает отправку.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, concurrency: int = webhook_concurrency):
+        self.dispatcher = dispatcher
+        self.concurrency = concurrency
+        self.accepting = True
+        self.received = 0
+        self.failed = 0
+        self._semaphore = None
+        self._tasks = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.accepting:
+            return web.Response(status=503)
+        try:
+            update = types.Update(**await request.json())
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        await self._semaphore.acquire()
+        self.received += 1
+        # Обработчики и aiogram обращаются к текущим боту и диспетчеру через контекст.
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        task = asyncio.ensure_future(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            await self.dispatcher.process_update(update)
+        except Exception:
+            self.failed += 1
+            logger.exception(f"Ошибка при обработке обновления {update.update_id}")
+        finally:
+            self._semaphore.release()
+
+    async def drain(self, timeout: float = webhook_drain_timeout):
+        """
+        Перестает принимать обновления и ждет завершения уже начатых обработчиков.
+        Обработчики, не успевшие за timeout секунд, отменяются.
+        """
+        self.accepting = False
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        # Запросы, ждавшие свободного места, могут добавить задачи уже во время ожидания.
+        while self._tasks:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                logger.warning(f"Не дождались завершения обработчиков: {len(self._tasks)}")
+                for task in list(self._tasks):
+                    task.cancel()
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+                break
+            await asyncio.wait(list(self._tasks), timeout=remaining)
+
+
+def make_app(dispatcher: Dispatcher, on_startup=None, on_shutdown=None, url: str = webhook_url,
+             path: str = webhook_path, concurrency: int = webhook_concurrency,
+             drain_timeout: float = webhook_drain_timeout, keep_pending: bool = keep_pending_updates,
+             certificate: str = None) -> web.Application:
+    """
+    Создает aiohttp-приложение, принимающее обновления Telegram по адресу path.
+    on_startup и on_shutdown - корутины бота, принимающие диспетчер, как у executor.start_polling.
+    Если задан url, при запуске webhook регистрируется в Telegram по адресу url + path.
+    При остановке приложение дожидается обработчиков, затем вызывает on_shutdown и закрывает хранилище и сессию бота.
+    """
+    handler = UpdateHandler(dispatcher, concurrency)
+    app = web.Application()
+    app.router.add_post(path, handler.handle)
+
+    async def startup(app: web.Application):
+        if on_startup is not None:
+            await on_startup(dispatcher)
+        if url:
+            Bot.set_current(dispatcher.bot)
+            await dispatcher.bot.set_webhook(
+                url.rstrip('/') + path,
+                certificate=types.InputFile(certificate) if certificate else None,
+                max_connections=min(concurrency, 100),
+                drop_pending_updates=not keep_pending,
+            )
+            logger.info(f"Webhook зарегистрирован: {url.rstrip('/') + path}")
+
+    async def shutdown(app: web.Application):
+        # Webhook в Telegram не снимаем: обновления копятся там, пока бот выключен.
+        await handler.drain(drain_timeout)
+        if on_shutdown is not None:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await dispatcher.bot.session.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def run_webhook(dispatcher: Dispatcher, on_startup=None, on_shutdown=None, url: str = webhook_url,
+                path: str = webhook_path, host: str = webapp_host, port: int = webapp_port,
+                ssl_cert: str = webhook_ssl_cert, ssl_key: str = webhook_ssl_key,
+                concurrency: int = webhook_concurrency, drain_timeout: float = webhook_drain_timeout,
+                keep_pending: bool = keep_pending_updates):
+    """
+    Запускает бота в режиме webhook. Если заданы сертификат и ключ, TLS терминирует сам бот,
+    иначе ожидается, что перед ним стоит прокси.
+    """
+    if not url:
+        raise ValueError("Для режима webhook нужно задать WEBHOOK_URL")
+    ssl_context = None
+    if ssl_cert and ssl_key:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(ssl_cert, ssl_key)
+    app = make_app(dispatcher, on_startup, on_shutdown, url=url, path=path, concurrency=concurrency,
+                   drain_timeout=drain_timeout, keep_pending=keep_pending,
+                   certificate=ssl_cert if ssl_context else None)
+    web.run_app(app, host=host, port=port, ssl_context=ssl_context, shutdown_timeout=drain_timeout)
@@ -1,147 +1,556 @@
+import asyncio
+import atexit
+import json
+import threading
 from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import aiohttp
 from loguru import logger
-import requests
-from requests import exceptions
-from config import api_url, issue_filter, twenty_min_past, time_format, tz
 
+from admission import AdmissionController, request_class
+from circuit_breaker import CLOSED, CircuitBreaker, parse_retry_after
+from config import (api_url, issue_filter, issue_query, tz, http_pool_size, http_timeout,
+                    poll_interval, issues_per_page, hot_before, hot_window)
+from issue_cache import CacheEntry, IssueCache
+from issues import Issue, make_issue, parse_time
+from metrics import coalesced_calls, measure, timed, tracker_responses
+from query_builder import IssueFilter, compile_filter, compile_query
+from singleflight import SingleFlight
+from token_cache import TokenCache
 
-logger.add('logs.json', format='{time} {level} {message}',
-           level='INFO', rotation='50 KB', compression='zip', serialize=True)
 
+# Сессии aiohttp привязаны к event loop, поэтому храним по одной общей сессии на каждый loop:
+# основной loop бота и фоновый loop синхронных оберток.
+_sessions = {}
+# Фоновый event loop, в котором выполняются синхронные обертки.
+_sync_loop = None
+_sync_lock = threading.Lock()
+# Кэш проверенных токенов, чтобы не запрашивать myself перед каждым запросом задач.
+token_cache = TokenCache()
+# Кэш списков задач, общий для /status, ввода токена и опросов по подписке.
+issue_cache = IssueCache()
+# Предохранитель: пока трекер отвечает ошибками, запросы к нему не отправляются.
+breaker = CircuitBreaker()
+# Одновременные одинаковые запросы (например, /status во время опроса по подписке) ждут один общий ответ.
+flights = SingleFlight()
+# Общий бюджет запросов к трекеру с очередью по пользователям и приоритетом команд над опросами.
+admission = AdmissionController()
 
-@logger.catch
-def get_headers(token: str):
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую keep-alive сессию для текущего event loop с ограниченным пулом соединений.
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=http_pool_size, limit_per_host=http_pool_size)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=http_timeout))
+        _sessions[loop] = session
+    return session
+
+
+async def close_session():
+    """
+    Закрывает сессию текущего event loop. Вызывается при остановке бота.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def _run_sync(coro):
+    """
+    Выполняет корутину в фоновом event loop и возвращает результат. Используется синхронными обертками,
+    чтобы они переиспользовали тот же пул соединений между вызовами.
+    """
+    global _sync_loop
+    with _sync_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sync_loop.run_forever, name='tracker-sync', daemon=True).start()
+            atexit.register(_close_sync_loop)
+    return asyncio.run_coroutine_threadsafe(coro, _sync_loop).result()
+
+
+def _close_sync_loop():
+    """
+    Закрывает сессию фонового loop при завершении интерпретатора.
+    """
+    asyncio.run_coroutine_threadsafe(close_session(), _sync_loop).result()
+    _sync_loop.call_soon_threadsafe(_sync_loop.stop)
+
+
+def tracker_backoff():
+    """
+    Возвращает None, если трекер доступен, иначе - сколько секунд осталось до пробного запроса к нему.
+    """
+    if breaker.state == CLOSED:
+        return None
+    return breaker.retry_in()
+
+
+def _record_status(status, retry_after: str = None):
+    """
+    Передает предохранителю результат запроса. Ошибками трекера считаются сетевые ошибки, 429 и 5xx:
+    остальные ответы означают, что трекер работает.
+    """
+    if status == 'error' or status == 429 or status >= 500:
+        breaker.record_failure(parse_retry_after(retry_after))
+    else:
+        breaker.record_success()
+
+
+async def _coalesced(call: str, key, factory):
+    """
+    Выполняет запрос через flights и считает вызовы, которые дождались чужого запроса.
+    Запрос ждет допуска с классом первого вызова. Команда пользователя, дождавшаяся запроса фонового опроса,
+    поднимает его до своего класса, чтобы не ждать в очереди опросов.
+    """
+    def joined(flight):
+        coalesced_calls.inc(call=call)
+        admission.promote(flight, request_class.get())
+    return await flights.do(key, factory, on_join=joined)
+
+
+async def get_headers_async(token: str):
     """
     Функция принимает token пользователя и возвращает заголовок для дальнейшей работы с  api.
+    Одновременные проверки одного токена выполняются одним запросом.
     """
+    key = ('myself', token) if isinstance(token, str) else None
+    return await _coalesced('get_headers', key, lambda: _get_headers(token))
+
+
+async def _get_headers(token: str):
     # Подставляем полученный от юзера токен в заголовок авторизации.
     headers = {'Authorization': f'OAuth {token}'}
+    # Токен уже проверялся недавно - повторный запрос к myself не нужен.
+    if token_cache.get(token):
+        return headers
+    # Трекер недоступен: токен не проверяем. Закэшированные задачи хранятся по заголовку авторизации,
+    # поэтому с невалидным токеном все равно ничего не получить.
+    if breaker.state != CLOSED:
+        return headers
     # Делаем запрос к странице пользователя, чтобы проверить ответ
     try:
-        r = requests.get(api_url+'myself', headers=headers)
-    except UnicodeDecodeError:
+        await admission.acquire(headers['Authorization'])
+        with measure('get_headers'):
+            async with get_session().get(api_url + 'myself', headers=headers) as r:
+                status = r.status
+                retry_after = r.headers.get('Retry-After')
+    except UnicodeError:
         logger.warning("Токен не декодируется. Скорее всего использованы не латинские буквы")
         return None
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        tracker_responses.inc(call='get_headers', status='error')
+        _record_status('error')
+        logger.exception("Не удалось получить ответ от трекера")
+        return None
+    tracker_responses.inc(call='get_headers', status=status)
+    _record_status(status, retry_after)
     # Если ответ положительный, token указан правильно и мы можем с ним работать.
-    if r.status_code == 200:
+    if status == 200:
+        token_cache.add(token)
         return headers
     else:
-        logger.warning(f"Сервер вернул плохой статус код: {r.status_code}")
+        logger.warning(f"Сервер вернул плохой статус код: {status}")
         return None
 
 
-@logger.catch
-def get_user_issues(headers: dict):
+async def get_login_async(token: str):
+    """
+    Возвращает логин владельца токена или None, если токен невалиден или трекер недоступен
+    (тогда tracker_backoff() говорит, когда повторить).
+    """
+    headers = {'Authorization': f'OAuth {token}'}
+    if not breaker.allow():
+        return None
+    try:
+        await admission.acquire(headers['Authorization'])
+        with measure('get_login'):
+            async with get_session().get(api_url + 'myself', headers=headers) as r:
+                status = r.status
+                retry_after = r.headers.get('Retry-After')
+                user = await r.json(content_type=None) if status == 200 else None
+    except UnicodeError:
+        logger.warning("Токен не декодируется. Скорее всего использованы не латинские буквы")
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        tracker_responses.inc(call='get_login', status='error')
+        _record_status('error')
+        logger.exception("Не удалось получить ответ от трекера")
+        return None
+    tracker_responses.inc(call='get_login', status=status)
+    _record_status(status, retry_after)
+    if status != 200:
+        logger.warning(f"Сервер вернул плохой статус код: {status}")
+        return None
+    token_cache.add(token)
+    return user.get('login')
+
+
+def build_updated_filter(since: datetime, issue_filter: IssueFilter = None) -> str:
     """
-    Функция фильтрует задачи по юзеру и возвращает список задач.
+    Возвращает запрос задач пользователя, обновленных не раньше since.
+    issue_filter - фильтр подписки. По умолчанию используется issue_query из config.
     """
+    query = f'{compile_query(issue_filter) if issue_filter else issue_query} Updated: >= "{since.astimezone(tz):%Y-%m-%d %H:%M:%S}" "Sort by": Updated ASC'
+    return 'issues?query=' + quote(query)
+
 
+def build_changes_filter(queue: str, since: datetime) -> str:
+    """
+    Возвращает запрос задач очереди queue, измененных не раньше since, в порядке изменения.
+    Условий на исполнителя и статус нет: закрытые и переназначенные задачи тоже попадают в выдачу.
+    """
+    query = f'Queue: {queue} Updated: >= "{since.astimezone(tz):%Y-%m-%d %H:%M:%S}" "Sort by": Updated ASC'
+    return 'issues?query=' + quote(query)
+
+
+def paged(query: str, page: int, per_page: int = None) -> str:
+    """
+    Добавляет к запросу задач параметры постраничной выдачи трекера.
+    """
+    separator = '' if query.endswith(('&', '?')) else '&'
+    return f'{query}{separator}perPage={per_page or issues_per_page}&page={page}'
+
+
+async def load_user_issues(headers: dict, query: str = None, cache: bool = None):
+    """
+    Запрашивает задачи пользователя и возвращает CacheEntry. Запросы по issue_filter кэшируются:
+    свежая запись возвращается без обращения к трекеру, устаревшая перепроверяется условным запросом.
+    Если трекер недоступен или ответил ошибкой, возвращается закэшированная запись с пометкой stale.
+    query - запрос к api задач. По умолчанию используется issue_filter из config.
+    cache - использовать ли кэш. По умолчанию кэшируется только запрос без query.
+    Одновременные запросы с одинаковыми заголовками авторизации и адресом выполняются одним запросом к трекеру,
+    все вызовы получают одну и ту же запись.
+    """
+    url = api_url + (query or issue_filter)
+    if cache is None:
+        cache = query is None
+    try:
+        key = ('issues', headers['Authorization'], url, cache)
+    except (TypeError, KeyError, IndexError):
+        # Неправильные заголовки разбирает сам запрос.
+        key = None
+    return await _coalesced('get_user_issues', key, lambda: _load_user_issues(headers, url, cache))
+
+
+async def _load_user_issues(headers: dict, url: str, cache: bool):
+    key = entry = None
     # Осуществляем запрос к api.
     try:
-        res_issues = requests.get(api_url + issue_filter, headers=headers)
-    except AttributeError:
-        logger.exception("Неправильный формат. Адрес должен быть строкой! header - dict!")
+        request_headers = dict(headers)
+        if cache:
+            key = issue_cache.key(headers['Authorization'], url)
+            entry = issue_cache.get(key)
+            if entry is not None:
+                if entry.is_fresh():
+                    return entry
+                request_headers.update(entry.conditional_headers())
+        if not breaker.allow():
+            return _stale(entry)
+        # Ожидание своей очереди в бюджете запросов в замер обращения к трекеру не входит.
+        await admission.acquire(headers['Authorization'])
+        # Замеряется только обращение к трекеру: ответ из кэша не стоит ничего.
+        with measure('get_user_issues'):
+            async with get_session().get(url, headers=request_headers) as res_issues:
+                status = res_issues.status
+                retry_after = res_issues.headers.get('Retry-After')
+                if status == 200:
+                    body = await res_issues.read()
+                    etag = res_issues.headers.get('ETag')
+                    last_modified = res_issues.headers.get('Last-Modified')
+                    total_pages = res_issues.headers.get('X-Total-Pages')
+                elif status != 304:
+                    text = await res_issues.text()
+    except (AttributeError, TypeError, ValueError, KeyError):
+        logger.exception("Неправильный формат. Адрес должен быть строкой! header - dict со строковыми значениями!")
         return None
-    except exceptions.InvalidHeader:
-        logger.exception("Значение заголовка должно быть строкой!")
-        return None
-    if res_issues.status_code == 200:
-        # Переводим в формат json, чтобы легче было парсить
-        response_issues = res_issues.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        tracker_responses.inc(call='get_user_issues', status='error')
+        _record_status('error')
+        logger.exception("Не удалось получить ответ от трекера")
+        return _stale(entry)
+    tracker_responses.inc(call='get_user_issues', status=status)
+    _record_status(status, retry_after)
+    if status == 304 and entry is not None:
+        # Задачи не изменились: переиспользуем уже разобранный список.
+        issue_cache.revalidated(entry)
+        return entry
+    if status == 200:
         try:
+            # Переводим в формат json, чтобы легче было парсить
+            response_issues = json.loads(body)
             # Фильтруем поле sla и оставляем только ту информацию, которая сейчас активна.
             for issue in response_issues:
                 sla_filter = list(filter(lambda x: (x['clockStatus'] == 'STARTED'), issue['sla']))
                 issue['sla'] = sla_filter
-            return response_issues
+        except ValueError:
+            logger.exception("Яндекс вернул невалидный json")
+            return None
         except KeyError:
             logger.exception("Яндекс вернул json с невалидными ключами. Фмльтрация невозможна")
             return None
+        entry = CacheEntry(response_issues, etag, last_modified, len(body),
+                           int(total_pages) if total_pages and total_pages.isdigit() else None)
+        if key is not None:
+            issue_cache.store(key, entry)
+        return entry
     else:
-        logger.warning(f"Сервер вернул плохой статус код:{res_issues.status_code}")
-        logger.warning(res_issues.text)
+        logger.warning(f"Сервер вернул плохой статус код:{status}")
+        if status != 304:
+            logger.warning(text)
+        if status == 429 or status >= 500:
+            # Ошибка на стороне трекера: задачи пользователя не изменились, отдаем последние известные.
+            return _stale(entry)
+        if key is not None:
+            issue_cache.discard(key)
+        if status in (401, 403):
+            # Токен отозван или потерял доступ: убираем его из кэша, следующий запрос проверит его заново.
+            token_cache.discard(headers['Authorization'][len('OAuth '):])
         return None
 
 
+def _stale(entry):
+    """
+    Помечает закэшированную запись как устаревшую и возвращает ее. Без записи возвращает None.
+    """
+    if entry is not None:
+        entry.stale = True
+    return entry
+
+
+async def iter_issue_entries(headers: dict, query: str = None, cache: bool = None):
+    """
+    Асинхронный генератор: постранично запрашивает задачи и отдает CacheEntry каждой страницы,
+    чтобы в памяти одновременно была только одна страница. При ошибке последним элементом отдается None.
+    cache - кэшировать ли страницы. По умолчанию кэшируются только страницы запроса по issue_filter.
+    """
+    if cache is None:
+        cache = query is None
+    page = 1
+    while True:
+        entry = await load_user_issues(headers, paged(query or issue_filter, page), cache=cache)
+        yield entry
+        if entry is None:
+            return
+        # Без заголовка X-Total-Pages считаем страницу последней, если она заполнена не полностью.
+        if entry.total_pages is not None:
+            if page >= entry.total_pages:
+                return
+        elif len(entry.issues) < issues_per_page:
+            return
+        page += 1
+
+
+async def get_user_issues_async(headers: dict, query: str = None):
+    """
+    Функция фильтрует задачи по юзеру и возвращает список задач со всех страниц выдачи.
+    query - запрос к api задач. По умолчанию используется issue_filter из config.
+    """
+    issues = []
+    async for entry in iter_issue_entries(headers, query):
+        if entry is None:
+            return None
+        issues.extend(entry.issues)
+    return issues
+
+
+def parsed_issues(entry: CacheEntry) -> list:
+    """
+    Возвращает результат get_list_issues для записи кэша, разбирая задачи только при первом обращении.
+    """
+    if entry.parsed is None:
+        entry.parsed = get_list_issues(entry.issues)
+    return list(entry.parsed)
+
+
 @logger.catch
+def get_headers(token: str):
+    """
+    Синхронная обертка над get_headers_async.
+    """
+    return _run_sync(get_headers_async(token))
+
+
+@logger.catch
+def get_user_issues(headers: dict):
+    """
+    Синхронная обертка над get_user_issues_async.
+    """
+    return _run_sync(get_user_issues_async(headers))
+
+
+@logger.catch
+@timed('get_list_issues')
 def get_list_issues(list_of_issues: list):
     """
-    Функция принимает список из задача в формате json. После чего фильтрует его по нужным полям и возвращает
-    пользователю.
+    Функция принимает список из задача в формате json. Разбирает каждую задачу один раз в запись Issue
+    и возвращает список записей.
     """
-    # Пустой список в который будут помещаться отформатированные задачи
+    # Пустой список в который будут помещаться разобранные задачи
     issues_list = []
     for issue in list_of_issues:
         try:
-            issue_dict = {
-                            "issue": issue['summary'],
-                            "deadline": datetime.strptime(issue['sla'][0]['failAt'], time_format),
-                            "warnAt": datetime.strptime(issue['sla'][0]['warnAt'], time_format),
-                        }
-            issues_list.append(issue_dict)
+            issues_list.append(make_issue(issue))
         except ValueError:
             logger.exception("Невалидно значение одного из полей")
             pass
-        except KeyError:
+        except (KeyError, IndexError):
             logger.exception("Яндекс вернул json с невалидными ключами")
             pass
     return issues_list
 
 
+def is_recent(issue: Issue, period_start: datetime, now: datetime) -> bool:
+    """
+    Проверяет, что задача создана или обновлена за последний период опроса либо только что стала горящей.
+    Напоминание о горящей задаче приходит только в окне hot_window, чтобы не повторяться каждый опрос.
+    """
+    return ((issue.created_at is not None and issue.created_at >= period_start) or
+            (issue.updated_at is not None and issue.updated_at >= period_start) or
+            issue.in_hot_window(now))
+
+
+def latest_issues(issues: list) -> list:
+    """
+    Оставляет из разобранных задач только обновления за последний период опроса.
+    """
+    now = datetime.now(tz)
+    # Считаем границу при каждом вызове: значение, посчитанное при импорте, устаревает после первого периода.
+    period_start = now - timedelta(seconds=poll_interval)
+    return [issue for issue in issues if is_recent(issue, period_start, now)]
+
+
 @logger.catch
 def filter_issues_by_time(list_of_issues: list):
     """
-    Функция фильтрует задачи по юзеру и времени и возвращает обновления за последние 20 миинут.
+    Функция фильтрует задачи по юзеру и времени и возвращает обновления за последний период опроса.
     """
+    now = datetime.now(tz)
+    period_start = now - timedelta(seconds=poll_interval)
+    filtered_issues = []
     try:
         # Фильтруем свежесозданные и обновленные таски, а так же те, которые сгорят через 4 часа,
         # но не раньше 3.5 часов. Это нужно, чтобы в телеграм не приходили сообщения о горящих тасках
-        # каждые 20 минут.
-        filtered_issues = list(filter(
-            lambda x: (
-                datetime.strptime(x['createdAt'], time_format) >= twenty_min_past or
-                datetime.strptime(x['updatedAt'], time_format) >= twenty_min_past or
-                datetime.strptime(x['sla'][0]['failAt'], time_format) - timedelta(hours=4) <=
-                datetime.now(tz) <=
-                datetime.strptime(x['sla'][0]['failAt'], time_format) - timedelta(minutes=210)),
-            list_of_issues
-        ))
+        # каждые 20 минут. Каждое поле разбирается один раз.
+        for x in list_of_issues:
+            if (parse_time(x['createdAt']) >= period_start or parse_time(x['updatedAt']) >= period_start):
+                filtered_issues.append(x)
+                continue
+            hot_at = parse_time(x['sla'][0]['failAt']) - hot_before
+            if hot_at <= now <= hot_at + hot_window:
+                filtered_issues.append(x)
     except KeyError:
         logger.exception("Яндекс вернул json с невалидными ключами. Фмльтрация невозможна")
         filtered_issues = []
     return filtered_issues
 
 
-def get_issues(token: str):
+def _page_issues(entry: CacheEntry, latest: bool) -> list:
+    issues = parsed_issues(entry)
+    # Фильтр обновлений работает с уже разобранными (и закэшированными) записями.
+    return latest_issues(issues) if latest else issues
+
+
+async def _issue_pages(first: CacheEntry, entries, latest: bool):
+    yield _page_issues(first, latest)
+    async for entry in entries:
+        if entry is None:
+            logger.info("От сервера вернулся плохой ответ. Остальные страницы задач не получены")
+            return
+        yield _page_issues(entry, latest)
+
+
+async def get_issue_pages_async(token: str, latest: bool = False, issue_filter: IssueFilter = None):
     """
-    Общая функция, получающая токен и возвращающая список всех задач этого юзера.
+    Возвращает асинхронный итератор по страницам задач пользователя в формате get_list_issues
+    или None, если токен невалиден или трекер не отдал первую страницу.
+    latest - оставлять на каждой странице только обновления за последний период опроса.
+    issue_filter - фильтр подписки. Строки запросов нормализованных фильтров совпадают, поэтому одинаковые
+    фильтры делят записи кэша и объединяются в один запрос. По умолчанию используется issue_filter из config.
     """
-    headers = get_headers(token)
-    # Проверка, что юзер был найден. Если в системе нет такого email адреса, возвращает None.
+    headers = await get_headers_async(token)
     if headers is None:
         logger.info("Функция get_header вернула None. Похоже передали невалидный токен")
         return None
-    issues_list = get_user_issues(headers)
-    if issues_list is None:
+    entries = iter_issue_entries(headers, compile_filter(issue_filter) if issue_filter else None, cache=True)
+    first = await entries.__anext__()
+    if first is None:
         logger.info("От сервера вернулся плохой ответ. Возможны проблемы на сервере")
         return None
-    issues = get_list_issues(issues_list)
+    return _issue_pages(first, entries, latest)
+
+
+async def get_issues_async(token: str, issue_filter: IssueFilter = None):
+    """
+    Общая функция, получающая токен и возвращающая список всех задач этого юзера.
+    """
+    pages = await get_issue_pages_async(token, issue_filter=issue_filter)
+    if pages is None:
+        return None
+    issues = []
+    async for page in pages:
+        issues.extend(page)
     return issues
 
 
-def get_latest_issues(token: str):
+async def get_latest_issues_async(token: str, issue_filter: IssueFilter = None):
     """
     Общая функция, получающая email и возвращающая список новых задач за последние 20 минут.
     """
-    headers = get_headers(token)
-    # Проверка, что юзер был найден. Если в системе нет такого email адреса, возвращает None.
+    pages = await get_issue_pages_async(token, latest=True, issue_filter=issue_filter)
+    if pages is None:
+        return None
+    issues = []
+    async for page in pages:
+        issues.extend(page)
+    return issues
+
+
+async def get_updated_issues_async(token: str, since: datetime, issue_filter: IssueFilter = None):
+    """
+    Инкрементальный опрос: возвращает задачи, обновленные позже since, и новую отметку времени
+    последнего обновления. Отметку нужно сохранять только после того, как задачи доставлены пользователю.
+    Без since возвращаются все открытые задачи.
+    """
+    headers = await get_headers_async(token)
     if headers is None:
         logger.info("Функция get_header вернула None. Похоже передали невалидный токен")
         return None
-    issues_list = get_user_issues(headers)
+    if since:
+        query = build_updated_filter(since, issue_filter)
+    else:
+        query = compile_filter(issue_filter) if issue_filter else None
+    issues_list = await get_user_issues_async(headers, query)
     if issues_list is None:
         logger.info("От сервера вернулся плохой ответ. Возможны проблемы на сервере")
         return None
-    filtered_issues = filter_issues_by_time(issues_list)
-    issues = get_list_issues(filtered_issues)
-    return issues
+    updated_issues = []
+    watermark = since
+    for issue in get_list_issues(issues_list):
+        if issue.updated_at is None:
+            logger.warning(f"Яндекс вернул задачу {issue.key} без поля updatedAt")
+            continue
+        # Трекер фильтрует с точностью до секунды, поэтому уже доставленные задачи отсекаем здесь.
+        if since is None or issue.updated_at > since:
+            updated_issues.append(issue)
+            watermark = issue.updated_at if watermark is None else max(watermark, issue.updated_at)
+    return updated_issues, watermark
+
+
+def get_issues(token: str):
+    """
+    Синхронная обертка над get_issues_async.
+    """
+    return _run_sync(get_issues_async(token))
+
+
+def get_latest_issues(token: str):
+    """
+    Синхронная обертка над get_latest_issues_async.
+    """
+    return _run_sync(get_latest_issues_async(token))